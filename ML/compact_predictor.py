@@ -0,0 +1,173 @@
+"""Compact, quantized tree-ensemble predictor for low-memory serving.
+
+``CompactForest.from_sklearn(model, scaler)`` stores a fitted DecisionTree,
+RandomForest or ExtraTrees classifier (scaler folded in, as in
+``fused_predictor``) in small fixed-width arrays:
+
+* ``feature`` (uint8) and ``threshold`` (float32, raw feature units) per node;
+* ``children`` (uint16 when every tree has fewer than 65536 nodes) holding
+  node numbers local to each tree, with ``roots`` giving each tree's offset;
+* ``leaf`` per node, pointing into ``leaf_value``: each distinct leaf class
+  distribution stored once, quantized to uint16 (1/65535 steps). Pure
+  leaves, the bulk of a random forest, share a handful of rows.
+
+``max_trees`` keeps the first trees of the forest (they are independent, so
+this only adds variance) and ``max_depth`` turns deeper subtrees into leaves
+carrying their node's class distribution. ``python crop_prediction.py
+compress`` builds one from the saved model and reports its accuracy, size
+and latency next to the original artifacts. The arrays are saved as a
+compressed ``.npz`` and loaded without pickle or sklearn.
+"""
+import numpy as np
+
+from fused_predictor import BLOCK_SIZE, _scaler_params
+
+QUANT_SCALE = 65535
+
+
+def _smallest_uint(max_value):
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.uint64
+
+
+def _truncated_nodes(tree, max_depth):
+    """Return the node ids kept when ``tree`` is cut at ``max_depth``, in their original order."""
+    t = tree.tree_
+    depth = np.zeros(t.node_count, dtype=np.int64)
+    keep = np.zeros(t.node_count, dtype=bool)
+    keep[0] = True
+    # sklearn numbers nodes depth-first, so a parent always comes before its children
+    for node in range(t.node_count):
+        if not keep[node] or t.children_left[node] == -1 or (max_depth is not None and depth[node] >= max_depth):
+            continue
+        for child in (t.children_left[node], t.children_right[node]):
+            keep[child] = True
+            depth[child] = depth[node] + 1
+    return np.flatnonzero(keep), int(depth[keep].max())
+
+
+class CompactForest:
+    """Quantized forest with ``predict_proba``/``predict``/``predict_topk`` like ``FusedPredictor``."""
+
+    def __init__(self, classes, arrays):
+        self.classes_ = np.asarray(classes).astype(str)
+        self.arrays = arrays
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self.depth = int(self.depth)
+        self.n_trees = len(self.roots)
+
+    @classmethod
+    def from_sklearn(cls, model, scaler=None, max_trees=None, max_depth=None):
+        """Quantize a fitted tree classifier; raises ``ValueError`` for other model types."""
+        from sklearn.ensemble import ExtraTreesClassifier, RandomForestClassifier
+        from sklearn.tree import DecisionTreeClassifier
+
+        if isinstance(model, DecisionTreeClassifier):
+            trees = [model]
+        elif isinstance(model, (RandomForestClassifier, ExtraTreesClassifier)):
+            trees = list(model.estimators_[:max_trees] if max_trees else model.estimators_)
+        else:
+            raise ValueError(f"{type(model).__name__} is not a tree classifier; only DecisionTree, "
+                             "RandomForest and ExtraTrees models can be compressed.")
+        mean, scale = _scaler_params(scaler, model.n_features_in_)
+
+        features, thresholds, children, leaves, distributions, roots = [], [], [], [], [], []
+        offset = depth = max_tree_nodes = 0
+        for tree in trees:
+            t = tree.tree_
+            kept, tree_depth = _truncated_nodes(tree, max_depth)
+            local = np.full(t.node_count, -1, dtype=np.int64)
+            local[kept] = np.arange(len(kept))
+            is_leaf = (t.children_left[kept] == -1) | (local[np.maximum(t.children_left[kept], 0)] == -1)
+            own = np.arange(len(kept))
+            feature = np.where(is_leaf, 0, t.feature[kept])
+            threshold = np.where(is_leaf, np.inf, t.threshold[kept] * scale[feature] + mean[feature])
+            left = np.where(is_leaf, own, local[np.maximum(t.children_left[kept], 0)])
+            right = np.where(is_leaf, own, local[np.maximum(t.children_right[kept], 0)])
+
+            value = t.value[kept, 0, :]
+            value = value / value.sum(axis=1, keepdims=True)
+            features.append(feature)
+            thresholds.append(threshold)
+            children.append(np.stack([left, right], axis=1))
+            leaves.append(is_leaf)
+            distributions.append(value)
+            roots.append(offset)
+            offset += len(kept)
+            depth = max(depth, tree_depth)
+            max_tree_nodes = max(max_tree_nodes, len(kept))
+
+        is_leaf = np.concatenate(leaves)
+        # Quantize so each row still sums to QUANT_SCALE: floor, then hand the remainder to the largest shares
+        value = np.concatenate(distributions)[is_leaf] * QUANT_SCALE
+        quantized = np.floor(value)
+        shortfall = (QUANT_SCALE - quantized.sum(axis=1)).astype(np.int64)
+        order = np.argsort(-(value - quantized), axis=1)
+        for row in np.flatnonzero(shortfall):
+            quantized[row, order[row, :shortfall[row]]] += 1
+        leaf_value, inverse = np.unique(quantized.astype(np.uint16), axis=0, return_inverse=True)
+
+        leaf = np.zeros(offset, dtype=np.int64)
+        leaf[is_leaf] = inverse.ravel()
+        arrays = {
+            'feature': np.concatenate(features).astype(_smallest_uint(model.n_features_in_ - 1)),
+            'threshold': np.concatenate(thresholds).astype(np.float32),
+            'children': np.concatenate(children).astype(_smallest_uint(max_tree_nodes - 1)),
+            'leaf': leaf.astype(_smallest_uint(len(leaf_value) - 1)),
+            'leaf_value': leaf_value,
+            'roots': np.asarray(roots, dtype=np.int64),
+            'depth': np.asarray(depth),
+        }
+        return cls(model.classes_, arrays)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def save(self, path):
+        np.savez_compressed(path, classes=self.classes_, **self.arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            arrays = {name: data[name] for name in data.files}
+        classes = arrays.pop('classes')
+        return cls(classes, arrays)
+
+    def _apply(self, X):
+        """Return the (global) node reached in every tree, shape ``(n_rows, n_trees)``."""
+        n_rows, n_features = X.shape
+        flat_X = X.ravel()
+        row_offsets = (np.arange(n_rows) * n_features)[:, None]
+        flat_children = self.children.ravel()
+        nodes = np.repeat(self.roots[None, :], n_rows, axis=0)
+        for _ in range(self.depth):
+            go_right = flat_X[row_offsets + self.feature[nodes]] > self.threshold[nodes]
+            nodes = flat_children[2 * nodes + go_right] + self.roots
+        return nodes
+
+    def _proba(self, X):
+        votes = self.leaf_value[self.leaf[self._apply(X)]].sum(axis=1, dtype=np.float64)
+        return votes / (QUANT_SCALE * self.n_trees)
+
+    def predict_proba(self, X):
+        # Thresholds are float32, so compare in float32 (as sklearn's own tree code does)
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        if len(X) <= BLOCK_SIZE:
+            return self._proba(X)
+        return np.concatenate([self._proba(X[i:i + BLOCK_SIZE]) for i in range(0, len(X), BLOCK_SIZE)])
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+    def predict_topk(self, X, k):
+        """Return ``(labels, probabilities)`` of shape ``(n_rows, k)``, best first."""
+        probabilities = self.predict_proba(X)
+        k = max(1, min(k, probabilities.shape[1]))
+        top = np.argsort(-probabilities, axis=1, kind='stable')[:, :k]
+        return self.classes_[top], np.take_along_axis(probabilities, top, axis=1)
@@ -1,8 +1,19 @@
-import pandas as pd
+"""Train, evaluate and explore the crop recommendation model.
+
+    python crop_prediction.py train [--n-jobs -1] [--search]   # headless, no plotting imports
+    python crop_prediction.py train-stream --data big.csv      # out-of-core, chunk by chunk
+    python crop_prediction.py evaluate [--plots]               # score the saved artifacts
+    python crop_prediction.py compress [--max-trees 50]        # quantized copy for low-memory serving
+    python crop_prediction.py retrain [--add-trees 20]         # update the saved model with new feedback
+    python crop_prediction.py eda                              # dataset summaries and plots
+    python crop_prediction.py                                  # eda + train + evaluate --plots
+
+The dataset is parsed once and cached as a typed ``.npz`` next to the source
+file (float32 features, int16 label codes); later runs load the cache unless
+the source file has changed.
+"""
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import GridSearchCV, train_test_split
 from sklearn.preprocessing import StandardScaler
 from sklearn.linear_model import LogisticRegression
 from sklearn.tree import DecisionTreeClassifier
@@ -10,152 +21,781 @@ from sklearn.svm import SVC
 from sklearn.neighbors import KNeighborsClassifier
 from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
 from sklearn.metrics import accuracy_score, confusion_matrix, f1_score, classification_report
+import argparse
+import io
+import json
 import os
+import resource
+import time
+import tracemalloc
 import joblib
+from compact_predictor import CompactForest
+from feedback_log import FeedbackLog
+from fused_predictor import FusedPredictor
+from model_artifacts import (
+    COMPACT_MODEL_FILENAME, COMPACT_REPORT_FILENAME, FEEDBACK_DIRNAME, FUSED_MODEL_FILENAME, METADATA_FILENAME,
+    MODEL_FILENAME, SCALER_FILENAME, atomic_write, write_version_file,
+)
+from selection import OBJECTIVES, measure_serving_cost, pareto_front, select_model
+from stream_training import CHUNK_SIZE, MAX_HOLDOUT_ROWS, HoldoutSample, StratifiedHoldout, build_stream_models, read_chunks
 
-# Ensure the output directory for plots exists
+# Directory for plots (relative to where the script is run from)
 output_dir = 'ML_plots'
-os.makedirs(output_dir, exist_ok=True)
-
-# Load the dataset
 file_path = os.path.join(os.path.dirname(__file__), "Crop_recommendation.xls")
-try:
-    # First, try to read as CSV
-    df = pd.read_csv(file_path)
-    print("Read as CSV successfully.")
-except Exception as e_csv:
-    print(f"Could not read as CSV: {e_csv}. Trying to read as Excel (xls) with xlrd...")
+model_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Hyperparameter grids used by --search, one per candidate model
+PARAM_GRIDS = {
+    'Logistic Regression': {'C': [0.1, 1.0, 10.0]},
+    'Decision Tree': {'max_depth': [None, 10, 20], 'min_samples_leaf': [1, 2, 5]},
+    'Support Vector Machine': {'C': [1.0, 10.0, 100.0], 'gamma': ['scale', 0.1]},
+    'K-Nearest Neighbors': {'n_neighbors': [3, 5, 7, 9], 'weights': ['uniform', 'distance']},
+    'Random Forest': {'n_estimators': [100, 200], 'max_depth': [None, 20], 'min_samples_leaf': [1, 2]},
+    'Gradient Boosting': {'n_estimators': [100, 200], 'learning_rate': [0.05, 0.1]},
+}
+
+# Every artifact a published version may contain
+ARTIFACT_FILENAMES = [MODEL_FILENAME, SCALER_FILENAME, FUSED_MODEL_FILENAME, METADATA_FILENAME, COMPACT_MODEL_FILENAME]
+
+
+def read_dataset_file(file_path):
+    """Parse the raw dataset with pandas (CSV first, then xls)."""
+    import pandas as pd
+
+    try:
+        # First, try to read as CSV
+        df = pd.read_csv(file_path)
+        print("Read as CSV successfully.")
+    except Exception as e_csv:
+        print(f"Could not read as CSV: {e_csv}. Trying to read as Excel (xls) with xlrd...")
+        try:
+            df = pd.read_excel(file_path, engine='xlrd')
+            print("Read as Excel (xls) successfully.")
+        except FileNotFoundError:
+            print(f"Error: '{file_path}' not found. Please ensure the file exists.")
+            exit()
+        except Exception as e_excel:
+            print(f"Error reading '{file_path}' as Excel: {e_excel}")
+            print("Please ensure the file is a valid .xls or .csv file and xlrd is installed if it's an .xls file.")
+            exit()
+    return df
+
+
+def dataset_cache_path(file_path):
+    return os.path.splitext(file_path)[0] + '.cache.npz'
+
+
+def load_dataset(file_path, use_cache=True):
+    """Return ``(X, y, feature_names)`` with float32 features and string labels.
+
+    Reads the typed cache when it was built from the current source file,
+    otherwise parses the source once and (re)writes the cache.
+    """
+    cache_path = dataset_cache_path(file_path)
     try:
-        df = pd.read_excel(file_path, engine='xlrd')
-        print("Read as Excel (xls) successfully.")
+        source = os.stat(file_path)
     except FileNotFoundError:
         print(f"Error: '{file_path}' not found. Please ensure the file exists.")
         exit()
-    except Exception as e_excel:
-        print(f"Error reading '{file_path}' as Excel: {e_excel}")
-        print("Please ensure the file is a valid .xls or .csv file and xlrd is installed if it's an .xls file.")
-        exit()
 
-print("Dataset loaded successfully.")
-print("Dataset head:")
-print(df.head())
-print("\nDataset Info:")
-df.info()
-print("\nDataset Description:")
-print(df.describe())
-
-# --- EDA and Visualization ---
-
-# 1. Histograms for numerical features
-print("\nGenerating histograms...")
-df.hist(bins=15, figsize=(15, 10))
-plt.suptitle('Distribution of Numerical Features')
-plt.tight_layout(rect=[0, 0.03, 1, 0.95])
-plt.savefig(os.path.join(output_dir, 'numerical_feature_histograms.png'))
-plt.close()
-print("Histograms saved to 'ML_plots/numerical_feature_histograms.png'")
-
-# 2. Correlation Matrix Heatmap
-print("\nGenerating correlation heatmap...")
-plt.figure(figsize=(12, 10))
-sns.heatmap(df.corr(numeric_only=True), annot=True, cmap='coolwarm', fmt=".2f")
-plt.title('Correlation Matrix of Features')
-plt.savefig(os.path.join(output_dir, 'correlation_heatmap.png'))
-plt.close()
-print("Correlation heatmap saved to 'ML_plots/correlation_heatmap.png'")
-
-# 3. Target variable distribution
-print("\nGenerating target variable distribution plot...")
-plt.figure(figsize=(12, 6))
-sns.countplot(data=df, y='label')
-plt.title('Distribution of label Types')
-plt.savefig(os.path.join(output_dir, 'crop_distribution.png'))
-plt.close()
-print("Crop distribution plot saved to 'ML_plots/crop_distribution.png'")
-
-# --- Machine Learning Models ---
-
-# Separate features and target variable
-X = df.drop('label', axis=1)
-y = df['label']
-
-# Split the dataset into training and testing sets
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
-
-print(f"\nTraining data shape: {X_train.shape}")
-print(f"Testing data shape: {X_test.shape}")
-
-# Scale numerical features
-scaler = StandardScaler()
-X_train_scaled = scaler.fit_transform(X_train)
-X_test_scaled = scaler.transform(X_test)
-
-# Initialize models
-models = {
-    'Logistic Regression': LogisticRegression(max_iter=1000, random_state=42),
-    'Decision Tree': DecisionTreeClassifier(random_state=42),
-    'Support Vector Machine': SVC(random_state=42),
-    'K-Nearest Neighbors': KNeighborsClassifier(),
-    'Random Forest': RandomForestClassifier(random_state=42),
-    'Gradient Boosting': GradientBoostingClassifier(random_state=42)
-}
+    if use_cache and os.path.exists(cache_path):
+        with np.load(cache_path, allow_pickle=False) as data:
+            if int(data['source_mtime_ns']) == source.st_mtime_ns and int(data['source_size']) == source.st_size:
+                X = data['features']
+                y = data['label_names'][data['label_codes']]
+                feature_names = data['feature_names'].tolist()
+                print(f"Loaded {X.shape[0]} rows from dataset cache '{cache_path}'.")
+                return X, y, feature_names
+
+    df = read_dataset_file(file_path)
+    feature_names = [column for column in df.columns if column != 'label']
+    X = df[feature_names].to_numpy(dtype=np.float32)
+    label_names, label_codes = np.unique(df['label'].to_numpy(dtype=str), return_inverse=True)
+    y = label_names[label_codes]
+
+    if use_cache:
+        atomic_write(cache_path, lambda f: np.savez(
+            f,
+            features=X,
+            label_codes=label_codes.astype(np.int16),
+            label_names=label_names,
+            feature_names=np.asarray(feature_names),
+            source_mtime_ns=np.int64(source.st_mtime_ns),
+            source_size=np.int64(source.st_size),
+        ))
+        print(f"Dataset cache written to '{cache_path}'.")
+    return X, y, feature_names
+
+
+def dataset_frame(X, y, feature_names):
+    import pandas as pd
+
+    df = pd.DataFrame(X, columns=feature_names)
+    df['label'] = y
+    return df
+
+
+def split_dataset(X, y):
+    # Fixed seed and stratification so train and evaluate see the same hold-out rows
+    return train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
+
+
+def run_eda(df):
+    # Plotting libraries are only imported by the eda/evaluate --plots paths
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    print("Dataset head:")
+    print(df.head())
+    print("\nDataset Info:")
+    df.info()
+    print("\nDataset Description:")
+    print(df.describe())
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    # 1. Histograms for numerical features
+    print("\nGenerating histograms...")
+    df.hist(bins=15, figsize=(15, 10))
+    plt.suptitle('Distribution of Numerical Features')
+    plt.tight_layout(rect=[0, 0.03, 1, 0.95])
+    plt.savefig(os.path.join(output_dir, 'numerical_feature_histograms.png'))
+    plt.close()
+    print("Histograms saved to 'ML_plots/numerical_feature_histograms.png'")
+
+    # 2. Correlation Matrix Heatmap
+    print("\nGenerating correlation heatmap...")
+    plt.figure(figsize=(12, 10))
+    sns.heatmap(df.corr(numeric_only=True), annot=True, cmap='coolwarm', fmt=".2f")
+    plt.title('Correlation Matrix of Features')
+    plt.savefig(os.path.join(output_dir, 'correlation_heatmap.png'))
+    plt.close()
+    print("Correlation heatmap saved to 'ML_plots/correlation_heatmap.png'")
+
+    # 3. Target variable distribution
+    print("\nGenerating target variable distribution plot...")
+    plt.figure(figsize=(12, 6))
+    sns.countplot(data=df, y='label')
+    plt.title('Distribution of label Types')
+    plt.savefig(os.path.join(output_dir, 'crop_distribution.png'))
+    plt.close()
+    print("Crop distribution plot saved to 'ML_plots/crop_distribution.png'")
+
+
+def build_models(n_jobs=None):
+    # n_jobs only applies to estimators that parallelise internally
+    return {
+        'Logistic Regression': LogisticRegression(max_iter=1000, random_state=42),
+        'Decision Tree': DecisionTreeClassifier(random_state=42),
+        'Support Vector Machine': SVC(random_state=42),
+        'K-Nearest Neighbors': KNeighborsClassifier(n_jobs=n_jobs),
+        'Random Forest': RandomForestClassifier(random_state=42, n_jobs=n_jobs),
+        'Gradient Boosting': GradientBoostingClassifier(random_state=42)
+    }
+
+
+def fit_candidate(name, model, X_train, y_train, X_test, y_test, param_grid=None, cv=5, search_n_jobs=1):
+    """Fit (or, given ``param_grid``, grid-search) one candidate and score it on the test split.
+
+    Runs unchanged in the main process or in a joblib worker. Peak memory is the
+    tracemalloc peak of the fitting process, which covers NumPy buffers.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    best_params = None
+    if param_grid:
+        grid = GridSearchCV(model, param_grid, cv=cv, scoring='f1_weighted', n_jobs=search_n_jobs)
+        grid.fit(X_train, y_train)
+        model = grid.best_estimator_
+        best_params = grid.best_params_
+    else:
+        model.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    y_pred = model.predict(X_test)
+    return name, {
+        'accuracy': accuracy_score(y_test, y_pred),
+        'f1_score': f1_score(y_test, y_pred, average='weighted'),
+        'model': model,
+        'fit_seconds': fit_seconds,
+        'peak_memory_mb': peak_bytes / 2**20,
+        'best_params': best_params,
+    }
+
+
+def train_models(X_train, y_train, X_test, y_test, n_jobs=1, search=False, cv=5):
+    """Train every candidate, concurrently when ``n_jobs`` allows it."""
+    total_jobs = joblib.cpu_count() if n_jobs == -1 else max(1, n_jobs)
+    # Candidates run side by side; cores left over go to each candidate's own parallelism
+    outer_jobs = min(total_jobs, len(PARAM_GRIDS))
+    inner_jobs = max(1, total_jobs // outer_jobs)
+    models = build_models(n_jobs=inner_jobs)
+
+    start = time.perf_counter()
+    if outer_jobs == 1:
+        outputs = []
+        for name, model in models.items():
+            print(f"\nTraining {name}...")
+            param_grid = PARAM_GRIDS[name] if search else None
+            outputs.append(fit_candidate(name, model, X_train, y_train, X_test, y_test, param_grid, cv, inner_jobs))
+    else:
+        print(f"\nTraining {len(models)} models on {outer_jobs} workers ({inner_jobs} job(s) each)...")
+        outputs = joblib.Parallel(n_jobs=outer_jobs)(
+            joblib.delayed(fit_candidate)(name, model, X_train, y_train, X_test, y_test,
+                                          PARAM_GRIDS[name] if search else None, cv, inner_jobs)
+            for name, model in models.items()
+        )
+    print(f"Trained all models in {time.perf_counter() - start:.1f}s wall-clock")
+
+    results = dict(outputs)
+    for name, metrics in results.items():
+        print(f"{name} - Accuracy: {metrics['accuracy']:.4f}, F1 Score: {metrics['f1_score']:.4f}")
+        if metrics['best_params'] is not None:
+            print(f"    best parameters: {metrics['best_params']}")
+    return results
+
+
+def export_fused_predictor(best_model_name, best_model, scaler, X_test, X_test_scaled, output_dir):
+    # Export the scaler folded into the best model as flat NumPy arrays for low-latency serving
+    fused_filename = os.path.join(output_dir, FUSED_MODEL_FILENAME)
+    try:
+        fused_model = FusedPredictor.from_sklearn(best_model, scaler)
+    except ValueError as e:
+        print(f"Skipping fused predictor export: {e}")
+        # Never leave a previous model's fused artifact next to the new model
+        if os.path.exists(fused_filename):
+            os.remove(fused_filename)
+        return
+
+    atomic_write(fused_filename, fused_model.save)
+    X_test_raw = np.asarray(X_test, dtype=float)
+    agreement = np.mean(fused_model.predict(X_test_raw) == best_model.predict(X_test_scaled))
+    max_diff = np.abs(fused_model.predict_proba(X_test_raw) - best_model.predict_proba(X_test_scaled)).max()
+    timings = []
+    for row in X_test_raw[:1000]:
+        start = time.perf_counter()
+        fused_model.predict_topk(row, 4)
+        timings.append(time.perf_counter() - start)
+    print(f"Fused predictor saved as '{fused_filename}'")
+    print(f"Fused predictor agreement with {best_model_name}: {agreement:.4f} (max probability difference {max_diff:.4f})")
+    print(f"Fused predictor single-row top-4 latency: p50 = {np.median(timings) * 1e6:.1f} us, p99 = {np.percentile(timings, 99) * 1e6:.1f} us")
+
+
+def publish_best_model(results, scaler, X_test, X_test_scaled, output_dir, objective='f1', f1_tolerance=0.0,
+                       max_latency_us=None, max_size_mb=None):
+    """Pick a candidate by ``objective`` and save it with its scaler, fused predictor and metadata, then publish a new version."""
+    print("\n--- Measuring Serving Cost ---")
+    for name, metrics in results.items():
+        metrics.update(measure_serving_cost(metrics['model'], scaler, X_test))
+
+    best_model_name, reason = select_model(results, objective, f1_tolerance, max_latency_us, max_size_mb)
+    front = pareto_front(results)
+
+    print("\n--- Model Comparison ---")
+    for name, metrics in results.items():
+        print(f"{name}: Accuracy = {metrics['accuracy']:.4f}, F1 Score = {metrics['f1_score']:.4f}, "
+              f"Fit time = {metrics['fit_seconds']:.2f}s, Peak memory = {metrics['peak_memory_mb']:.1f} MB")
+        print(f"    serving: single row p50 = {metrics['single_row_p50_us']:.1f} us, p99 = {metrics['single_row_p99_us']:.1f} us"
+              f"{' (fused)' if metrics['fused'] else ''}, batched = {metrics['batch_us_per_row']:.2f} us/row, "
+              f"size = {metrics['artifact_bytes'] / 2**20:.2f} MB{', Pareto-optimal' if name in front else ''}")
+
+    print(f"\nSelected model: {best_model_name} with F1 Score: {results[best_model_name]['f1_score']:.4f} ({reason})")
+
+    # Save the best model
+    os.makedirs(output_dir, exist_ok=True)
+    best_model = results[best_model_name]['model']
+    # Training parallelism should not carry over into single-request serving
+    if 'n_jobs' in best_model.get_params():
+        best_model.set_params(n_jobs=None)
+    # Artifacts are replaced atomically so a running web app never loads a half-written file
+    model_filename = os.path.join(output_dir, MODEL_FILENAME)
+    atomic_write(model_filename, lambda f: joblib.dump(best_model, f))
+    print(f"Best model saved as '{model_filename}'")
+
+    # Save the scaler as well, as it's needed for new predictions
+    scaler_filename = os.path.join(output_dir, SCALER_FILENAME)
+    atomic_write(scaler_filename, lambda f: joblib.dump(scaler, f))
+    print(f"Scaler saved as '{scaler_filename}'")
+
+    export_fused_predictor(best_model_name, best_model, scaler, X_test, X_test_scaled, output_dir)
+    # A compact artifact describes the previous model; rebuild it with the compress subcommand
+    for filename in (COMPACT_MODEL_FILENAME, COMPACT_REPORT_FILENAME):
+        if os.path.exists(os.path.join(output_dir, filename)):
+            os.remove(os.path.join(output_dir, filename))
+
+    # Why this model was chosen, and what the alternatives would have cost to serve
+    metadata = {
+        'selected_model': best_model_name,
+        'objective': objective,
+        'reason': reason,
+        'f1_tolerance': f1_tolerance,
+        'max_latency_us': max_latency_us,
+        'max_size_mb': max_size_mb,
+        'pareto_front': front,
+        'candidates': {
+            name: {key: value for key, value in metrics.items() if key != 'model'}
+            for name, metrics in results.items()
+        },
+    }
+    metadata_filename = os.path.join(output_dir, METADATA_FILENAME)
+    atomic_write(metadata_filename, lambda f: f.write(json.dumps(metadata, indent=2, default=str).encode()))
+    print(f"Selection metadata saved as '{metadata_filename}'")
+
+    # Publish the new version last; a running web app hot-reloads once this file changes
+    version = write_version_file(output_dir, ARTIFACT_FILENAMES)
+    print(f"Model version {version} published")
+
+
+def serving_report(predict_proba, classes, X_raw, y_test, reference_proba, artifact_bytes, in_memory_bytes):
+    """Accuracy, agreement with the original model, size and latency of one way of serving the model."""
+    proba = predict_proba(X_raw)
+    y_pred = classes[proba.argmax(axis=1)]
+    timings = []
+    for row in X_raw[np.arange(1000) % len(X_raw)]:
+        start = time.perf_counter()
+        predict_proba(row[None, :])
+        timings.append(time.perf_counter() - start)
+    batch = X_raw[np.arange(10000) % len(X_raw)]
+    start = time.perf_counter()
+    predict_proba(batch)
+    batch_seconds = time.perf_counter() - start
+    return {
+        'accuracy': float(accuracy_score(y_test, y_pred)),
+        'f1_score': float(f1_score(y_test, y_pred, average='weighted')),
+        'agreement': float(np.mean(proba.argmax(axis=1) == reference_proba.argmax(axis=1))),
+        'max_probability_difference': float(np.abs(proba - reference_proba).max()),
+        'artifact_bytes': artifact_bytes,
+        'in_memory_bytes': in_memory_bytes,
+        'single_row_p50_us': float(np.median(timings)) * 1e6,
+        'single_row_p99_us': float(np.percentile(timings, 99)) * 1e6,
+        'batch_us_per_row': batch_seconds / len(batch) * 1e6,
+    }
+
+
+def sklearn_tree_bytes(model):
+    # The node and value arrays behind every fitted tree; None for non-tree models
+    trees = getattr(model, 'estimators_', [model])
+    try:
+        return int(sum(tree.tree_.__getstate__()['nodes'].nbytes + tree.tree_.value.nbytes for tree in trees))
+    except AttributeError:
+        return None
+
+
+def plot_confusion_matrix(model_name, model, y_test, y_pred):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    os.makedirs(output_dir, exist_ok=True)
+    print("\nGenerating Confusion Matrix for Best Model...")
+    cm = confusion_matrix(y_test, y_pred)
+    plt.figure(figsize=(15, 12))
+    sns.heatmap(cm, annot=True, fmt='d', cmap='Blues', xticklabels=model.classes_, yticklabels=model.classes_)
+    plt.title(f'Confusion Matrix for {model_name}')
+    plt.xlabel('Predicted')
+    plt.ylabel('Actual')
+    plt.tight_layout()
+    plt.savefig(os.path.join(output_dir, f'confusion_matrix_{model_name.replace(" ", "_")}.png'))
+    plt.close()
+    print(f"Confusion Matrix for {model_name} saved to 'ML_plots/confusion_matrix_{model_name.replace(' ', '_')}.png'")
+
+
+def model_display_name(model):
+    candidates = {**build_models(), **build_stream_models()}
+    names = {type(candidate): name for name, candidate in candidates.items()}
+    return names.get(type(model), type(model).__name__)
+
+
+def command_eda(args):
+    X, y, feature_names = load_dataset(args.data, use_cache=not args.no_cache)
+
+    # --- EDA and Visualization ---
+    run_eda(dataset_frame(X, y, feature_names))
+
+
+def command_train(args):
+    X, y, feature_names = load_dataset(args.data, use_cache=not args.no_cache)
+
+    # --- Machine Learning Models ---
+
+    # Split the dataset into training and testing sets
+    X_train, X_test, y_train, y_test = split_dataset(X, y)
+
+    print(f"\nTraining data shape: {X_train.shape}")
+    print(f"Testing data shape: {X_test.shape}")
+
+    # Scale numerical features
+    scaler = StandardScaler()
+    X_train_scaled = scaler.fit_transform(X_train)
+    X_test_scaled = scaler.transform(X_test)
+
+    print("\n--- Training and Evaluating Models ---")
+    results = train_models(X_train_scaled, y_train, X_test_scaled, y_test,
+                           n_jobs=args.n_jobs, search=args.search, cv=args.cv)
+
+    publish_best_model(results, scaler, X_test, X_test_scaled, args.output_dir, args.objective, args.f1_tolerance,
+                       args.max_latency_us, args.max_size_mb)
+
+
+def command_train_stream(args):
+    """Train the incremental learners on a CSV of any length in bounded memory."""
+    splitter = StratifiedHoldout(args.holdout)
+    holdout = HoldoutSample(args.max_holdout_rows)
+    scaler = StandardScaler()
+    labels = set()
+    rng = np.random.default_rng(42)
+
+    # Pass 1: scaler statistics, label set and the hold-out sample
+    print(f"\nPass 1: fitting the scaler on '{args.data}' in chunks of {args.chunksize} rows...")
+    train_rows = 0
+    for X_chunk, y_chunk, feature_names in read_chunks(args.data, args.chunksize):
+        mask = splitter.mask(y_chunk)
+        holdout.add(X_chunk[mask], y_chunk[mask])
+        if not mask.all():
+            scaler.partial_fit(X_chunk[~mask])
+        labels.update(np.unique(y_chunk).tolist())
+        train_rows += int((~mask).sum())
+    classes = np.array(sorted(labels))
+    X_test, y_test = holdout.arrays()
+    X_test_scaled = scaler.transform(X_test)
+    print(f"Training rows: {train_rows}, hold-out rows: {holdout.seen} ({len(X_test)} kept for evaluation), classes: {len(classes)}")
+
+    models = build_stream_models()
+    fit_seconds = dict.fromkeys(models, 0.0)
+    for epoch in range(1, args.epochs + 1):
+        print(f"Pass {epoch + 1}: epoch {epoch}/{args.epochs}...")
+        splitter.reset()
+        for X_chunk, y_chunk, _ in read_chunks(args.data, args.chunksize):
+            mask = splitter.mask(y_chunk)
+            # Shuffle within the chunk; files sorted by label would otherwise bias SGD
+            order = rng.permutation(np.flatnonzero(~mask))
+            if not len(order):
+                continue
+            X_train_scaled = scaler.transform(X_chunk[order])
+            y_train = y_chunk[order]
+            for name, model in models.items():
+                start = time.perf_counter()
+                model.partial_fit(X_train_scaled, y_train, classes=classes)
+                fit_seconds[name] += time.perf_counter() - start
+
+    # Whole-process high-water mark: chunk buffers, hold-out sample and models together
+    peak_memory_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results = {}
+    for name, model in models.items():
+        y_pred = model.predict(X_test_scaled)
+        results[name] = {
+            'accuracy': accuracy_score(y_test, y_pred),
+            'f1_score': f1_score(y_test, y_pred, average='weighted'),
+            'model': model,
+            'fit_seconds': fit_seconds[name],
+            'peak_memory_mb': peak_memory_mb,
+        }
+        print(f"{name} - Accuracy: {results[name]['accuracy']:.4f}, F1 Score: {results[name]['f1_score']:.4f}")
+
+    publish_best_model(results, scaler, X_test, X_test_scaled, args.output_dir, args.objective, args.f1_tolerance,
+                       args.max_latency_us, args.max_size_mb)
+
+
+def command_evaluate(args):
+    X, y, _ = load_dataset(args.data, use_cache=not args.no_cache)
+    _, X_test, _, y_test = split_dataset(X, y)
+
+    model = joblib.load(os.path.join(args.output_dir, MODEL_FILENAME))
+    scaler = joblib.load(os.path.join(args.output_dir, SCALER_FILENAME))
+    model_name = model_display_name(model)
+
+    # --- Evaluation of the Best Model ---
+    print(f"\n--- Detailed Evaluation of {model_name} ---")
+    y_pred = model.predict(scaler.transform(X_test))
+    print(f"Accuracy: {accuracy_score(y_test, y_pred):.4f}, F1 Score: {f1_score(y_test, y_pred, average='weighted'):.4f}")
+
+    # Classification Report
+    print("\nClassification Report:")
+    print(classification_report(y_test, y_pred))
+
+    if args.plots:
+        plot_confusion_matrix(model_name, model, y_test, y_pred)
+
+
+def command_compress(args):
+    X, y, _ = load_dataset(args.data, use_cache=not args.no_cache)
+    _, X_test, _, y_test = split_dataset(X, y)
+    X_raw = np.asarray(X_test, dtype=float)
+
+    model_filename = os.path.join(args.output_dir, MODEL_FILENAME)
+    scaler_filename = os.path.join(args.output_dir, SCALER_FILENAME)
+    model = joblib.load(model_filename)
+    scaler = joblib.load(scaler_filename)
+    try:
+        compact = CompactForest.from_sklearn(model, scaler, max_trees=args.max_trees, max_depth=args.max_depth)
+    except ValueError as e:
+        print(f"Cannot compress {model_display_name(model)}: {e}")
+        raise SystemExit(1)
+
+    print(f"\n--- Compressing {model_display_name(model)} ---")
+    reference = model.predict_proba(scaler.transform(X_raw))
+    report = {
+        'model': model_display_name(model),
+        'max_trees': args.max_trees,
+        'max_depth': args.max_depth,
+        'variants': {
+            'sklearn': serving_report(
+                lambda X: model.predict_proba(scaler.transform(X)), model.classes_, X_raw, y_test, reference,
+                os.path.getsize(model_filename) + os.path.getsize(scaler_filename), sklearn_tree_bytes(model),
+            ),
+        },
+    }
+    fused_filename = os.path.join(args.output_dir, FUSED_MODEL_FILENAME)
+    if os.path.exists(fused_filename):
+        fused = FusedPredictor.load(fused_filename)
+        report['variants']['fused'] = serving_report(
+            fused.predict_proba, fused.classes_, X_raw, y_test, reference,
+            os.path.getsize(fused_filename), sum(array.nbytes for array in fused.arrays.values()),
+        )
+
+    compact_filename = os.path.join(args.output_dir, COMPACT_MODEL_FILENAME)
+    buffer = io.BytesIO()
+    compact.save(buffer)
+    report['variants']['compact'] = compact_report = serving_report(
+        compact.predict_proba, compact.classes_, X_raw, y_test, reference, buffer.tell(), compact.nbytes,
+    )
+
+    for name, variant in report['variants'].items():
+        in_memory = f"{variant['in_memory_bytes'] / 2**20:.2f} MB" if variant['in_memory_bytes'] is not None else 'n/a'
+        print(f"{name}: Accuracy = {variant['accuracy']:.4f}, F1 Score = {variant['f1_score']:.4f}, "
+              f"agreement = {variant['agreement']:.4f}, file = {variant['artifact_bytes'] / 2**20:.2f} MB, "
+              f"arrays = {in_memory}, single row p50 = {variant['single_row_p50_us']:.1f} us, "
+              f"batched = {variant['batch_us_per_row']:.2f} us/row")
+
+    if compact_report['agreement'] < args.min_agreement:
+        print(f"Compact model agrees with the original on only {compact_report['agreement']:.4f} of the hold-out rows "
+              f"(--min-agreement {args.min_agreement}); not published.")
+        raise SystemExit(1)
+
+    atomic_write(compact_filename, compact.save)
+    report_filename = os.path.join(args.output_dir, COMPACT_REPORT_FILENAME)
+    atomic_write(report_filename, lambda f: f.write(json.dumps(report, indent=2).encode()))
+    print(f"Compact model saved as '{compact_filename}', report as '{report_filename}'")
+    version = write_version_file(args.output_dir, ARTIFACT_FILENAMES)
+    print(f"Model version {version} published")
+
+
+def warm_start_update(model, X, y, add_trees):
+    """Continue training a fitted model on ``(X, y)`` instead of refitting it; return how it was updated.
+
+    Incremental learners (SGD, naive Bayes, MLP) take another ``partial_fit``
+    step. Forests and gradient boosting keep their fitted trees and grow
+    ``add_trees`` more on the new rows (``warm_start``). Logistic regression
+    is the exception: ``warm_start`` only starts the solver from the current
+    coefficients, and it still converges to the fit of ``(X, y)`` alone, so
+    this is a refit on the update rows (the replayed sample keeps it close to
+    the original model). Other models raise ``ValueError``: they have to be
+    retrained with ``train``.
+    """
+    if hasattr(model, 'partial_fit'):
+        model.partial_fit(X, y, classes=model.classes_)
+        return 'partial_fit'
+    params = model.get_params()
+    if 'warm_start' not in params:
+        raise ValueError(f"{type(model).__name__} cannot be updated incrementally; retrain it with the train subcommand.")
+    # A refit recomputes classes_, which must still line up with the kept trees/coefficients
+    if not np.array_equal(np.unique(y), model.classes_):
+        raise ValueError("Warm-start updates need rows of every class the model knows; add replayed rows.")
+    if 'n_estimators' in params:
+        model.set_params(warm_start=True, n_estimators=params['n_estimators'] + add_trees)
+        how = f'warm_start (+{add_trees} trees)'
+    else:
+        model.set_params(warm_start=True)
+        how = 'refit on the update rows (solver started from the current coefficients)'
+    model.fit(X, y)
+    # Later fits (e.g. a full train) must not keep growing this model
+    model.set_params(warm_start=False)
+    return how
+
+
+def replay_sample(X, y, per_class, seed=42):
+    """Pick up to ``per_class`` rows of every class, so each update sees all classes and keeps its old skill."""
+    rng = np.random.default_rng(seed)
+    rows = [rng.permutation(np.flatnonzero(y == label))[:per_class] for label in np.unique(y)]
+    rows = np.concatenate(rows)
+    return X[rows], y[rows]
+
+
+def command_retrain(args):
+    """Update the saved model with the feedback logged since it was trained; cost grows with the new rows."""
+    model_filename = os.path.join(args.output_dir, MODEL_FILENAME)
+    model = joblib.load(model_filename)
+    scaler = joblib.load(os.path.join(args.output_dir, SCALER_FILENAME))
+    model_name = model_display_name(model)
+    metadata_filename = os.path.join(args.output_dir, METADATA_FILENAME)
+    metadata = {}
+    if os.path.exists(metadata_filename):
+        with open(metadata_filename) as f:
+            metadata = json.load(f)
+
+    feedback_dir = args.feedback_dir or os.path.join(args.output_dir, FEEDBACK_DIRNAME)
+    start_row = 0 if args.from_start else metadata.get('feedback_rows', 0)
+    feedback = FeedbackLog(feedback_dir).read(start_row)
+    if start_row > feedback['stop']:
+        print(f"The feedback log has {feedback['stop']} rows but the model already used {start_row}; "
+              "pass --from-start if the log was replaced.")
+    X_new, y_new = feedback['features'], feedback['actual']
+    print(f"Feedback rows {feedback['start']}-{feedback['stop']} from '{feedback_dir}': {len(X_new)} new")
+    # The model's classes are fixed; a crop it has never seen needs a full train
+    known = np.isin(y_new, model.classes_)
+    if not known.all():
+        print(f"Skipping {int((~known).sum())} row(s) with crops the model does not know: "
+              f"{', '.join(sorted(set(y_new[~known].tolist())))}")
+    X_new, y_new = X_new[known], y_new[known]
+    if len(X_new) < args.min_rows:
+        print(f"Fewer than --min-rows {args.min_rows} new labelled rows; model left unchanged.")
+        return
+
+    X, y, _ = load_dataset(args.data, use_cache=not args.no_cache)
+    X_train, X_test, y_train, y_test = split_dataset(X, y)
+    X_replay, y_replay = replay_sample(X_train, y_train, args.replay_per_class)
+    X_update = np.concatenate([X_new, X_replay])
+    y_update = np.concatenate([y_new, y_replay])
+    # The scaler stays as it was: the fitted model's inputs must keep their meaning
+    X_test_scaled = scaler.transform(X_test)
+    before = {
+        'f1_score': float(f1_score(y_test, model.predict(X_test_scaled), average='weighted')),
+        'feedback_accuracy': float(accuracy_score(y_new, model.predict(scaler.transform(X_new)))),
+    }
+
+    print(f"\n--- Updating {model_name} with {len(X_new)} feedback rows + {len(X_replay)} replayed rows ---")
+    start = time.perf_counter()
+    try:
+        how = warm_start_update(model, scaler.transform(X_update), y_update, args.add_trees)
+    except ValueError as e:
+        print(e)
+        raise SystemExit(1)
+    update_seconds = time.perf_counter() - start
+    after = {
+        'f1_score': float(f1_score(y_test, model.predict(X_test_scaled), average='weighted')),
+        'feedback_accuracy': float(accuracy_score(y_new, model.predict(scaler.transform(X_new)))),
+    }
+    print(f"{how} in {update_seconds:.2f}s. Hold-out F1: {before['f1_score']:.4f} -> {after['f1_score']:.4f}, "
+          f"accuracy on the feedback rows: {before['feedback_accuracy']:.4f} -> {after['feedback_accuracy']:.4f}")
+    if after['f1_score'] < before['f1_score'] - args.max_f1_drop:
+        print(f"Hold-out F1 dropped by more than --max-f1-drop {args.max_f1_drop}; not published.")
+        raise SystemExit(1)
+
+    atomic_write(model_filename, lambda f: joblib.dump(model, f))
+    print(f"Updated model saved as '{model_filename}'")
+    export_fused_predictor(model_name, model, scaler, X_test, X_test_scaled, args.output_dir)
+    for filename in (COMPACT_MODEL_FILENAME, COMPACT_REPORT_FILENAME):
+        if os.path.exists(os.path.join(args.output_dir, filename)):
+            os.remove(os.path.join(args.output_dir, filename))
+
+    # The next retrain starts after the rows used here
+    metadata['feedback_rows'] = feedback['stop']
+    metadata.setdefault('retrains', []).append({
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'method': how,
+        'feedback_rows': [feedback['start'], feedback['stop']],
+        'rows_used': len(X_new),
+        'replayed_rows': len(X_replay),
+        'update_seconds': update_seconds,
+        'before': before,
+        'after': after,
+    })
+    atomic_write(metadata_filename, lambda f: f.write(json.dumps(metadata, indent=2, default=str).encode()))
+    version = write_version_file(args.output_dir, ARTIFACT_FILENAMES)
+    print(f"Model version {version} published")
+
+
+def main():
+    def add_common_arguments(parser, default):
+        parser.add_argument('--data', default=default(file_path), help="Dataset CSV/xls file (default: Crop_recommendation.xls).")
+        parser.add_argument('--no-cache', action='store_true', default=default(False),
+                            help="Always re-parse the dataset instead of using the .npz cache.")
+        parser.add_argument('--output-dir', default=default(model_dir),
+                            help="Directory the model artifacts are written to and read from (default: this directory).")
+
+    parser = argparse.ArgumentParser(description="Train, evaluate and explore the crop recommendation model.")
+    add_common_arguments(parser, lambda value: value)
+    # Also accepted after the subcommand; SUPPRESS keeps those copies from overwriting values given before it
+    common = argparse.ArgumentParser(add_help=False)
+    add_common_arguments(common, lambda value: argparse.SUPPRESS)
+    # Model selection options shared by train and train-stream
+    selection = argparse.ArgumentParser(add_help=False)
+    selection.add_argument('--objective', choices=OBJECTIVES, default='f1',
+                           help="f1: best F1 within the budgets; latency: fastest within --f1-tolerance of the best F1.")
+    selection.add_argument('--f1-tolerance', type=float, default=0.005,
+                           help="F1 a faster model may give up under --objective latency.")
+    selection.add_argument('--max-latency-us', type=float, help="Exclude candidates whose single-row p99 latency exceeds this.")
+    selection.add_argument('--max-size-mb', type=float, help="Exclude candidates whose saved artifacts exceed this size.")
+    subparsers = parser.add_subparsers(dest='command')
+
+    subparsers.add_parser('eda', parents=[common], help="Print dataset summaries and save EDA plots to ML_plots/.")
+
+    train_parser = subparsers.add_parser('train', parents=[common, selection], help="Train the candidates and publish the best model (no plotting).")
+    train_parser.add_argument('--n-jobs', type=int, default=1,
+                              help="Worker processes for training the candidate models concurrently (-1 = all cores).")
+    train_parser.add_argument('--search', action='store_true',
+                              help="Run a cross-validated grid search (PARAM_GRIDS) for every candidate.")
+    train_parser.add_argument('--cv', type=int, default=5, help="Cross-validation folds for --search.")
+
+    stream_parser = subparsers.add_parser('train-stream', parents=[common, selection],
+                                          help="Train incremental learners chunk by chunk on a CSV larger than memory.")
+    stream_parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE, help="Rows read per chunk.")
+    stream_parser.add_argument('--holdout', type=float, default=0.2, help="Stratified hold-out fraction.")
+    stream_parser.add_argument('--max-holdout-rows', type=int, default=MAX_HOLDOUT_ROWS,
+                               help="Cap on hold-out rows kept in memory for evaluation (reservoir sampled).")
+    stream_parser.add_argument('--epochs', type=int, default=5, help="Passes over the training rows.")
+
+    evaluate_parser = subparsers.add_parser('evaluate', parents=[common], help="Report metrics for the saved model on the hold-out split.")
+    evaluate_parser.add_argument('--plots', action='store_true', help="Also save the confusion matrix plot.")
+
+    compress_parser = subparsers.add_parser('compress', parents=[common],
+                                            help="Export a quantized copy of the saved tree model and compare it with the original.")
+    compress_parser.add_argument('--max-trees', type=int, help="Keep only the first N trees of a forest.")
+    compress_parser.add_argument('--max-depth', type=int, help="Cut every tree at this depth.")
+    compress_parser.add_argument('--min-agreement', type=float, default=0.99,
+                                 help="Do not publish if fewer hold-out predictions than this match the original model.")
+
+    retrain_parser = subparsers.add_parser('retrain', parents=[common],
+                                           help="Warm-start the saved model on the feedback logged since it was trained.")
+    retrain_parser.add_argument('--feedback-dir', help=f"Feedback log directory (default: <output-dir>/{FEEDBACK_DIRNAME}).")
+    retrain_parser.add_argument('--add-trees', type=int, default=20,
+                                help="Trees (or boosting stages) added to a forest or gradient boosting model.")
+    retrain_parser.add_argument('--replay-per-class', type=int, default=20,
+                                help="Original training rows per crop mixed into the update.")
+    retrain_parser.add_argument('--min-rows', type=int, default=1, help="Do nothing with fewer new feedback rows.")
+    retrain_parser.add_argument('--max-f1-drop', type=float, default=0.01,
+                                help="Do not publish if the hold-out F1 falls by more than this.")
+    retrain_parser.add_argument('--from-start', action='store_true',
+                                help="Use the whole feedback log, not only the rows since the last retrain.")
+
+    args = parser.parse_args()
+
+    if args.command == 'eda':
+        command_eda(args)
+    elif args.command == 'train':
+        command_train(args)
+    elif args.command == 'train-stream':
+        command_train_stream(args)
+    elif args.command == 'evaluate':
+        command_evaluate(args)
+    elif args.command == 'compress':
+        command_compress(args)
+    elif args.command == 'retrain':
+        command_retrain(args)
+    else:
+        # No subcommand: the full original pipeline
+        args.n_jobs, args.search, args.cv, args.plots = 1, False, 5, True
+        args.objective, args.f1_tolerance, args.max_latency_us, args.max_size_mb = 'f1', 0.005, None, None
+        command_eda(args)
+        command_train(args)
+        command_evaluate(args)
+        print("\nMachine learning process completed. Check 'ML_plots' directory for visualizations and the current directory for the saved model and scaler.")
+
 
-results = {}
-best_model_name = None
-best_f1_score = -1
-
-print("\n--- Training and Evaluating Models ---")
-for name, model in models.items():
-    print(f"\nTraining {name}...")
-    model.fit(X_train_scaled, y_train)
-    y_pred = model.predict(X_test_scaled)
-
-    accuracy = accuracy_score(y_test, y_pred)
-    f1 = f1_score(y_test, y_pred, average='weighted')
-
-    results[name] = {'accuracy': accuracy, 'f1_score': f1, 'model': model}
-    print(f"{name} - Accuracy: {accuracy:.4f}, F1 Score: {f1:.4f}")
-
-    if f1 > best_f1_score:
-        best_f1_score = f1
-        best_model_name = name
-
-print("\n--- Model Comparison ---")
-for name, metrics in results.items():
-    print(f"{name}: Accuracy = {metrics['accuracy']:.4f}, F1 Score = {metrics['f1_score']:.4f}")
-
-print(f"\nBest performing model: {best_model_name} with F1 Score: {best_f1_score:.4f}")
-
-# Save the best model
-best_model = results[best_model_name]['model']
-model_filename = os.path.join(os.path.dirname(__file__), 'best_crop_prediction_model.joblib')
-joblib.dump(best_model, model_filename)
-print(f"Best model saved as '{model_filename}'")
-
-# Save the scaler as well, as it's needed for new predictions
-scaler_filename = os.path.join(os.path.dirname(__file__), 'scaler.joblib')
-joblib.dump(scaler, scaler_filename)
-print(f"Scaler saved as '{scaler_filename}'")
-
-# --- Evaluation of the Best Model ---
-print(f"\n--- Detailed Evaluation of {best_model_name} ---")
-y_pred_best = best_model.predict(X_test_scaled)
-
-# Classification Report
-print("\nClassification Report:")
-print(classification_report(y_test, y_pred_best))
-
-# Confusion Matrix
-print("\nGenerating Confusion Matrix for Best Model...")
-cm = confusion_matrix(y_test, y_pred_best)
-plt.figure(figsize=(15, 12))
-sns.heatmap(cm, annot=True, fmt='d', cmap='Blues', xticklabels=best_model.classes_, yticklabels=best_model.classes_)
-plt.title(f'Confusion Matrix for {best_model_name}')
-plt.xlabel('Predicted')
-plt.ylabel('Actual')
-plt.tight_layout()
-plt.savefig(os.path.join(output_dir, f'confusion_matrix_{best_model_name.replace(" ", "_")}.png'))
-plt.close()
-print(f"Confusion Matrix for {best_model_name} saved to 'ML_plots/confusion_matrix_{best_model_name.replace(' ', '_')}.png'")
-
-print("\nMachine learning process completed. Check 'ML_plots' directory for visualizations and the current directory for the saved model and scaler.")
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Append-only, columnar log of farmer-reported crop outcomes.
+
+Every column is a flat binary file in the log directory holding one
+fixed-width value per row: the seven features as float32, the reported and
+the served crop as uint16 codes into ``labels.json``, the served probability
+(float32), the model version (12 bytes) and a Unix timestamp (int64), about
+56 bytes a row. Appending writes a few bytes to the end of each file, and
+``read(start)`` loads just the rows after ``start`` with ``np.fromfile``, so
+``crop_prediction.py retrain`` only touches the feedback that arrived since
+the model it updates. Rows are never rewritten; row numbers are stable.
+
+Writers hold an exclusive ``flock`` on ``.lock`` (web workers append
+concurrently). A crash between two column writes leaves the columns uneven;
+readers use the shortest column and the next append trims the others back to
+it first.
+"""
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from model_artifacts import FEATURE_COLUMNS, atomic_write
+
+try:
+    import fcntl
+except ImportError:  # Windows: only writers in this process are serialized
+    fcntl = None
+
+LABELS_FILENAME = 'labels.json'
+LOCK_FILENAME = '.lock'
+COLUMNS = {
+    **{name: np.dtype('<f4') for name in FEATURE_COLUMNS},
+    'actual': np.dtype('<u2'),
+    'predicted': np.dtype('<u2'),
+    'probability': np.dtype('<f4'),
+    'model_version': np.dtype('S12'),
+    'timestamp': np.dtype('<i8'),
+}
+
+
+class FeedbackLog:
+    def __init__(self, directory):
+        self.directory = str(directory)
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _column_path(self, column):
+        return self._path(f'{column}.col')
+
+    def _lengths(self):
+        lengths = {}
+        for column, dtype in COLUMNS.items():
+            try:
+                lengths[column] = os.path.getsize(self._column_path(column)) // dtype.itemsize
+            except FileNotFoundError:
+                lengths[column] = 0
+        return lengths
+
+    def __len__(self):
+        return min(self._lengths().values())
+
+    def labels(self):
+        # Code 0 is the empty label, stored when no prediction was served
+        try:
+            with open(self._path(LABELS_FILENAME)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return ['']
+
+    def _codes(self, labels, names):
+        """Return the codes of ``names``, adding unseen ones to ``labels`` (which the caller saves)."""
+        codes = []
+        for name in names:
+            if name not in labels:
+                labels.append(name)
+            codes.append(labels.index(name))
+        if len(labels) > np.iinfo(COLUMNS['actual']).max + 1:
+            raise ValueError("Too many distinct crop labels for the feedback log.")
+        return codes
+
+    def append(self, features, actual, predicted='', probability=float('nan'), model_version='', timestamp=None):
+        """Record one reported outcome; return its row number."""
+        if len(features) != len(FEATURE_COLUMNS):
+            raise ValueError(f"Expected {len(FEATURE_COLUMNS)} features, got {len(features)}.")
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock, open(self._path(LOCK_FILENAME), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            labels = self.labels()
+            known = len(labels)
+            actual_code, predicted_code = self._codes(labels, [actual, predicted or ''])
+            if len(labels) != known:
+                atomic_write(self._path(LABELS_FILENAME), lambda f: f.write(json.dumps(labels).encode()))
+
+            values = {
+                **dict(zip(FEATURE_COLUMNS, features)),
+                'actual': actual_code,
+                'predicted': predicted_code,
+                'probability': probability,
+                'model_version': str(model_version or '').encode()[:12],
+                'timestamp': int(time.time() if timestamp is None else timestamp),
+            }
+            row = len(self)
+            for column, dtype in COLUMNS.items():
+                with open(self._column_path(column), 'ab') as f:
+                    # Drop the tail of a row a crashed writer left half-written
+                    f.truncate(row * dtype.itemsize)
+                    f.write(np.asarray([values[column]], dtype=dtype).tobytes())
+            return row
+
+    def read(self, start=0, stop=None):
+        """Return the rows ``start:stop`` as a dict of column arrays, labels decoded to strings.
+
+        ``features`` is the ``(n, 7)`` float32 matrix in ``FEATURE_COLUMNS`` order.
+        """
+        length = len(self)
+        stop = length if stop is None else min(stop, length)
+        start = min(start, stop)
+        columns = {}
+        for column, dtype in COLUMNS.items():
+            path = self._column_path(column)
+            if stop == start or not os.path.exists(path):
+                columns[column] = np.empty(0, dtype=dtype)
+                continue
+            columns[column] = np.fromfile(path, dtype=dtype, count=stop - start, offset=start * dtype.itemsize)
+        labels = np.asarray(self.labels())
+        return {
+            'features': np.column_stack([columns[name] for name in FEATURE_COLUMNS]).reshape(-1, len(FEATURE_COLUMNS)),
+            'actual': labels[columns['actual']],
+            'predicted': labels[columns['predicted']],
+            'probability': columns['probability'],
+            'model_version': columns['model_version'].astype(str),
+            'timestamp': columns['timestamp'],
+            'start': start,
+            'stop': stop,
+        }
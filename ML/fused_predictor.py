@@ -0,0 +1,221 @@
+"""Pure-NumPy crop predictor with the StandardScaler folded into the model.
+
+``FusedPredictor.from_sklearn(model, scaler)`` flattens a fitted
+LogisticRegression, DecisionTree, RandomForest or GradientBoosting classifier
+into a handful of flat arrays that operate directly on raw (unscaled)
+features, so serving needs neither sklearn nor a separate scaler call.
+The arrays are saved as a single ``.npz`` file and loaded without pickle.
+"""
+import numpy as np
+
+# Rows scored per block; keeps the (rows, trees) working arrays cache-sized for big batches
+BLOCK_SIZE = 512
+# Batches up to this size resolve the branch at every node up front (see _apply)
+DENSE_ROWS = 1
+
+
+def _scaler_params(scaler, n_features):
+    mean = np.zeros(n_features)
+    scale = np.ones(n_features)
+    if scaler is not None:
+        if getattr(scaler, 'mean_', None) is not None:
+            mean = np.asarray(scaler.mean_, dtype=np.float64)
+        if getattr(scaler, 'scale_', None) is not None:
+            scale = np.asarray(scaler.scale_, dtype=np.float64)
+    return mean, scale
+
+
+def _flatten_trees(trees, mean, scale, leaf_values):
+    """Concatenate sklearn trees into flat node arrays.
+
+    Thresholds are mapped back to raw feature units and every leaf points to
+    itself, so walking ``depth`` steps from the roots always ends on a leaf.
+    ``leaf_values(tree)`` returns the per-node value rows to store.
+    """
+    features, thresholds, children, values, roots = [], [], [], [], []
+    offset = 0
+    depth = 0
+    for tree in trees:
+        t = tree.tree_
+        node_ids = np.arange(t.node_count)
+        is_leaf = t.children_left == -1
+        feature = np.where(is_leaf, 0, t.feature)
+        threshold = np.where(is_leaf, np.inf, t.threshold * scale[feature] + mean[feature])
+        left = np.where(is_leaf, node_ids, t.children_left) + offset
+        right = np.where(is_leaf, node_ids, t.children_right) + offset
+
+        features.append(feature.astype(np.int32))
+        thresholds.append(threshold)
+        children.append(np.stack([left, right], axis=1).astype(np.int32))
+        values.append(leaf_values(tree))
+        roots.append(offset)
+        offset += t.node_count
+        depth = max(depth, t.max_depth)
+
+    return {
+        'feature': np.concatenate(features),
+        'threshold': np.concatenate(thresholds),
+        'children': np.concatenate(children),
+        'value': np.concatenate(values),
+        'roots': np.asarray(roots, dtype=np.int32),
+        'depth': np.asarray(depth),
+    }
+
+
+def _softmax(scores):
+    scores = scores - scores.max(axis=1, keepdims=True)
+    np.exp(scores, out=scores)
+    scores /= scores.sum(axis=1, keepdims=True)
+    return scores
+
+
+def _sigmoid(scores):
+    return 1.0 / (1.0 + np.exp(-scores))
+
+
+class FusedPredictor:
+    """Scaler + classifier collapsed into flat arrays with a ``predict_topk`` entry point."""
+
+    def __init__(self, kind, link, classes, arrays):
+        self.kind = kind
+        self.link = link
+        # Plain unicode labels so the .npz loads without pickle
+        self.classes_ = np.asarray(classes).astype(str)
+        self.arrays = arrays
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        if kind == 'trees':
+            self.depth = int(self.depth)
+        if 'tree_class' in arrays:
+            # One-hot (trees, classes) map that routes each boosting tree to its class column
+            self._class_map = np.eye(len(self.init))[self.tree_class]
+
+    @classmethod
+    def from_sklearn(cls, model, scaler=None):
+        """Fold ``scaler`` into a fitted sklearn classifier.
+
+        Raises ``ValueError`` for model types that have no flat representation
+        (e.g. SVC or KNN); callers should keep serving the joblib artifacts then.
+        """
+        # Imported here so loading a saved predictor never needs sklearn
+        from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+        from sklearn.linear_model import LogisticRegression, SGDClassifier
+        from sklearn.tree import DecisionTreeClassifier
+
+        n_features = model.n_features_in_
+        mean, scale = _scaler_params(scaler, n_features)
+
+        if isinstance(model, (LogisticRegression, SGDClassifier)):
+            if isinstance(model, SGDClassifier) and model.loss != 'log_loss':
+                raise ValueError(f"SGDClassifier with loss='{model.loss}' has no predict_proba to fuse.")
+            # w . (x - mean) / scale + b  ==  (w / scale) . x + (b - w . (mean / scale))
+            coef = model.coef_ / scale
+            intercept = model.intercept_ - model.coef_ @ (mean / scale)
+            if len(model.classes_) == 2:
+                link = 'logistic'
+            else:
+                link = 'softmax' if isinstance(model, LogisticRegression) else 'ovr'
+            return cls('linear', link, model.classes_, {'coef': coef, 'intercept': intercept})
+
+        if isinstance(model, (DecisionTreeClassifier, RandomForestClassifier)):
+            trees = [model] if isinstance(model, DecisionTreeClassifier) else model.estimators_
+
+            def leaf_values(tree):
+                value = tree.tree_.value[:, 0, :]
+                # Pre-divide by the tree count so summing over trees gives the forest average
+                return value / value.sum(axis=1, keepdims=True) / len(trees)
+
+            arrays = _flatten_trees(trees, mean, scale, leaf_values)
+            return cls('trees', 'identity', model.classes_, arrays)
+
+        if isinstance(model, GradientBoostingClassifier):
+            n_stages, n_columns = model.estimators_.shape
+            trees = list(model.estimators_.ravel())
+            arrays = _flatten_trees(
+                trees, mean, scale,
+                lambda tree: tree.tree_.value[:, 0, :1] * model.learning_rate,
+            )
+            # estimators_ is (stages, columns); ravel() interleaves the columns
+            arrays['tree_class'] = np.tile(np.arange(n_columns, dtype=np.int32), n_stages)
+            arrays['init'] = model._raw_predict_init(np.zeros((1, n_features)))[0]
+            link = 'logistic' if n_columns == 1 else 'softmax'
+            return cls('trees', link, model.classes_, arrays)
+
+        raise ValueError(f"{type(model).__name__} cannot be fused into a flat predictor.")
+
+    def save(self, path):
+        np.savez(path, kind=self.kind, link=self.link, classes=self.classes_, **self.arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            arrays = {name: data[name] for name in data.files}
+        kind = str(arrays.pop('kind'))
+        link = str(arrays.pop('link'))
+        classes = arrays.pop('classes')
+        return cls(kind, link, classes, arrays)
+
+    def _apply(self, X):
+        """Return the leaf reached in every tree, shape ``(n_rows, n_trees)``."""
+        if len(X) <= DENSE_ROWS:
+            # Single row: decide every node's branch in one pass, after which each
+            # level is one gather instead of five NumPy calls.
+            n_nodes = len(self.feature)
+            offsets = (np.arange(len(X)) * n_nodes)[:, None]
+            successor = np.where(X[:, self.feature] > self.threshold, self.children[:, 1], self.children[:, 0])
+            successor = (successor + offsets).ravel()
+            nodes = self.roots + offsets
+            for _ in range(self.depth):
+                nodes = successor[nodes]
+            return nodes - offsets
+
+        # Walk all trees one level at a time using flat indices into X and children
+        n_rows, n_features = X.shape
+        flat_X = X.ravel()
+        offsets = (np.arange(n_rows) * n_features)[:, None]
+        flat_children = self.children.ravel()
+        nodes = np.repeat(self.roots[None, :], n_rows, axis=0)
+        for _ in range(self.depth):
+            go_right = flat_X[offsets + self.feature[nodes]] > self.threshold[nodes]
+            nodes = flat_children[2 * nodes + go_right]
+        return nodes
+
+    def _scores(self, X):
+        if self.kind == 'linear':
+            return X @ self.coef.T + self.intercept
+        leaves = self._apply(X)
+        if self.link == 'identity':
+            return self.value[leaves].sum(axis=1)
+        # Gradient boosting: add each tree's leaf value to its class column
+        return self.init + self.value[leaves, 0] @ self._class_map
+
+    def _proba(self, X):
+        scores = self._scores(X)
+        if self.link == 'identity':
+            return scores
+        if self.link == 'softmax':
+            return _softmax(scores)
+        if self.link == 'ovr':
+            scores = _sigmoid(scores)
+            return scores / scores.sum(axis=1, keepdims=True)
+        positive = _sigmoid(scores.reshape(-1))
+        return np.stack([1.0 - positive, positive], axis=1)
+
+    def predict_proba(self, X):
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X[None, :]
+        if len(X) <= BLOCK_SIZE:
+            return self._proba(X)
+        return np.concatenate([self._proba(X[i:i + BLOCK_SIZE]) for i in range(0, len(X), BLOCK_SIZE)])
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+    def predict_topk(self, X, k):
+        """Return ``(labels, probabilities)`` of shape ``(n_rows, k)``, best first."""
+        probabilities = self.predict_proba(X)
+        k = max(1, min(k, probabilities.shape[1]))
+        # Stable sort keeps ties in class order, matching sorted() over predict_proba
+        top = np.argsort(-probabilities, axis=1, kind='stable')[:, :k]
+        return self.classes_[top], np.take_along_axis(probabilities, top, axis=1)
@@ -0,0 +1,68 @@
+"""Artifact file names and atomic publishing shared by training and serving.
+
+The trainer replaces each artifact atomically and writes ``model_version.json``
+last, listing the SHA-256 of every artifact. The web app's model registry only
+reloads when that version changes and refuses artifacts whose checksums do not
+match, so a deploy is picked up all at once or not at all.
+"""
+import hashlib
+import json
+import os
+import time
+
+# Feature order the model is trained on (the columns of Crop_recommendation.xls)
+FEATURE_COLUMNS = ['N', 'P', 'K', 'temperature', 'humidity', 'ph', 'rainfall']
+
+MODEL_FILENAME = 'best_crop_prediction_model.joblib'
+SCALER_FILENAME = 'scaler.joblib'
+FUSED_MODEL_FILENAME = 'fused_crop_prediction_model.npz'
+VERSION_FILENAME = 'model_version.json'
+# Candidate metrics and the selection objective behind the saved model
+METADATA_FILENAME = 'best_crop_prediction_model.meta.json'
+# Optional quantized copy of a tree model for low-memory serving, and its comparison report
+COMPACT_MODEL_FILENAME = 'compact_crop_prediction_model.npz'
+COMPACT_REPORT_FILENAME = 'compact_crop_prediction_model.report.json'
+# Append-only log of farmer-reported outcomes, read by `crop_prediction.py retrain`
+FEEDBACK_DIRNAME = 'feedback'
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def atomic_write(path, write):
+    """Call ``write(file)`` on a temporary file, then move it over ``path``."""
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    try:
+        with open(tmp_path, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def write_version_file(output_dir, filenames):
+    """Checksum the artifacts that exist in ``output_dir`` and publish a new version."""
+    checksums = {
+        filename: file_sha256(os.path.join(output_dir, filename))
+        for filename in filenames
+        if os.path.exists(os.path.join(output_dir, filename))
+    }
+    version = hashlib.sha256(json.dumps(checksums, sort_keys=True).encode()).hexdigest()[:12]
+    info = {
+        'version': version,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'artifacts': checksums,
+    }
+    atomic_write(
+        os.path.join(output_dir, VERSION_FILENAME),
+        lambda f: f.write(json.dumps(info, indent=2).encode()),
+    )
+    return version
@@ -0,0 +1,203 @@
+"""Score a large CSV of soil tests offline, without Django.
+
+    python score_csv.py soil_tests.csv scored.csv --top-k 3 --workers 4
+    python score_csv.py soil_tests.csv scored.parquet --keep-columns farm_id field_id
+
+The input needs the columns the model was trained on (``N, P, K,
+temperature, humidity, ph, rainfall``, any case and order); other columns are
+ignored unless listed in ``--keep-columns``. It is read ``--chunksize`` rows
+at a time and each chunk is scored in one vectorized call in a pool of
+worker processes, each of which loads its own copy of the artifacts once
+(they are loaded in the parent first, so missing or broken artifacts fail
+before the pool starts). At most ``2 * workers`` chunks are in flight and
+results are written in input order, so memory stays bounded for any file
+size. Rows with a missing or non-numeric feature get empty predictions.
+Output is CSV, or Parquet when the name ends in ``.parquet`` (needs pyarrow).
+"""
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from model_artifacts import COMPACT_MODEL_FILENAME, FEATURE_COLUMNS, FUSED_MODEL_FILENAME, MODEL_FILENAME, SCALER_FILENAME
+
+CHUNK_SIZE = 50000
+ENGINES = ('sklearn', 'fused', 'compact')
+
+model_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Set in each worker process by _init_worker
+_predict_top_k = None
+
+
+def load_predictor(artifact_dir, engine):
+    """Return ``predict_top_k(X, k) -> (labels, probabilities)`` for the chosen artifacts."""
+    if engine == 'compact':
+        from compact_predictor import CompactForest
+        return CompactForest.load(os.path.join(artifact_dir, COMPACT_MODEL_FILENAME)).predict_topk
+    if engine == 'fused':
+        from fused_predictor import FusedPredictor
+        return FusedPredictor.load(os.path.join(artifact_dir, FUSED_MODEL_FILENAME)).predict_topk
+
+    import joblib
+    model = joblib.load(os.path.join(artifact_dir, MODEL_FILENAME))
+    scaler = joblib.load(os.path.join(artifact_dir, SCALER_FILENAME))
+    if 'n_jobs' in model.get_params():
+        # Parallelism comes from the process pool
+        model.set_params(n_jobs=1)
+
+    def predict_top_k(X, k):
+        probabilities = model.predict_proba(scaler.transform(X))
+        k = max(1, min(k, probabilities.shape[1]))
+        top = np.argsort(-probabilities, axis=1, kind='stable')[:, :k]
+        return model.classes_[top], np.take_along_axis(probabilities, top, axis=1)
+    return predict_top_k
+
+
+def _init_worker(artifact_dir, engine):
+    global _predict_top_k
+    _predict_top_k = load_predictor(artifact_dir, engine)
+
+
+def score_chunk(X, k):
+    """Score the rows of ``X`` without NaNs; the others get empty labels and NaN probabilities."""
+    valid = ~np.isnan(X).any(axis=1)
+    labels = np.full((len(X), k), '', dtype=object)
+    probabilities = np.full((len(X), k), np.nan)
+    if valid.any():
+        top_labels, top_probabilities = _predict_top_k(X[valid], k)
+        labels[valid, :top_labels.shape[1]] = top_labels
+        probabilities[valid, :top_probabilities.shape[1]] = top_probabilities
+    return labels, probabilities
+
+
+def _score_in_worker(X, k):
+    return score_chunk(X, k)
+
+
+def feature_matrix(chunk):
+    """Select the model features from a chunk by case-insensitive name, in training order."""
+    import pandas as pd
+
+    columns = {str(name).strip().lower(): name for name in chunk.columns}
+    missing = [name for name in FEATURE_COLUMNS if name.lower() not in columns]
+    if missing:
+        raise ValueError(f"Input is missing the column(s): {', '.join(missing)}")
+    features = chunk[[columns[name.lower()] for name in FEATURE_COLUMNS]]
+    # Non-numeric cells become NaN and the row is reported without predictions
+    return features.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+
+
+def result_frame(chunk, keep_columns, labels, probabilities):
+    import pandas as pd
+
+    frame = pd.DataFrame({column: chunk[column].to_numpy() for column in keep_columns})
+    for i in range(labels.shape[1]):
+        frame[f'crop_{i + 1}'] = labels[:, i]
+        frame[f'probability_{i + 1}'] = np.round(probabilities[:, i], 6)
+    return frame
+
+
+class ResultWriter:
+    """Append result frames to a CSV or Parquet file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.parquet = path.lower().endswith('.parquet')
+        self._writer = None
+        self._first = True
+        if self.parquet:
+            # Checked up front so a missing pyarrow fails before any scoring
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise SystemExit("Parquet output needs pyarrow: pip install pyarrow")
+
+    def write(self, frame):
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table)
+        else:
+            frame.to_csv(self.path, mode='w' if self._first else 'a', header=self._first, index=False)
+        self._first = False
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def score_csv(input_path, output_path, artifact_dir=model_dir, engine='sklearn', k=3, workers=None,
+              chunksize=CHUNK_SIZE, keep_columns=()):
+    """Score ``input_path`` into ``output_path``; return ``(rows, seconds)``."""
+    import pandas as pd
+
+    if k < 1:
+        raise ValueError("--top-k must be at least 1.")
+    workers = workers or os.cpu_count() or 1
+    # Fails here, with the real error, rather than as a BrokenProcessPool from the workers
+    _init_worker(artifact_dir, engine)
+    writer = ResultWriter(output_path)
+    rows = 0
+    start = time.perf_counter()
+    chunks = pd.read_csv(input_path, chunksize=chunksize)
+
+    def finish(chunk, labels, probabilities):
+        nonlocal rows
+        writer.write(result_frame(chunk, keep_columns, labels, probabilities))
+        rows += len(chunk)
+        elapsed = time.perf_counter() - start
+        print(f"{rows} rows scored ({rows / elapsed:,.0f} rows/s)", file=sys.stderr)
+
+    try:
+        if workers == 1:
+            for chunk in chunks:
+                finish(chunk, *score_chunk(feature_matrix(chunk), k))
+        else:
+            with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(artifact_dir, engine)) as pool:
+                pending = deque()
+                for chunk in chunks:
+                    pending.append((chunk, pool.submit(_score_in_worker, feature_matrix(chunk), k)))
+                    # Bounded read-ahead; results are written in input order
+                    while len(pending) >= 2 * workers:
+                        chunk_done, future = pending.popleft()
+                        finish(chunk_done, *future.result())
+                while pending:
+                    chunk_done, future = pending.popleft()
+                    finish(chunk_done, *future.result())
+    finally:
+        writer.close()
+    return rows, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a CSV of soil tests with the saved crop model, without Django.")
+    parser.add_argument('input', help="CSV with N, P, K, temperature, humidity, ph and rainfall columns.")
+    parser.add_argument('output', help="Output file: .csv, or .parquet (needs pyarrow).")
+    parser.add_argument('--model-dir', default=model_dir, help="Directory holding the model artifacts (default: this directory).")
+    parser.add_argument('--engine', choices=ENGINES, default='sklearn',
+                        help="Artifacts to score with: sklearn (fastest for big chunks), fused or compact (NumPy only).")
+    parser.add_argument('--top-k', type=int, default=3, help="Crops to report per row.")
+    parser.add_argument('--workers', type=int, help="Scoring processes (default: one per CPU).")
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE, help="Rows read and scored per chunk.")
+    parser.add_argument('--keep-columns', nargs='*', default=[], help="Input columns copied to the output, e.g. farm ids.")
+    args = parser.parse_args()
+
+    try:
+        rows, seconds = score_csv(args.input, args.output, args.model_dir, args.engine, args.top_k, args.workers,
+                                  args.chunksize, args.keep_columns)
+    except (ValueError, KeyError, FileNotFoundError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        raise SystemExit(1)
+    print(f"Scored {rows} rows in {seconds:.1f}s ({rows / max(seconds, 1e-9):,.0f} rows/s) into '{args.output}'")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Serving-cost measurement and objective-based choice between candidate models.
+
+Every candidate is timed the way the web app would serve it: single rows go
+through the fused NumPy predictor when the model can be fused (otherwise
+scaler + ``predict_proba``), large batches through sklearn. Together with the
+serialized artifact size this lets the trainer pick, say, the most accurate
+model that fits a latency budget instead of the most accurate model outright.
+"""
+import io
+import time
+
+import joblib
+import numpy as np
+
+from fused_predictor import FusedPredictor
+
+OBJECTIVES = ('f1', 'latency')
+LATENCY_ROWS = 300
+BATCH_ROWS = 10000
+
+
+def _predict_scores(model, X):
+    if hasattr(model, 'predict_proba'):
+        return model.predict_proba(X)
+    return model.predict(X)
+
+
+def measure_serving_cost(model, scaler, X_test):
+    """Return single-row p50/p99 latency, batched per-row latency and artifact bytes for one candidate."""
+    X_raw = np.asarray(X_test, dtype=float)
+    try:
+        fused = FusedPredictor.from_sklearn(model, scaler)
+    except ValueError:
+        fused = None
+
+    if fused is not None:
+        score_row = lambda row: fused.predict_topk(row, 4)
+    else:
+        score_row = lambda row: _predict_scores(model, scaler.transform(row.reshape(1, -1)))
+    score_row(X_raw[0])
+    timings = []
+    for row in X_raw[np.arange(LATENCY_ROWS) % len(X_raw)]:
+        start = time.perf_counter()
+        score_row(row)
+        timings.append(time.perf_counter() - start)
+
+    batch = X_raw[np.arange(BATCH_ROWS) % len(X_raw)]
+    start = time.perf_counter()
+    _predict_scores(model, scaler.transform(batch))
+    batch_seconds = time.perf_counter() - start
+
+    buffer = io.BytesIO()
+    joblib.dump(model, buffer)
+    artifact_bytes = buffer.tell()
+    if fused is not None:
+        buffer = io.BytesIO()
+        fused.save(buffer)
+        artifact_bytes += buffer.tell()
+
+    return {
+        'fused': fused is not None,
+        'single_row_p50_us': float(np.median(timings)) * 1e6,
+        'single_row_p99_us': float(np.percentile(timings, 99)) * 1e6,
+        'batch_us_per_row': batch_seconds / BATCH_ROWS * 1e6,
+        'artifact_bytes': artifact_bytes,
+    }
+
+
+def pareto_front(results):
+    """Names of candidates not beaten on F1, single-row p99 latency and size all at once."""
+    def costs(metrics):
+        return (-metrics['f1_score'], metrics['single_row_p99_us'], metrics['artifact_bytes'])
+
+    front = []
+    for name, metrics in results.items():
+        mine = costs(metrics)
+        dominated = any(
+            all(a <= b for a, b in zip(costs(other), mine)) and costs(other) != mine
+            for other_name, other in results.items() if other_name != name
+        )
+        if not dominated:
+            front.append(name)
+    return front
+
+
+def select_model(results, objective='f1', f1_tolerance=0.0, max_latency_us=None, max_size_mb=None):
+    """Pick a candidate name from ``results`` (which must include the serving costs).
+
+    Candidates over ``max_latency_us`` (single-row p99) or ``max_size_mb`` are
+    excluded first. ``objective='f1'`` then takes the best F1; ``'latency'``
+    takes the fastest candidate whose F1 is within ``f1_tolerance`` of the best.
+    Returns ``(name, reason)``; when no candidate fits the budgets the best F1
+    overall is returned and the reason says so.
+    """
+    eligible = {
+        name: metrics for name, metrics in results.items()
+        if (max_latency_us is None or metrics['single_row_p99_us'] <= max_latency_us)
+        and (max_size_mb is None or metrics['artifact_bytes'] <= max_size_mb * 2**20)
+    }
+    if not eligible:
+        name = max(results, key=lambda n: results[n]['f1_score'])
+        return name, 'no candidate met the latency/size budget; fell back to the best F1'
+
+    best_f1 = max(metrics['f1_score'] for metrics in eligible.values())
+    if objective == 'latency':
+        close = [name for name, metrics in eligible.items() if metrics['f1_score'] >= best_f1 - f1_tolerance]
+        name = min(close, key=lambda n: eligible[n]['single_row_p99_us'])
+        return name, f'fastest single-row p99 within {f1_tolerance:.4f} F1 of the best eligible candidate'
+    name = max(eligible, key=lambda n: eligible[n]['f1_score'])
+    return name, 'best F1 among candidates within budget'
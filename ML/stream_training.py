@@ -0,0 +1,96 @@
+"""Out-of-core training for sensor datasets that do not fit in memory.
+
+The CSV is read in fixed-size chunks, so memory is bounded by the chunk size
+plus a capped hold-out sample, whatever the file length:
+
+* pass 1 fits the ``StandardScaler`` with ``partial_fit`` and collects the labels;
+* passes 2..n train every incremental learner chunk by chunk with ``partial_fit``.
+
+Hold-out rows are chosen in the same single pass that reads them: each class
+has its own running row counter and every row whose counter crosses a multiple
+of ``1 / holdout`` is held out, which gives an exactly stratified split that is
+identical on every pass over the file.
+"""
+import numpy as np
+from sklearn.linear_model import SGDClassifier
+from sklearn.naive_bayes import GaussianNB
+from sklearn.neural_network import MLPClassifier
+
+CHUNK_SIZE = 100000
+MAX_HOLDOUT_ROWS = 200000
+
+
+def build_stream_models():
+    # Learners that support partial_fit; SGD with log loss also exports to the fused predictor
+    return {
+        'SGD Logistic Regression': SGDClassifier(loss='log_loss', alpha=1e-4, random_state=42),
+        'Gaussian Naive Bayes': GaussianNB(),
+        'MLP (mini-batch)': MLPClassifier(hidden_layer_sizes=(64,), batch_size=256, random_state=42),
+    }
+
+
+def read_chunks(file_path, chunksize=CHUNK_SIZE):
+    """Yield ``(features, labels, feature_names)`` for successive chunks of a CSV with a ``label`` column."""
+    import pandas as pd
+
+    for chunk in pd.read_csv(file_path, chunksize=chunksize):
+        feature_names = [column for column in chunk.columns if column != 'label']
+        yield chunk[feature_names].to_numpy(dtype=np.float32), chunk['label'].to_numpy(dtype=str), feature_names
+
+
+class StratifiedHoldout:
+    """Assigns rows to the hold-out set per class, deterministically, as they stream past."""
+
+    def __init__(self, fraction):
+        self.fraction = fraction
+        self.counts = {}
+
+    def reset(self):
+        self.counts = {}
+
+    def mask(self, labels):
+        classes, inverse = np.unique(labels, return_inverse=True)
+        # Rank of each row among the rows of its class in this chunk
+        order = np.argsort(inverse, kind='stable')
+        starts = np.searchsorted(inverse[order], np.arange(len(classes)))
+        ranks = np.empty(len(labels), dtype=np.int64)
+        ranks[order] = np.arange(len(labels)) - starts[inverse[order]]
+
+        offsets = np.array([self.counts.get(label, 0) for label in classes], dtype=np.int64)
+        index = offsets[inverse] + ranks
+        for label, count in zip(classes, np.bincount(inverse)):
+            self.counts[label] = self.counts.get(label, 0) + int(count)
+        return np.floor((index + 1) * self.fraction) > np.floor(index * self.fraction)
+
+
+class HoldoutSample:
+    """Reservoir sample of at most ``max_rows`` hold-out rows."""
+
+    def __init__(self, max_rows=MAX_HOLDOUT_ROWS, seed=42):
+        self.max_rows = max_rows
+        self.rng = np.random.default_rng(seed)
+        self.seen = 0
+        self.X = None
+        self.y = None
+        self.size = 0
+
+    def add(self, X, y):
+        if self.X is None:
+            self.X = np.empty((self.max_rows, X.shape[1]), dtype=X.dtype)
+            self.y = np.empty(self.max_rows, dtype=object)
+
+        fill = min(len(X), self.max_rows - self.size)
+        self.X[self.size:self.size + fill] = X[:fill]
+        self.y[self.size:self.size + fill] = y[:fill]
+        self.size += fill
+
+        # Algorithm R: row t replaces a random slot with probability max_rows / (t + 1)
+        rest = np.arange(fill, len(X))
+        slots = self.rng.integers(0, self.seen + rest + 1)
+        keep = slots < self.max_rows
+        self.X[slots[keep]] = X[rest[keep]]
+        self.y[slots[keep]] = y[rest[keep]]
+        self.seen += len(X)
+
+    def arrays(self):
+        return self.X[:self.size], self.y[:self.size].astype(str)
@@ -1,5 +1,12 @@
 from django.contrib import admin
-from .models import LearningContent
+from .models import LearningContent, PredictionFeedback
 
 # Register your models here.
 admin.site.register(LearningContent)
+
+
+@admin.register(PredictionFeedback)
+class PredictionFeedbackAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'model_version', 'created_at', 'actual_crop', 'reported_at')
+    list_filter = ('model_version',)
+    readonly_fields = ('features', 'predictions', 'model_version', 'actual_crop', 'reported_at', 'log_row')
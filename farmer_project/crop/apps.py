@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class CropConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'crop'
+
+    def ready(self):
+        from crop import signals  # noqa: F401  (connects the LearningContent receivers)
+
+        if getattr(settings, 'WARMUP_ON_START', False):
+            from farmer_project.warmup import warmup
+            warmup(load_data=False, before_fork=True)
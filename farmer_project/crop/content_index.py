@@ -0,0 +1,59 @@
+"""Process-level index from crop label to LearningContent image URLs.
+
+Built with a single query on first use and dropped by the LearningContent
+signal handlers in ``crop.signals`` whenever an article is saved or deleted,
+so a prediction never needs a per-crop database lookup. Each label maps to
+``(image URL, WebP URL)``: the JPEG thumbnail and the WebP one when
+``crop.thumbnails`` has made them, else the original upload and None.
+"""
+import threading
+
+from crop.models import LearningContent, normalize_title
+
+_lock = threading.Lock()
+_image_urls = None
+# Bumped on every invalidation so a build racing with a save is not published
+_generation = 0
+
+
+def _build_image_urls():
+    storage = LearningContent._meta.get_field('image').storage
+    image_urls = {}
+    rows = LearningContent.objects.exclude(image='').order_by('id').values_list(
+        'title_normalized', 'image', 'thumbnail', 'thumbnail_webp'
+    )
+    for title, image, thumbnail, thumbnail_webp in rows:
+        # Like the old .get() lookup, the first article for a title wins
+        urls = (storage.url(thumbnail), storage.url(thumbnail_webp)) if thumbnail else (storage.url(image), None)
+        image_urls.setdefault(title, urls)
+    return image_urls
+
+
+def get_image_urls():
+    global _image_urls
+    image_urls = _image_urls
+    if image_urls is None:
+        with _lock:
+            generation = _generation
+        image_urls = _build_image_urls()
+        with _lock:
+            if generation == _generation:
+                _image_urls = image_urls
+    return image_urls
+
+
+def crop_image_url(crop, default=None):
+    urls = get_image_urls().get(normalize_title(crop))
+    return urls[0] if urls else default
+
+
+def crop_image_webp_url(crop):
+    urls = get_image_urls().get(normalize_title(crop))
+    return urls[1] if urls else None
+
+
+def invalidate():
+    global _image_urls, _generation
+    with _lock:
+        _image_urls = None
+        _generation += 1
@@ -0,0 +1,95 @@
+"""Keyset-paginated LearningContent pages for the crop information view.
+
+Articles are listed newest first by id. A page is addressed by the id it
+starts after (``?after=``) or ends before (``?before=``), so each page is one
+indexed range query however deep the reader goes, and only the columns the
+cards show are loaded (the description is cut to a summary in SQL).
+
+``version()`` is a timestamp kept in the ``CACHE`` alias and reset by the
+LearningContent signal handlers in ``crop.signals`` on every save or delete.
+It keys the rendered card fragments and doubles as the ETag and
+Last-Modified source, so a change reaches every page at once. ``CACHE`` must
+be shared by all processes (the file-based ``pages`` cache by default): a
+save in one worker, or in ``run_jobs``, has to reset the stamp for all of
+them.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.functions import Left
+
+from crop.models import LearningContent
+
+VERSION_KEY = 'learning-content-version'
+SUMMARY_CHARS = 100
+
+
+def page_settings():
+    return {
+        'PAGE_SIZE': 24,
+        'CACHE': 'pages',
+        'CACHE_TIMEOUT': 600,
+        **getattr(settings, 'LEARNING_CONTENT_PAGES', {}),
+    }
+
+
+def version():
+    cache = caches[page_settings()['CACHE']]
+    stamp = cache.get(VERSION_KEY)
+    if stamp is None:
+        # Nothing recorded (cold or evicted cache): count the content as changed now.
+        # add() keeps a stamp another worker set in the meantime.
+        cache.add(VERSION_KEY, time.time(), None)
+        stamp = cache.get(VERSION_KEY, time.time())
+    return stamp
+
+
+def invalidate():
+    caches[page_settings()['CACHE']].set(VERSION_KEY, time.time(), None)
+
+
+def parse_cursor(params):
+    """Return ``('after' | 'before', id)`` from the query string, or ``(None, None)`` for the first page."""
+    for direction in ('after', 'before'):
+        value = params.get(direction)
+        if value is not None:
+            try:
+                return direction, int(value)
+            except ValueError:
+                break
+    return None, None
+
+
+class ContentPage:
+    def __init__(self, contents, next_after=None, previous_before=None):
+        self.contents = contents
+        self.next_after = next_after
+        self.previous_before = previous_before
+
+
+def get_page(direction=None, cursor=None, page_size=None):
+    page_size = page_size or page_settings()['PAGE_SIZE']
+    # One extra row tells whether there is a page beyond this one
+    queryset = LearningContent.objects.only('id', 'title', 'image', 'thumbnail', 'thumbnail_webp').annotate(
+        summary=Left('description', SUMMARY_CHARS + 1)
+    )
+    if direction == 'before':
+        rows = list(queryset.filter(id__gt=cursor).order_by('id')[:page_size + 1])
+        has_more = len(rows) > page_size
+        contents = rows[:page_size][::-1]
+        has_previous, has_next = has_more, True
+    else:
+        if direction == 'after':
+            queryset = queryset.filter(id__lt=cursor)
+        rows = list(queryset.order_by('-id')[:page_size + 1])
+        contents = rows[:page_size]
+        has_previous, has_next = direction == 'after', len(rows) > page_size
+
+    if not contents:
+        return ContentPage([])
+    return ContentPage(
+        contents,
+        next_after=contents[-1].id if has_next else None,
+        previous_before=contents[0].id if has_previous else None,
+    )
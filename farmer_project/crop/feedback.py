@@ -0,0 +1,99 @@
+"""Prediction feedback: what was recommended, and what the farmer actually grew.
+
+Every recommendation served from the form is stored as a
+``PredictionFeedback`` row (inputs, top predictions, model version), and the
+results page asks the farmer to report the crop they planted, or they report
+it after the season from the list of their unreported recommendations
+(``pending_reports``). A report is
+also appended to the columnar ``FeedbackLog`` in ``FEEDBACK['LOG_DIR']``
+(next to the model artifacts by default), which ``crop_prediction.py
+retrain`` reads to warm-start the model on just the new outcomes. The log is
+append-only, so each outcome can be reported once.
+"""
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from crop.models import PredictionFeedback
+from model_artifacts import FEEDBACK_DIRNAME
+
+_log = None
+_log_lock = threading.Lock()
+
+
+class FeedbackError(Exception):
+    pass
+
+
+def feedback_settings():
+    model_dir = getattr(settings, 'CROP_MODEL', {}).get('DIR', settings.BASE_DIR)
+    return {
+        'ENABLED': True,
+        'PENDING_LIMIT': 50,
+        'LOG_DIR': model_dir / FEEDBACK_DIRNAME,
+        **getattr(settings, 'FEEDBACK', {}),
+    }
+
+
+def get_log():
+    global _log
+    if _log is None:
+        with _log_lock:
+            if _log is None:
+                from feedback_log import FeedbackLog
+                _log = FeedbackLog(feedback_settings()['LOG_DIR'])
+    return _log
+
+
+def record_prediction(user, features, predictions, model_version):
+    """Store a served recommendation and return it.
+
+    Returns None when feedback is disabled or the user is anonymous (nobody
+    could report the outcome). Resubmitting the form with the same inputs
+    returns the user's still unreported row instead of adding another.
+    """
+    if not feedback_settings()['ENABLED'] or user is None or not user.is_authenticated:
+        return None
+    features = [float(value) for value in features]
+    latest = PredictionFeedback.objects.filter(user=user).order_by('-created_at', '-id').first()
+    if (latest is not None and latest.reported_at is None and latest.features == features
+            and latest.model_version == model_version):
+        return latest
+    return PredictionFeedback.objects.create(
+        user=user,
+        features=features,
+        predictions=predictions,
+        model_version=model_version,
+    )
+
+
+def pending_reports(user):
+    """The user's most recent recommendations still waiting for a harvest report, newest first."""
+    return (
+        PredictionFeedback.objects.filter(user=user, reported_at__isnull=True)
+        .order_by('-created_at', '-id')[:feedback_settings()['PENDING_LIMIT']]
+    )
+
+
+def report_outcome(feedback, actual_crop, known_crops):
+    """Record the crop the farmer grew and append it to the feedback log."""
+    actual_crop = ' '.join(str(actual_crop).split()).lower()
+    if actual_crop not in known_crops:
+        raise FeedbackError(f"Unknown crop '{actual_crop}'.")
+    top = feedback.predictions[0] if feedback.predictions else {}
+    with transaction.atomic():
+        # The conditional update makes a second report of the same prediction a no-op
+        updated = PredictionFeedback.objects.filter(pk=feedback.pk, reported_at__isnull=True).update(
+            actual_crop=actual_crop, reported_at=timezone.now(),
+        )
+        if not updated:
+            raise FeedbackError("An outcome was already reported for this recommendation.")
+        # Appended inside the transaction: if it fails, the report is rolled back and can be retried
+        row = get_log().append(
+            feedback.features, actual_crop, top.get('crop', ''), top.get('probability', 0.0) / 100,
+            feedback.model_version,
+        )
+        PredictionFeedback.objects.filter(pk=feedback.pk).update(log_row=row)
+    return row
@@ -0,0 +1,277 @@
+"""Reproducible benchmark of the crop recommendation inference path.
+
+    python manage.py benchmark_inference --output bench.json
+    python manage.py benchmark_inference --baseline bench.json --threshold 0.25
+
+Covers artifact cold-start and load times, single-row latency of
+``get_crop_prediction_context`` with and without the LearningContent image
+lookup, batch throughput of each of the six candidate models (and their fused
+predictors) at several batch sizes, and the disk/memory footprint of every
+artifact. Results are written as JSON so runs can be diffed across retrains;
+``--baseline`` fails the command when a timing regresses past ``--threshold``.
+"""
+import json
+import os
+import pickle
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from unittest import mock
+
+import joblib
+import numpy as np
+import sklearn
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+
+from crop import prediction_views
+from crop.content_index import get_image_urls
+from fused_predictor import FusedPredictor
+from model_artifacts import FUSED_MODEL_FILENAME, MODEL_FILENAME, SCALER_FILENAME
+
+SEED = 42
+DEFAULT_SIZES = [1, 100, 10000, 1000000]
+
+
+def _check_context(context):
+    # Failures come back as "Error ..." cards; timing those would publish meaningless numbers
+    for prediction in context['top_predictions']:
+        if str(prediction['crop']).startswith('Error'):
+            raise CommandError(f"Single-row prediction failed: {prediction['crop']}")
+
+
+def _percentiles(timings):
+    timings = np.asarray(timings) * 1e6
+    return {
+        'p50_us': round(float(np.percentile(timings, 50)), 1),
+        'p90_us': round(float(np.percentile(timings, 90)), 1),
+        'p99_us': round(float(np.percentile(timings, 99)), 1),
+        'mean_us': round(float(timings.mean()), 1),
+    }
+
+
+def _time_calls(func, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _loaded_size(load):
+    """Bytes Python and NumPy allocated for what ``load()`` returns.
+
+    Memory that compiled extensions allocate with plain ``malloc`` (sklearn's
+    tree nodes, for one) is invisible to tracemalloc; ``disk_bytes`` and
+    ``pickled_bytes`` bound those artifacts instead.
+    """
+    tracemalloc.start()
+    try:
+        obj = load()
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del obj
+    return current
+
+
+class Command(BaseCommand):
+    help = 'Benchmark model loading, single-row recommendation latency and batch throughput; prints JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout.')
+        parser.add_argument('--repeats', type=int, default=500, help='Iterations for the single-row latency benchmarks.')
+        parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Batch sizes for the throughput benchmark.')
+        parser.add_argument('--max-seconds', type=float, default=30.0,
+                            help='Skip a batch size when its estimated run time for one model exceeds this budget.')
+        parser.add_argument('--skip-candidates', action='store_true',
+                            help='Only benchmark the deployed artifacts, not the six candidate models.')
+        parser.add_argument('--baseline', help='Earlier results to compare against; exits non-zero on regressions.')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='Allowed relative slowdown against --baseline (0.25 = 25%%).')
+
+    def handle(self, *args, **options):
+        np.random.seed(SEED)
+        model_dir = str(prediction_views.registry.model_dir)
+        results = {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'environment': {
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'sklearn': sklearn.__version__,
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+            },
+            'model_dir': model_dir,
+            'model_version': prediction_views.registry.get().version,
+            'artifacts': self.benchmark_artifacts(model_dir),
+            'single_row': self.benchmark_single_row(options['repeats']),
+        }
+        if not options['skip_candidates']:
+            results['batch_throughput'] = self.benchmark_candidates(options['sizes'], options['max_seconds'])
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stderr.write(f"Benchmark results written to {options['output']}")
+        else:
+            self.stdout.write(output)
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = compare(baseline, results, options['threshold'])
+            for regression in regressions:
+                self.stderr.write(regression)
+            if regressions:
+                raise CommandError(f"{len(regressions)} timing(s) regressed by more than {options['threshold']:.0%}.")
+
+    def benchmark_artifacts(self, model_dir):
+        artifacts = {}
+        loaders = {
+            MODEL_FILENAME: lambda path: joblib.load(path),
+            SCALER_FILENAME: lambda path: joblib.load(path),
+            FUSED_MODEL_FILENAME: FusedPredictor.load,
+        }
+        for filename, load in loaders.items():
+            path = os.path.join(model_dir, filename)
+            if not os.path.exists(path):
+                continue
+            load_timings = _time_calls(lambda: load(path), 20)
+            artifacts[filename] = {
+                'disk_bytes': os.path.getsize(path),
+                'traced_memory_bytes': _loaded_size(lambda: load(path)),
+                'load_ms': round(float(np.median(load_timings)) * 1e3, 3),
+            }
+
+        if MODEL_FILENAME not in artifacts:
+            return artifacts
+        # A fresh interpreter: imports plus the first joblib.load, as a worker pays at startup
+        script = (
+            'import time; start = time.perf_counter(); import joblib; '
+            f'joblib.load({os.path.join(model_dir, MODEL_FILENAME)!r}); '
+            f'joblib.load({os.path.join(model_dir, SCALER_FILENAME)!r}); '
+            'print(time.perf_counter() - start)'
+        )
+        cold_starts = []
+        for _ in range(3):
+            completed = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True)
+            cold_starts.append(float(completed.stdout.strip()))
+        artifacts['cold_start_ms'] = round(min(cold_starts) * 1e3, 1)
+        return artifacts
+
+    def benchmark_single_row(self, repeats):
+        factory = RequestFactory()
+        # Anonymous: predictions are not stored for feedback, so only inference is timed
+        rng = np.random.default_rng(SEED)
+        # Distinct rows so every call misses the prediction cache and reaches the model
+        rows = rng.uniform([0, 5, 5, 10, 15, 4, 20], [140, 145, 205, 43, 99, 9.5, 298], size=(repeats, 7))
+        requests = [
+            factory.post('/recommendation/', dict(zip(prediction_views.FORM_FIELDS, map(str, row))))
+            for row in rows
+        ]
+        for request in requests:
+            request.user = AnonymousUser()
+        get_image_urls()
+        prediction_views.prediction_cache.clear()
+
+        def run_all():
+            prediction_views.prediction_cache.clear()
+            timings = []
+            contexts = []
+            for request in requests:
+                start = time.perf_counter()
+                contexts.append(prediction_views.get_crop_prediction_context(request))
+                timings.append(time.perf_counter() - start)
+            for context in contexts:
+                _check_context(context)
+            return timings
+
+        # Warm-up pass: first-call costs (lazy imports, allocator growth) would skew whichever variant runs first
+        run_all()
+        results = {'with_image_lookup': _percentiles(run_all())}
+        with mock.patch.object(prediction_views, 'crop_image_url', lambda crop, default=None: default), \
+                mock.patch.object(prediction_views, 'crop_image_webp_url', lambda crop: None):
+            results['without_image_lookup'] = _percentiles(run_all())
+
+        # Same request again: served from the prediction cache
+        _check_context(prediction_views.get_crop_prediction_context(requests[0]))
+        results['cache_hit'] = _percentiles(
+            _time_calls(lambda: prediction_views.get_crop_prediction_context(requests[0]), repeats)
+        )
+        results['repeats'] = repeats
+        return results
+
+    def benchmark_candidates(self, sizes, max_seconds):
+        from crop_prediction import build_models, file_path, load_dataset, split_dataset
+        from sklearn.preprocessing import StandardScaler
+
+        X, y, _ = load_dataset(file_path)
+        X_train, X_test, y_train, _ = split_dataset(X, y)
+        scaler = StandardScaler().fit(X_train)
+        X_train_scaled = scaler.transform(X_train)
+        rng = np.random.default_rng(SEED)
+        # Batches drawn from the hold-out rows with a little noise, like fresh sensor readings
+        pool = np.asarray(X_test, dtype=float)
+        spread = pool.std(axis=0) * 0.05
+
+        results = {}
+        for name, model in build_models().items():
+            self.stderr.write(f"Benchmarking {name}...")
+            model.fit(X_train_scaled, y_train)
+            try:
+                fused = FusedPredictor.from_sklearn(model, scaler)
+            except ValueError:
+                fused = None
+            scorers = {'sklearn': lambda batch: model.predict(scaler.transform(batch))}
+            if hasattr(model, 'predict_proba'):
+                scorers['sklearn'] = lambda batch: model.predict_proba(scaler.transform(batch))
+            if fused is not None:
+                scorers['fused'] = fused.predict_proba
+
+            entry = {'pickled_bytes': len(pickle.dumps(model))}
+            for scorer_name, scorer in scorers.items():
+                throughput = {}
+                seconds_per_row = None
+                for size in sizes:
+                    if seconds_per_row is not None and seconds_per_row * size > max_seconds:
+                        throughput[str(size)] = {'skipped': f'estimated {seconds_per_row * size:.0f}s exceeds --max-seconds'}
+                        continue
+                    batch = pool[rng.integers(0, len(pool), size)] + rng.normal(0, spread, (size, pool.shape[1]))
+                    repeats = max(1, min(50, 10000 // size))
+                    seconds = float(np.median(_time_calls(lambda: scorer(batch), repeats)))
+                    seconds_per_row = seconds / size
+                    throughput[str(size)] = {
+                        'seconds': round(seconds, 6),
+                        'rows_per_second': round(size / seconds, 1),
+                    }
+                entry[scorer_name] = throughput
+            results[name] = entry
+        return results
+
+
+def _timings(results, prefix=''):
+    """Flatten every latency/duration figure into ``{'a.b.c': value}``; larger is slower."""
+    flat = {}
+    for key, value in results.items():
+        path = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(_timings(value, path + '.'))
+        elif key.endswith(('_us', '_ms', 'seconds')) and isinstance(value, (int, float)):
+            flat[path] = value
+    return flat
+
+
+def compare(baseline, current, threshold):
+    base = _timings(baseline)
+    regressions = []
+    for path, value in sorted(_timings(current).items()):
+        previous = base.get(path)
+        if previous and value > previous * (1 + threshold):
+            regressions.append(f"{path}: {previous} -> {value} (+{value / previous - 1:.0%})")
+    return regressions
@@ -0,0 +1,133 @@
+"""Cold-start benchmark: how long a fresh process takes to become ready to serve.
+
+    python manage.py benchmark_startup --output startup.json
+    python manage.py benchmark_startup --baseline startup.json --threshold 0.25
+
+Each repeat starts a new interpreter with ``python -X importtime`` that runs
+``django.setup()`` and loads the URLconf, the work every worker and
+``manage.py`` call does before handling anything. Reports the median of the
+process wall time and of each phase, the slowest top-level imports, and
+which heavy libraries (NumPy, scikit-learn, Pillow, the Gemini SDK...) were
+imported; with the lazy imports in place that list should be empty.
+``--baseline`` fails the command when a timing regresses past
+``--threshold``, as in ``benchmark_inference``.
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from crop.management.commands.benchmark_inference import compare
+
+HEAVY_MODULES = ['numpy', 'joblib', 'sklearn', 'scipy', 'PIL', 'google.generativeai', 'grpc', 'matplotlib', 'pandas']
+
+CHILD_SCRIPT = f'''
+import json, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+setup_done = time.perf_counter()
+from django.urls import get_resolver
+get_resolver().url_patterns
+urls_done = time.perf_counter()
+print(json.dumps({{
+    'django_setup_ms': (setup_done - start) * 1000,
+    'urlconf_ms': (urls_done - setup_done) * 1000,
+    'heavy_modules': [name for name in {HEAVY_MODULES!r} if name in sys.modules],
+}}))
+'''
+
+
+def parse_importtime(stderr):
+    """Return ``{module: cumulative microseconds}`` for the top-level imports in ``-X importtime`` output."""
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        # Nested imports are indented further under the module that triggered them
+        if name.startswith('  ') or not cumulative_us.strip().isdigit():
+            continue
+        cumulative[name.strip()] = int(cumulative_us)
+    return cumulative
+
+
+class Command(BaseCommand):
+    help = 'Measure process cold start (django.setup + URLconf) with python -X importtime; prints JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout.')
+        parser.add_argument('--repeats', type=int, default=5, help='Fresh interpreters to start; medians are reported.')
+        parser.add_argument('--top', type=int, default=15, help='How many of the slowest top-level imports to list.')
+        parser.add_argument('--baseline', help='Earlier results to compare against; exits non-zero on regressions.')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='Allowed relative slowdown against --baseline (0.25 = 25%%).')
+
+    def handle(self, *args, **options):
+        if options['repeats'] < 1:
+            raise CommandError('--repeats must be at least 1.')
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE}
+        env.pop('WARMUP_ON_START', None)  # Measure the default, lazy start
+        runs, imports = [], {}
+        for _ in range(options['repeats']):
+            start = time.perf_counter()
+            child = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', CHILD_SCRIPT],
+                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+            )
+            wall_ms = (time.perf_counter() - start) * 1000
+            if child.returncode != 0:
+                raise CommandError(f'Startup run failed:\n{child.stderr[-2000:]}')
+            run = json.loads(child.stdout.strip().splitlines()[-1])
+            run['process_wall_ms'] = wall_ms
+            runs.append(run)
+            for module, cumulative_us in parse_importtime(child.stderr).items():
+                imports.setdefault(module, []).append(cumulative_us)
+
+        slowest = sorted(
+            ((module, statistics.median(values) / 1000) for module, values in imports.items()),
+            key=lambda item: -item[1],
+        )[:options['top']]
+        results = {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'platform': platform.platform(),
+            },
+            'repeats': options['repeats'],
+            'startup': {
+                key: round(statistics.median(run[key] for run in runs), 1)
+                for key in ('process_wall_ms', 'django_setup_ms', 'urlconf_ms')
+            },
+            'heavy_modules_imported': runs[-1]['heavy_modules'],
+            'slowest_top_level_imports': [
+                {'module': module, 'cumulative_ms': round(ms, 1)} for module, ms in slowest
+            ],
+        }
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stderr.write(f"Startup results written to {options['output']}")
+        else:
+            self.stdout.write(output)
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            # Only the phase medians are compared; per-import figures are too noisy
+            regressions = compare({'startup': baseline.get('startup', {})}, {'startup': results['startup']},
+                                  options['threshold'])
+            for regression in regressions:
+                self.stderr.write(regression)
+            if regressions:
+                raise CommandError(f"{len(regressions)} timing(s) regressed by more than {options['threshold']:.0%}.")
@@ -0,0 +1,36 @@
+"""Create thumbnails for LearningContent images that do not have them yet.
+
+    python manage.py generate_thumbnails
+    python manage.py generate_thumbnails --force
+
+New uploads are handled in the background by ``crop.thumbnails``; this
+command backfills articles saved before that existed (or whose background
+job failed), one at a time in the foreground.
+"""
+from django.core.management.base import BaseCommand
+
+from crop import thumbnails
+from crop.models import LearningContent
+
+
+class Command(BaseCommand):
+    help = 'Generate WebP/JPEG thumbnails for LearningContent images that are missing them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Rebuild every thumbnail, e.g. after changing LEARNING_CONTENT_THUMBNAILS.')
+
+    def handle(self, *args, **options):
+        contents = LearningContent.objects.exclude(image='').only('id', 'image', 'thumbnail_source').order_by('id')
+        if options['force']:
+            contents.update(thumbnail_source='')
+        done = failed = 0
+        for content in contents:
+            if not thumbnails.needs_thumbnails(content):
+                continue
+            try:
+                done += thumbnails.generate(content.pk)
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f'{content.pk}: {e}')
+        self.stdout.write(self.style.SUCCESS(f'Generated thumbnails for {done} article(s), {failed} failed.'))
@@ -0,0 +1,24 @@
+"""Import and initialize the model, LLM client, caches and indexes now.
+
+    python manage.py warmup
+    python manage.py warmup --no-data
+
+Prints how long each step took, which is also how much the first request
+after a restart saves. See ``farmer_project.warmup``.
+"""
+import json
+
+from django.core.management.base import BaseCommand
+
+from farmer_project.warmup import warmup
+
+
+class Command(BaseCommand):
+    help = 'Load the prediction model, LLM client, response cache and content/retrieval indexes; prints timings.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-data', action='store_true', help='Skip the steps that query the database.')
+
+    def handle(self, *args, **options):
+        results = warmup(load_data=not options['no_data'])
+        self.stdout.write(json.dumps(results, indent=2))
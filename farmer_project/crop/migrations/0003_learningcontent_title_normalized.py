@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+def populate_title_normalized(apps, schema_editor):
+    LearningContent = apps.get_model('crop', 'LearningContent')
+    contents = list(LearningContent.objects.only('id', 'title'))
+    for content in contents:
+        content.title_normalized = ' '.join(content.title.split()).lower()
+    LearningContent.objects.bulk_update(contents, ['title_normalized'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crop', '0002_learningcontent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='learningcontent',
+            name='title_normalized',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=200),
+            preserve_default=False,
+        ),
+        migrations.RunPython(populate_title_normalized, migrations.RunPython.noop),
+    ]
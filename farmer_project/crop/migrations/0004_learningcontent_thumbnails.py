@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crop', '0003_learningcontent_title_normalized'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='learningcontent',
+            name='thumbnail',
+            field=models.ImageField(blank=True, editable=False, upload_to='learning_images/thumbs/'),
+        ),
+        migrations.AddField(
+            model_name='learningcontent',
+            name='thumbnail_webp',
+            field=models.ImageField(blank=True, editable=False, upload_to='learning_images/thumbs/'),
+        ),
+        migrations.AddField(
+            model_name='learningcontent',
+            name='thumbnail_source',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crop', '0004_learningcontent_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='crop',
+            index=models.Index(fields=['name'], name='crop_name_idx'),
+        ),
+    ]
@@ -0,0 +1,181 @@
+"""Lazy, thread-safe, hot-reloadable access to the crop prediction artifacts.
+
+Nothing is loaded at import time. The first prediction loads the model,
+scaler and (optional) fused predictor; afterwards the registry re-reads the
+small ``model_version.json`` written by ``ML/crop_prediction.py`` at most
+every ``check_interval`` seconds and swaps in a complete new bundle when the
+version changes. Requests in flight keep using the bundle they started with.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import joblib
+import numpy as np
+
+from farmer_project import metrics
+from compact_predictor import CompactForest
+from fused_predictor import FusedPredictor
+from model_artifacts import (
+    COMPACT_MODEL_FILENAME, FUSED_MODEL_FILENAME, MODEL_FILENAME, SCALER_FILENAME, VERSION_FILENAME, file_sha256,
+)
+
+logger = logging.getLogger(__name__)
+
+# Above this many rows sklearn's compiled tree walkers outpace the NumPy fused predictor
+FUSED_MAX_ROWS = 256
+
+
+class ModelNotAvailable(Exception):
+    pass
+
+
+class ModelBundle:
+    """One consistent set of loaded artifacts; never mutated after loading."""
+
+    def __init__(self, version, model, scaler, fused_predictor=None):
+        self.version = version
+        self.model = model
+        self.scaler = scaler
+        self.fused_predictor = fused_predictor
+        self.loaded_at = time.time()
+
+    @property
+    def classes(self):
+        if self.model is not None:
+            return self.model.classes_
+        return self.fused_predictor.classes_
+
+    def predict_top_k(self, input_data, k):
+        """Score a 2-D feature matrix in one vectorized call.
+
+        Returns ``(labels, probabilities)``, both of shape ``(n_rows, k)`` and
+        sorted by descending probability within each row.
+        """
+        sklearn_loaded = self.model is not None and self.scaler is not None
+        if self.fused_predictor is not None and (len(input_data) <= FUSED_MAX_ROWS or not sklearn_loaded):
+            with metrics.timed('inference', metrics.inference_duration, 'fused'):
+                return self.fused_predictor.predict_topk(input_data, k)
+        with metrics.timed('inference', metrics.inference_duration, 'sklearn'):
+            return self._predict_top_k_sklearn(input_data, k)
+
+    def _predict_top_k_sklearn(self, input_data, k):
+        scaled_data = self.scaler.transform(input_data)
+
+        if hasattr(self.model, 'predict_proba'):
+            probabilities = self.model.predict_proba(scaled_data)
+            k = max(1, min(k, probabilities.shape[1]))
+            # Stable sort keeps ties in class order, like sorted() did for a single row
+            top = np.argsort(-probabilities, axis=1, kind='stable')[:, :k]
+            return self.model.classes_[top], np.take_along_axis(probabilities, top, axis=1)
+
+        # Fallback for models without predict_proba (e.g., SVC without probability=True)
+        predicted = self.model.predict(scaled_data)
+        return predicted.reshape(-1, 1), np.ones((len(predicted), 1))
+
+
+class ModelRegistry:
+    def __init__(self, model_dir, mmap_mode=None, check_interval=5.0, prefer_compact=False):
+        self.model_dir = str(model_dir)
+        self.mmap_mode = mmap_mode
+        self.check_interval = check_interval
+        # Serve only the quantized CompactForest when one has been exported; sklearn is never loaded
+        self.prefer_compact = prefer_compact
+        self._bundle = None
+        self._last_error = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def path(self, filename):
+        return os.path.join(self.model_dir, filename)
+
+    def _read_version(self):
+        """Return ``(version, checksums)`` for the artifacts currently on disk.
+
+        Without a version file (artifacts copied in by hand) the version falls
+        back to the artifacts' modification times and sizes.
+        """
+        try:
+            with open(self.path(VERSION_FILENAME)) as f:
+                info = json.load(f)
+            return info['version'], info.get('artifacts', {})
+        except FileNotFoundError:
+            pass
+        parts = []
+        for filename in (MODEL_FILENAME, SCALER_FILENAME, FUSED_MODEL_FILENAME, COMPACT_MODEL_FILENAME):
+            try:
+                stat = os.stat(self.path(filename))
+                parts.append(f'{filename}:{stat.st_mtime_ns}:{stat.st_size}')
+            except OSError:
+                parts.append(f'{filename}:missing')
+        return hashlib.sha256('|'.join(parts).encode()).hexdigest()[:12], {}
+
+    def _load(self, version, checksums):
+        # Refuse a half-written deploy: every artifact listed must match its checksum
+        for filename, expected in checksums.items():
+            if file_sha256(self.path(filename)) != expected:
+                raise ModelNotAvailable(f"Checksum mismatch for {filename} (version {version}).")
+
+        if self.prefer_compact and os.path.exists(self.path(COMPACT_MODEL_FILENAME)):
+            logger.info("Loaded compact crop model version %s from %s", version, self.model_dir)
+            return ModelBundle(version, None, None, CompactForest.load(self.path(COMPACT_MODEL_FILENAME)))
+
+        model = scaler = fused_predictor = None
+        if os.path.exists(self.path(MODEL_FILENAME)) or os.path.exists(self.path(SCALER_FILENAME)):
+            model = joblib.load(self.path(MODEL_FILENAME), mmap_mode=self.mmap_mode)
+            scaler = joblib.load(self.path(SCALER_FILENAME), mmap_mode=self.mmap_mode)
+        if os.path.exists(self.path(FUSED_MODEL_FILENAME)):
+            fused_predictor = FusedPredictor.load(self.path(FUSED_MODEL_FILENAME))
+        if fused_predictor is None and (model is None or scaler is None):
+            raise ModelNotAvailable(f"No model artifacts found in {self.model_dir}.")
+
+        logger.info("Loaded crop model version %s from %s", version, self.model_dir)
+        return ModelBundle(version, model, scaler, fused_predictor)
+
+    def get(self):
+        """Return the current ``ModelBundle``, loading or reloading it if needed.
+
+        Raises ``ModelNotAvailable`` when nothing has ever loaded successfully.
+        """
+        bundle = self._bundle
+        if time.monotonic() < self._next_check:
+            if bundle is None:
+                raise ModelNotAvailable(self._last_error)
+            return bundle
+
+        # While one thread reloads, others keep serving the current bundle
+        if not self._lock.acquire(blocking=bundle is None):
+            return bundle
+        try:
+            if time.monotonic() >= self._next_check:
+                self._next_check = time.monotonic() + self.check_interval
+                self._refresh()
+            bundle = self._bundle
+        finally:
+            self._lock.release()
+
+        if bundle is None:
+            raise ModelNotAvailable(self._last_error)
+        return bundle
+
+    def _refresh(self):
+        # Caller holds the lock
+        try:
+            version, checksums = self._read_version()
+            if self._bundle is None or self._bundle.version != version:
+                self._bundle = self._load(version, checksums)
+                self._last_error = None
+        except Exception as e:
+            self._last_error = f"Error loading model or scaler: {e}"
+            if self._bundle is None:
+                logger.exception("Could not load crop model from %s", self.model_dir)
+            else:
+                logger.exception("Could not reload crop model; still serving version %s", self._bundle.version)
+
+    def reload(self):
+        """Force a version check on the next ``get()``."""
+        self._next_check = 0.0
+        return self.get()
@@ -1,17 +1,53 @@
+from django.conf import settings
 from django.db import models
 from farmer.models import Farmer
 
+
+def normalize_title(title):
+    # Case- and whitespace-insensitive key used to match model labels to content titles
+    return ' '.join(str(title).split()).lower()
+
 class Crop(models.Model):
     name = models.CharField(max_length=100)
 
+    class Meta:
+        indexes = [models.Index(fields=['name'], name='crop_name_idx')]
+
     def __str__(self):
         return self.name
 
 class LearningContent(models.Model):
     title = models.CharField(max_length=200)
+    title_normalized = models.CharField(max_length=200, db_index=True, editable=False)
     description = models.TextField()
     image = models.ImageField(upload_to='learning_images/')
+    # Resized copies made in the background by crop.thumbnails; empty until then
+    thumbnail = models.ImageField(upload_to='learning_images/thumbs/', blank=True, editable=False)
+    thumbnail_webp = models.ImageField(upload_to='learning_images/thumbs/', blank=True, editable=False)
+    thumbnail_source = models.CharField(max_length=100, blank=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def save(self, *args, **kwargs):
+        self.title_normalized = normalize_title(self.title)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'title' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'title_normalized'}
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.title
+
+class PredictionFeedback(models.Model):
+    # One served recommendation; the farmer may later report what was actually grown
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    features = models.JSONField()
+    predictions = models.JSONField()
+    model_version = models.CharField(max_length=20)
     created_at = models.DateTimeField(auto_now_add=True)
+    actual_crop = models.CharField(max_length=100, blank=True)
+    reported_at = models.DateTimeField(null=True, blank=True)
+    # Row of crop.feedback's columnar log holding this outcome
+    log_row = models.PositiveIntegerField(null=True, blank=True, editable=False)
 
     def __str__(self):
-        return self.title
\ No newline at end of file
+        return f'{self.predictions[0]["crop"] if self.predictions else "?"} -> {self.actual_crop or "not reported"}'
@@ -0,0 +1,80 @@
+"""LRU/TTL cache of top-k crop predictions keyed on quantized input features.
+
+Nearby submissions (same district, same soil test lab) round to the same
+key, so repeat requests are answered without touching the model. Entries
+are dropped wholesale whenever the model version being served changes.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class PredictionCache:
+    def __init__(self, feature_names, precision, max_size=10000, ttl=3600):
+        # Decimal places per feature; features missing from ``precision`` are kept at 2
+        self.decimals = [precision.get(name, 2) for name in feature_names]
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def quantize(self, features):
+        return tuple(round(float(value), decimals) for value, decimals in zip(features, self.decimals))
+
+    def _check_version(self, version):
+        # Caller holds the lock. A retrained or replaced model invalidates everything.
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._version = version
+            self._entries.clear()
+
+    def get(self, key, version):
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, version):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
@@ -1,69 +1,215 @@
-import joblib
+import csv
+import io
+import json
+import logging
 import numpy as np
 from django.conf import settings
-import os
-from crop.models import LearningContent # Import LearningContent model
+from crop.content_index import crop_image_url, crop_image_webp_url
+from crop.feedback import record_prediction
+from crop.model_registry import ModelNotAvailable, ModelRegistry
+from crop.prediction_cache import PredictionCache
+from farmer_project import metrics
+from model_artifacts import FEATURE_COLUMNS
 
-# Load the model and scaler
-MODEL_PATH = os.path.join(settings.BASE_DIR, 'best_crop_prediction_model.joblib')
-SCALER_PATH = os.path.join(settings.BASE_DIR, 'scaler.joblib')
+# Names the recommendation form uses for the model's FEATURE_COLUMNS, in the same order
+FORM_FIELDS = ['nitrogen', 'phosphorus', 'potassium', 'temperature', 'humidity', 'ph', 'rainfall']
 
-model = None
-scaler = None
+PLACEHOLDER_IMAGE_URL = "https://via.placeholder.com/150"
+
+logger = logging.getLogger(__name__)
+
+# Artifacts are loaded on first use and hot-reloaded when model_version.json changes
+model_settings = getattr(settings, 'CROP_MODEL', {})
+registry = ModelRegistry(
+    model_settings.get('DIR', settings.BASE_DIR),
+    mmap_mode=model_settings.get('MMAP_MODE'),
+    check_interval=model_settings.get('CHECK_INTERVAL', 5.0),
+    prefer_compact=model_settings.get('COMPACT', False),
+)
+
+cache_settings = getattr(settings, 'PREDICTION_CACHE', {})
+prediction_cache = PredictionCache(
+    FEATURE_COLUMNS,
+    precision=cache_settings.get('PRECISION', {}),
+    max_size=cache_settings.get('MAX_SIZE', 10000),
+    ttl=cache_settings.get('TTL', 3600),
+)
+metrics.register_collector('prediction_cache', prediction_cache.stats)
+
+
+class BatchPredictionError(Exception):
+    """Raised for batch requests that cannot be scored; carries the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def predict_top_k(input_data, k):
+    """Score a 2-D feature matrix with the current model; see ``ModelBundle.predict_top_k``."""
+    return registry.get().predict_top_k(input_data, k)
 
-try:
-    model = joblib.load(MODEL_PATH)
-    scaler = joblib.load(SCALER_PATH)
-except Exception as e:
-    print(f"Error loading model or scaler: {e}")
 
 def get_crop_prediction_context(request, num_predictions=4):
     top_predictions = []
+    feedback = None
+    known_crops = []
     if request.method == 'POST':
         try:
-            N = float(request.POST.get('nitrogen'))
-            P = float(request.POST.get('phosphorus'))
-            K = float(request.POST.get('potassium'))
-            temperature = float(request.POST.get('temperature'))
-            humidity = float(request.POST.get('humidity'))
-            ph = float(request.POST.get('ph'))
-            rainfall = float(request.POST.get('rainfall'))
-
-            input_data = np.array([[N, P, K, temperature, humidity, ph, rainfall]])
-
-            if scaler and model:
-                scaled_data = scaler.transform(input_data)
-
-                if hasattr(model, 'predict_proba'):
-                    probabilities = model.predict_proba(scaled_data)[0]
-                    class_labels = model.classes_
-                    sorted_predictions = sorted(zip(class_labels, probabilities), key=lambda x: x[1], reverse=True)
-
-                    for crop, prob in sorted_predictions[:num_predictions]:
-                        image_url = "https://via.placeholder.com/150" # Default placeholder
-                        try:
-                            learning_content = LearningContent.objects.get(title__iexact=crop) # Case-insensitive match
-                            if learning_content.image:
-                                image_url = learning_content.image.url
-                        except LearningContent.DoesNotExist:
-                            pass # Use default placeholder if not found
-                        
-                        top_predictions.append({'crop': crop, 'probability': round(prob * 100, 2), 'image_url': image_url})
-                else:
-                    # Fallback for models without predict_proba (e.g., SVC without probability=True)
-                    predicted_crop = model.predict(scaled_data)[0]
-                    image_url = "https://via.placeholder.com/150" # Default placeholder
-                    try:
-                        learning_content = LearningContent.objects.get(title__iexact=predicted_crop)
-                        if learning_content.image:
-                            image_url = learning_content.image.url
-                    except LearningContent.DoesNotExist:
-                        pass
-                    top_predictions.append({'crop': predicted_crop, 'probability': 100.0, 'image_url': image_url})
+            features = [float(request.POST.get(field)) for field in FORM_FIELDS]
+            bundle = registry.get()
+
+            if prediction_cache.enabled:
+                # Score the quantized features so every input in a cache bucket gets the same answer
+                quantized = prediction_cache.quantize(features)
+                cache_key = (quantized, num_predictions)
+                cached = prediction_cache.get(cache_key, bundle.version)
+                if cached is None:
+                    labels, probabilities = bundle.predict_top_k(np.array([quantized]), num_predictions)
+                    cached = (labels[0].tolist(), probabilities[0].tolist())
+                    prediction_cache.set(cache_key, cached, bundle.version)
             else:
-                top_predictions.append({'crop': "Error: Model or scaler not loaded.", 'probability': 0.0, 'image_url': "https://via.placeholder.com/150"})
+                labels, probabilities = bundle.predict_top_k(np.array([features]), num_predictions)
+                cached = (labels[0].tolist(), probabilities[0].tolist())
+
+            for crop, prob in zip(*cached):
+                # Case-insensitive match against LearningContent titles, from the in-memory index
+                image_url = crop_image_url(crop, default=PLACEHOLDER_IMAGE_URL)
+                top_predictions.append({
+                    'crop': crop,
+                    'probability': round(prob * 100, 2),
+                    'image_url': image_url,
+                    'image_webp_url': crop_image_webp_url(crop),
+                })
+
+        except ModelNotAvailable:
+            top_predictions.append({'crop': "Error: Model or scaler not loaded.", 'probability': 0.0, 'image_url': PLACEHOLDER_IMAGE_URL})
 
         except Exception as e:
-            top_predictions.append({'crop': f"Error processing input: {e}", 'probability': 0.0, 'image_url': "https://via.placeholder.com/150"})
+            top_predictions = [{'crop': f"Error processing input: {e}", 'probability': 0.0, 'image_url': PLACEHOLDER_IMAGE_URL}]
+
+        else:
+            feedback = _record_feedback(request, features, top_predictions, bundle.version)
+            if feedback is not None:
+                known_crops = sorted(str(crop) for crop in bundle.classes)
+
+    return {'top_predictions': top_predictions, 'feedback': feedback, 'known_crops': known_crops}
+
+
+def _record_feedback(request, features, top_predictions, model_version):
+    # The recommendation is still shown when it cannot be stored for feedback
+    try:
+        return record_prediction(
+            getattr(request, 'user', None), features,
+            [{'crop': p['crop'], 'probability': p['probability']} for p in top_predictions], model_version,
+        )
+    except Exception:
+        logger.exception("Could not record the prediction for feedback")
+        return None
+
+
+def _column_indices(header):
+    # Accept either the dataset column names or the form field names, in any order
+    positions = {name.strip().lower(): i for i, name in enumerate(header)}
+    for names in (FEATURE_COLUMNS, FORM_FIELDS):
+        if all(name.lower() in positions for name in names):
+            return [positions[name.lower()] for name in names]
+    raise BatchPredictionError(f"CSV header must contain the columns {', '.join(FEATURE_COLUMNS)}.")
+
+
+def _rows_from_csv(text):
+    reader = csv.reader(io.StringIO(text))
+    try:
+        indices = _column_indices(next(reader))
+    except StopIteration:
+        raise BatchPredictionError("CSV upload is empty.")
+    width = max(indices) + 1
+    rows = []
+    for row in reader:
+        if not row:
+            continue
+        if len(row) < width:
+            raise BatchPredictionError(f"CSV line {reader.line_num} has {len(row)} fields; expected at least {width}.")
+        rows.append([row[i] for i in indices])
+    return rows
+
+
+def _rows_from_json(rows):
+    if not isinstance(rows, list):
+        raise BatchPredictionError("Expected a JSON array of rows.")
+    parsed = []
+    for row in rows:
+        if isinstance(row, dict):
+            names = FEATURE_COLUMNS if FEATURE_COLUMNS[0] in row else FORM_FIELDS
+            try:
+                row = [row[name] for name in names]
+            except KeyError as e:
+                raise BatchPredictionError(f"Row is missing the feature {e}.")
+        parsed.append(row)
+    return parsed
+
+
+def _read_body(request, max_bytes):
+    # Read the stream directly so large batches are not rejected by DATA_UPLOAD_MAX_MEMORY_SIZE
+    body = request.read(max_bytes + 1)
+    if len(body) > max_bytes:
+        raise BatchPredictionError(f"Request body exceeds {max_bytes} bytes.", status=413)
+    return body
+
+
+def get_batch_prediction_context(request, num_predictions=4):
+    """Score a batch of soil/weather rows posted as JSON or CSV.
+
+    Accepted payloads: a JSON array of rows, a JSON object ``{"rows": [...], "k": 3}``,
+    a ``text/csv`` body, or a multipart upload in the ``file`` field. Rows are
+    lists of the seven features in ``FEATURE_COLUMNS`` order, or objects keyed by
+    the dataset column names or the form field names.
+    """
+    max_rows = getattr(settings, 'BATCH_PREDICTION_MAX_ROWS', 100000)
+    max_bytes = getattr(settings, 'BATCH_PREDICTION_MAX_BYTES', 50 * 1024 * 1024)
+    k = request.GET.get('k', num_predictions)
+
+    try:
+        if 'file' in request.FILES:
+            upload = request.FILES['file']
+            if upload.size > max_bytes:
+                raise BatchPredictionError(f"Upload exceeds {max_bytes} bytes.", status=413)
+            rows = _rows_from_csv(upload.read().decode('utf-8-sig'))
+        elif request.content_type == 'text/csv':
+            rows = _rows_from_csv(_read_body(request, max_bytes).decode('utf-8-sig'))
+        else:
+            payload = json.loads(_read_body(request, max_bytes))
+            if isinstance(payload, dict):
+                k = payload.get('k', k)
+                payload = payload.get('rows')
+            rows = _rows_from_json(payload)
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise BatchPredictionError(f"Could not parse request body: {e}")
+
+    if not rows:
+        raise BatchPredictionError("No rows to score.")
+    if len(rows) > max_rows:
+        raise BatchPredictionError(f"Batch of {len(rows)} rows exceeds the limit of {max_rows}.", status=413)
+
+    try:
+        k = int(k)
+        input_data = np.asarray(rows, dtype=float)
+    except (TypeError, ValueError) as e:
+        raise BatchPredictionError(f"Invalid input: {e}")
+    if k < 1:
+        raise BatchPredictionError("k must be a positive integer.")
+    if input_data.ndim != 2 or input_data.shape[1] != len(FEATURE_COLUMNS):
+        raise BatchPredictionError(f"Each row must have exactly {len(FEATURE_COLUMNS)} features.")
+    if not np.isfinite(input_data).all():
+        raise BatchPredictionError("Features must be finite numbers.")
 
-    return {'top_predictions': top_predictions}
\ No newline at end of file
+    try:
+        labels, probabilities = predict_top_k(input_data, k)
+    except ModelNotAvailable:
+        raise BatchPredictionError("Model or scaler not loaded.", status=503)
+    percentages = np.round(probabilities * 100, 2).tolist()
+    predictions = [
+        [{'crop': crop, 'probability': prob} for crop, prob in zip(row_labels, row_probs)]
+        for row_labels, row_probs in zip(labels.tolist(), percentages)
+    ]
+    return {'count': len(predictions), 'k': labels.shape[1], 'predictions': predictions}
@@ -0,0 +1,211 @@
+"""Local BM25 search over LearningContent, used to ground the chatbot.
+
+Each article is split into passages of about ``PASSAGE_WORDS`` words; the
+title is prepended to every passage so title words count everywhere. The
+inverted index is built with one query on first use and then kept current
+incrementally by the LearningContent signal handlers in ``crop.signals``.
+
+``augment(messages)`` adds the best passages to the latest user message
+before it goes to the LLM. ``direct_answer(question)`` answers simple
+"tell me about <crop>" questions straight from the matching article, with
+no LLM call, when every content word of the question is in that article's
+title and the article clearly outranks the next best one.
+"""
+import math
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+
+from crop.models import LearningContent
+from farmer_project.chat_cache import STOP_WORDS, WORD, stem
+
+K1 = 1.2
+B = 0.75
+# Words that ask for information without saying what about
+QUESTION_WORDS = frozenset(
+    stem(word) for word in 'tell about info information details explain describe know learn give show crops growing'.split()
+)
+
+
+def retrieval_settings():
+    return {
+        'ENABLED': True,
+        'TOP_K': 3,
+        'MIN_SCORE': 1.0,
+        'PASSAGE_WORDS': 80,
+        'DIRECT_ANSWERS': True,
+        'DIRECT_ANSWER_MARGIN': 1.2,
+        'DIRECT_ANSWER_WORDS': 120,
+        **getattr(settings, 'CHATBOT_RETRIEVAL', {}),
+    }
+
+
+def tokenize(text):
+    return [stem(word) for word in WORD.findall(text.lower()) if word not in STOP_WORDS]
+
+
+def split_passages(text, passage_words):
+    words = text.split()
+    return [' '.join(words[i:i + passage_words]) for i in range(0, len(words), passage_words)] or ['']
+
+
+class Passage:
+    __slots__ = ('content_id', 'title', 'text', 'length')
+
+    def __init__(self, content_id, title, text, length):
+        self.content_id = content_id
+        self.title = title
+        self.text = text
+        self.length = length
+
+
+class BM25Index:
+    def __init__(self, passage_words=80):
+        self.passage_words = passage_words
+        self.passages = {}                    # passage id -> Passage
+        self.postings = defaultdict(dict)     # term -> {passage id: term frequency}
+        self.by_content = {}                  # content id -> (passage ids, title terms, description)
+        self.total_length = 0
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def add(self, content_id, title, description):
+        with self._lock:
+            self._remove(content_id)
+            passage_ids = []
+            for text in split_passages(description, self.passage_words):
+                terms = tokenize(f'{title} {text}')
+                passage_id = self._next_id
+                self._next_id += 1
+                self.passages[passage_id] = Passage(content_id, title, text, len(terms))
+                for term, tf in Counter(terms).items():
+                    self.postings[term][passage_id] = tf
+                self.total_length += len(terms)
+                passage_ids.append(passage_id)
+            self.by_content[content_id] = (passage_ids, frozenset(tokenize(title)), description)
+
+    def remove(self, content_id):
+        with self._lock:
+            self._remove(content_id)
+
+    def _remove(self, content_id):
+        # Caller holds the lock
+        entry = self.by_content.pop(content_id, None)
+        if entry is None:
+            return
+        for passage_id in entry[0]:
+            passage = self.passages.pop(passage_id)
+            self.total_length -= passage.length
+            for term in set(tokenize(f'{passage.title} {passage.text}')):
+                postings = self.postings.get(term)
+                if postings is not None:
+                    postings.pop(passage_id, None)
+                    if not postings:
+                        del self.postings[term]
+
+    def search(self, query, k=3):
+        """Return up to ``k`` ``(score, Passage)`` pairs, best first."""
+        with self._lock:
+            n = len(self.passages)
+            if not n:
+                return []
+            avgdl = self.total_length / n
+            scores = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for passage_id, tf in postings.items():
+                    length = self.passages[passage_id].length
+                    scores[passage_id] += idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / avgdl))
+            best = sorted(scores.items(), key=lambda item: -item[1])[:k]
+            return [(score, self.passages[passage_id]) for passage_id, score in best]
+
+    def article(self, content_id):
+        with self._lock:
+            _, title_terms, description = self.by_content[content_id]
+            return title_terms, description
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = BM25Index(retrieval_settings()['PASSAGE_WORDS'])
+                for content_id, title, description in LearningContent.objects.values_list('id', 'title', 'description'):
+                    index.add(content_id, title, description)
+                _index = index
+    return _index
+
+
+def update(content):
+    # Called from the post_save signal. Taking the build lock means a save racing with the
+    # first build is applied after it; an index not built yet picks the article up when it is.
+    with _index_lock:
+        if _index is not None:
+            _index.add(content.pk, content.title, content.description)
+
+
+def remove(content_id):
+    with _index_lock:
+        if _index is not None:
+            _index.remove(content_id)
+
+
+def search(query, k=None):
+    options = retrieval_settings()
+    results = get_index().search(query, k or options['TOP_K'])
+    return [(score, passage) for score, passage in results if score >= options['MIN_SCORE']]
+
+
+def augment(messages):
+    """Return ``messages`` with the best matching passages prepended to the last user message."""
+    options = retrieval_settings()
+    if not options['ENABLED'] or not messages or messages[-1]['role'] != 'user':
+        return messages
+    question = messages[-1]['text']
+    results = search(question)
+    if not results:
+        return messages
+    context = '\n\n'.join(f'[{i}] {passage.title}: {passage.text}' for i, (_, passage) in enumerate(results, 1))
+    text = (
+        'Relevant articles from the CropWise library (use them when they help, and say so):\n'
+        f'{context}\n\nQuestion: {question}'
+    )
+    return messages[:-1] + [{'role': 'user', 'text': text}]
+
+
+def direct_answer(question):
+    """Answer a plain "tell me about <crop>" question from the library, or return None."""
+    options = retrieval_settings()
+    if not (options['ENABLED'] and options['DIRECT_ANSWERS']):
+        return None
+    asked = {term for term in tokenize(question) if term not in QUESTION_WORDS}
+    if not asked:
+        return None
+
+    results = get_index().search(question, k=20)
+    if not results:
+        return None
+    best_score, best = results[0]
+    # Unambiguous: the best article must clearly beat every other article
+    runner_up = next((score for score, passage in results if passage.content_id != best.content_id), 0.0)
+    if runner_up and best_score < runner_up * options['DIRECT_ANSWER_MARGIN']:
+        return None
+    title_terms, description = get_index().article(best.content_id)
+    # Confident only when the question asks about nothing beyond the article's title
+    if not asked <= title_terms:
+        return None
+
+    words = description.split()
+    summary = ' '.join(words[:options['DIRECT_ANSWER_WORDS']])
+    if len(words) > options['DIRECT_ANSWER_WORDS']:
+        summary += '...'
+    return f'**{best.title}**\n\n{summary}\n\n*From the CropWise crop information library.*'
@@ -0,0 +1,44 @@
+import sys
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from crop import content_index, content_pages
+from crop.models import LearningContent
+
+
+def loaded_retrieval():
+    # The BM25 index only exists once crop.retrieval has been imported; until then there is nothing to update
+    return sys.modules.get('crop.retrieval')
+
+
+@receiver(post_save, sender=LearningContent)
+@receiver(post_delete, sender=LearningContent)
+def invalidate_content_index(sender, **kwargs):
+    content_index.invalidate()
+
+
+@receiver(post_save, sender=LearningContent)
+@receiver(post_delete, sender=LearningContent)
+def invalidate_content_pages(sender, **kwargs):
+    content_pages.invalidate()
+
+
+@receiver(post_save, sender=LearningContent)
+def update_retrieval_index(sender, instance, **kwargs):
+    retrieval = loaded_retrieval()
+    if retrieval is not None:
+        retrieval.update(instance)
+
+
+@receiver(post_save, sender=LearningContent)
+def schedule_thumbnails(sender, instance, **kwargs):
+    from crop import thumbnails  # Pillow is only needed once an image is saved
+    thumbnails.schedule(instance)
+
+
+@receiver(post_delete, sender=LearningContent)
+def remove_from_retrieval_index(sender, instance, **kwargs):
+    retrieval = loaded_retrieval()
+    if retrieval is not None:
+        retrieval.remove(instance.pk)
@@ -1,3 +1,433 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+
+from crop import prediction_views, retrieval
+from crop.model_registry import ModelNotAvailable, ModelRegistry
+from crop.prediction_cache import PredictionCache
+from compact_predictor import CompactForest
+from fused_predictor import FusedPredictor
+from model_artifacts import FUSED_MODEL_FILENAME, write_version_file
+
+BATCH_URL = '/api/recommendation/batch/'
+CLASSES = np.array(['rice', 'maize', 'jute'])
+ROW = [90, 42, 43, 20.9, 82.0, 6.5, 202.9]
+CSV_HEADER = 'N,P,K,temperature,humidity,ph,rainfall'
+
+
+def fake_predict_top_k(input_data, k):
+    """Stands in for the model: every row gets rice, maize, jute with fixed probabilities."""
+    k = min(k, len(CLASSES))
+    probabilities = np.tile([0.6, 0.3, 0.1], (len(input_data), 1))[:, :k]
+    return np.tile(CLASSES[:k], (len(input_data), 1)), probabilities
+
+
+class BatchRecommendationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('batch', password='pw')
+        self.client = Client(enforce_csrf_checks=True)
+        self.client.force_login(self.user)
+        self.client.get('/')  # sets the CSRF cookie
+        self.csrf = {'HTTP_X_CSRFTOKEN': self.client.cookies['csrftoken'].value}
+        patcher = mock.patch.object(prediction_views, 'predict_top_k', side_effect=fake_predict_top_k)
+        self.predict = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post_json(self, payload, path=BATCH_URL, **extra):
+        return self.client.post(path, json.dumps(payload), content_type='application/json', **{**self.csrf, **extra})
+
+    def post_csv(self, text, path=BATCH_URL):
+        return self.client.post(path, text, content_type='text/csv', **self.csrf)
+
+    def scored_rows(self):
+        return self.predict.call_args.args[0]
+
+    def test_json_list_of_rows(self):
+        response = self.post_json([ROW, ROW])
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body['count'], body['k']), (2, 3))
+        self.assertEqual(body['predictions'][0][0], {'crop': 'rice', 'probability': 60.0})
+        np.testing.assert_array_equal(self.scored_rows(), [ROW, ROW])
+
+    def test_json_object_rows_by_dataset_or_form_names(self):
+        by_column = dict(zip(['N', 'P', 'K', 'temperature', 'humidity', 'ph', 'rainfall'], ROW))
+        by_field = dict(zip(prediction_views.FORM_FIELDS, ROW))
+        response = self.post_json({'rows': [by_column, by_field], 'k': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['k'], 2)
+        np.testing.assert_array_equal(self.scored_rows(), [ROW, ROW])
+
+    def test_json_object_row_missing_a_feature(self):
+        response = self.post_json([{'N': 1, 'P': 2}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('missing the feature', response.json()['error'])
+
+    def test_csv_with_reordered_headers(self):
+        text = 'rainfall,ph,humidity,temperature,K,P,N,farm\n' + ','.join(map(str, ROW[::-1])) + ',f1\n'
+        response = self.post_csv(text)
+        self.assertEqual(response.status_code, 200)
+        np.testing.assert_array_equal(self.scored_rows(), [ROW])
+
+    def test_csv_upload(self):
+        upload = SimpleUploadedFile('soil.csv', f'{CSV_HEADER}\n{",".join(map(str, ROW))}\n'.encode())
+        response = self.client.post(BATCH_URL, {'file': upload}, **self.csrf)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 1)
+
+    def test_csv_without_the_feature_columns(self):
+        response = self.post_csv('a,b\n1,2\n')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('CSV header must contain', response.json()['error'])
+
+    def test_ragged_csv_row(self):
+        response = self.post_csv(f'{CSV_HEADER}\n{",".join(map(str, ROW))}\n1,2,3\n')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('CSV line 3 has 3 fields', response.json()['error'])
+
+    def test_non_finite_and_non_numeric_rows(self):
+        self.assertEqual(self.post_csv(f'{CSV_HEADER}\n1,2,3,nan,5,6,7\n').status_code, 400)
+        self.assertEqual(self.post_csv(f'{CSV_HEADER}\n1,2,3,inf,5,6,7\n').status_code, 400)
+        self.assertEqual(self.post_json([[1, 2, 3, 'x', 5, 6, 7]]).status_code, 400)
+        self.predict.assert_not_called()
+
+    def test_rows_of_the_wrong_width(self):
+        response = self.post_json([ROW[:6]])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('exactly 7 features', response.json()['error'])
+
+    def test_empty_and_malformed_bodies(self):
+        self.assertEqual(self.post_json([]).status_code, 400)
+        self.assertEqual(self.post_json({'rows': 'nope'}).status_code, 400)
+        response = self.client.post(BATCH_URL, '{not json', content_type='application/json', **self.csrf)
+        self.assertEqual(response.status_code, 400)
+
+    def test_k_bounds(self):
+        self.assertEqual(self.post_json({'rows': [ROW], 'k': 0}).status_code, 400)
+        self.assertEqual(self.post_json({'rows': [ROW], 'k': 'two'}).status_code, 400)
+        self.assertEqual(self.post_json([ROW], path=BATCH_URL + '?k=-1').status_code, 400)
+        # Larger than the number of crops: every crop, best first
+        response = self.post_json({'rows': [ROW], 'k': 50})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['k'], 3)
+
+    @override_settings(BATCH_PREDICTION_MAX_ROWS=2)
+    def test_row_limit(self):
+        self.assertEqual(self.post_json([ROW, ROW]).status_code, 200)
+        self.assertEqual(self.post_json([ROW, ROW, ROW]).status_code, 413)
+
+    @override_settings(BATCH_PREDICTION_MAX_BYTES=100)
+    def test_size_limits(self):
+        self.assertEqual(self.post_json([ROW] * 10).status_code, 413)
+        self.assertEqual(self.post_csv(f'{CSV_HEADER}\n' + f'{",".join(map(str, ROW))}\n' * 10).status_code, 413)
+        upload = SimpleUploadedFile('soil.csv', b'x' * 200)
+        self.assertEqual(self.client.post(BATCH_URL, {'file': upload}, **self.csrf).status_code, 413)
+
+    def test_model_not_available(self):
+        self.predict.side_effect = ModelNotAvailable('no model')
+        self.assertEqual(self.post_json([ROW]).status_code, 503)
+
+    def test_session_request_needs_the_csrf_token(self):
+        response = self.client.post(BATCH_URL, json.dumps([ROW]), content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()['error'], 'CSRF verification failed.')
+
+    def test_anonymous_request(self):
+        response = Client().post(BATCH_URL, json.dumps([ROW]), content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_only_post(self):
+        self.assertEqual(self.client.get(BATCH_URL).status_code, 405)
+
+    @override_settings(BATCH_API_TOKEN='s3cret')
+    def test_bearer_token(self):
+        anonymous = Client(enforce_csrf_checks=True)
+        ok = anonymous.post(BATCH_URL, json.dumps([ROW]), content_type='application/json',
+                            HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(ok.status_code, 200)
+        wrong = anonymous.post(BATCH_URL, json.dumps([ROW]), content_type='application/json',
+                               HTTP_AUTHORIZATION='Bearer nope')
+        self.assertEqual(wrong.status_code, 401)
+        # A wrong token is rejected even when the session would be allowed
+        self.assertEqual(self.post_json([ROW], HTTP_AUTHORIZATION='Bearer nope').status_code, 401)
+
+    def test_bearer_header_without_a_configured_token_uses_the_session(self):
+        response = self.client.post(BATCH_URL, json.dumps([ROW]), content_type='application/json',
+                                    HTTP_AUTHORIZATION='Bearer anything')
+        self.assertEqual(response.status_code, 403)
+
+
+def soil_samples(seed=0, n_rows=400):
+    """Seven-feature, four-crop data in roughly the dataset's units, so the scaler has real work to do."""
+    from sklearn.datasets import make_classification
+
+    X, y = make_classification(n_samples=n_rows, n_features=7, n_informative=5, n_classes=4, random_state=seed)
+    X = X * [10, 5, 3, 1, 20, 0.5, 50] + [50, 40, 40, 25, 70, 6, 100]
+    return X, np.array(['rice', 'maize', 'jute', 'cotton'])[y]
+
+
+class PredictorTestCase(SimpleTestCase):
+    """Fits the scaler and each candidate model once, on a fixed seed."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.preprocessing import StandardScaler
+
+        X, y = soil_samples()
+        cls.scaler = StandardScaler().fit(X)
+        cls.models = {
+            'rf': RandomForestClassifier(n_estimators=20, random_state=0),
+            'gb': GradientBoostingClassifier(n_estimators=20, random_state=0),
+            'lr': LogisticRegression(max_iter=1000),
+        }
+        for model in cls.models.values():
+            model.fit(cls.scaler.transform(X), y)
+        # Unseen rows near the training data; more than a BLOCK_SIZE so blocked scoring is covered too
+        rng = np.random.default_rng(1)
+        cls.X_test = X[rng.integers(0, len(X), 700)] + rng.normal(0, 0.5, (700, 7))
+
+    def sklearn_proba(self, model):
+        return model.predict_proba(self.scaler.transform(self.X_test))
+
+
+class FusedPredictorTests(PredictorTestCase):
+    def test_predict_proba_matches_sklearn(self):
+        for name, model in self.models.items():
+            with self.subTest(model=name):
+                fused = FusedPredictor.from_sklearn(model, self.scaler)
+                np.testing.assert_array_equal(fused.classes_, model.classes_)
+                np.testing.assert_allclose(fused.predict_proba(self.X_test), self.sklearn_proba(model), atol=1e-9)
+                # A single row takes the dense path
+                np.testing.assert_allclose(fused.predict_proba(self.X_test[0]), self.sklearn_proba(model)[:1],
+                                           atol=1e-9)
+
+    def test_predict_topk_is_sorted_best_first(self):
+        fused = FusedPredictor.from_sklearn(self.models['rf'], self.scaler)
+        labels, probabilities = fused.predict_topk(self.X_test[:5], 3)
+        self.assertEqual(labels.shape, (5, 3))
+        self.assertTrue((np.diff(probabilities, axis=1) <= 0).all())
+        np.testing.assert_array_equal(labels[:, 0], self.models['rf'].predict(self.scaler.transform(self.X_test[:5])))
+
+    def test_save_and_load(self):
+        fused = FusedPredictor.from_sklearn(self.models['gb'], self.scaler)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'fused.npz')
+            fused.save(path)
+            loaded = FusedPredictor.load(path)
+        np.testing.assert_allclose(loaded.predict_proba(self.X_test), fused.predict_proba(self.X_test))
+
+
+class CompactForestTests(PredictorTestCase):
+    def test_top_choice_agrees_with_the_forest(self):
+        forest = self.models['rf']
+        compact = CompactForest.from_sklearn(forest, self.scaler)
+        expected = self.sklearn_proba(forest)
+        agreement = (compact.predict(self.X_test) == forest.classes_[expected.argmax(axis=1)]).mean()
+        self.assertGreaterEqual(agreement, 0.99)
+        # Leaf distributions are quantized to 1/65535 steps
+        np.testing.assert_allclose(compact.predict_proba(self.X_test), expected, atol=1e-4)
+
+    def test_truncated_forest_mostly_agrees(self):
+        forest = self.models['rf']
+        compact = CompactForest.from_sklearn(forest, self.scaler, max_trees=10, max_depth=6)
+        self.assertEqual(compact.n_trees, 10)
+        self.assertLessEqual(compact.depth, 6)
+        agreement = (compact.predict(self.X_test) == forest.predict(self.scaler.transform(self.X_test))).mean()
+        self.assertGreaterEqual(agreement, 0.8)
+
+    def test_save_and_load(self):
+        compact = CompactForest.from_sklearn(self.models['rf'], self.scaler)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'compact.npz')
+            compact.save(path)
+            loaded = CompactForest.load(path)
+        np.testing.assert_array_equal(loaded.predict_proba(self.X_test), compact.predict_proba(self.X_test))
+
+    def test_only_tree_models(self):
+        with self.assertRaises(ValueError):
+            CompactForest.from_sklearn(self.models['gb'], self.scaler)
+
+
+class PredictionCacheTests(SimpleTestCase):
+    def cache(self, **options):
+        return PredictionCache(['N', 'ph', 'rainfall'], {'N': 0, 'ph': 1}, **options)
+
+    def test_nearby_inputs_share_a_key(self):
+        cache = self.cache()
+        self.assertEqual(cache.quantize([90.4, 6.52, 202.904]), (90, 6.5, 202.9))
+        self.assertEqual(cache.quantize([89.6, 6.48, 202.9]), cache.quantize([90.4, 6.52, 202.904]))
+        self.assertNotEqual(cache.quantize([91, 6.5, 202.9]), cache.quantize([90, 6.5, 202.9]))
+        cache.set(cache.quantize([90.4, 6.52, 202.904]), 'rice', 'v1')
+        self.assertEqual(cache.get(cache.quantize([89.6, 6.48, 202.9]), 'v1'), 'rice')
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    def test_expired_entries_miss(self):
+        cache = self.cache(ttl=-1)
+        cache.set((90, 6.5, 202.9), 'rice', 'v1')
+        self.assertIsNone(cache.get((90, 6.5, 202.9), 'v1'))
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_new_model_version_invalidates_everything(self):
+        cache = self.cache()
+        cache.set((90, 6.5, 202.9), 'rice', 'v1')
+        cache.set((20, 7.0, 60.0), 'maize', 'v1')
+        self.assertIsNone(cache.get((90, 6.5, 202.9), 'v2'))
+        stats = cache.stats()
+        self.assertEqual((stats['size'], stats['invalidations']), (0, 1))
+        # Switching back does not resurrect the old entries
+        self.assertIsNone(cache.get((20, 7.0, 60.0), 'v1'))
+
+    def test_evicts_least_recently_used(self):
+        cache = self.cache(max_size=2)
+        cache.set((1, 1.0, 1.0), 'a', 'v1')
+        cache.set((2, 2.0, 2.0), 'b', 'v1')
+        cache.get((1, 1.0, 1.0), 'v1')
+        cache.set((3, 3.0, 3.0), 'c', 'v1')
+        self.assertEqual(cache.get((1, 1.0, 1.0), 'v1'), 'a')
+        self.assertIsNone(cache.get((2, 2.0, 2.0), 'v1'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_zero_size_disables_the_cache(self):
+        cache = self.cache(max_size=0)
+        self.assertFalse(cache.enabled)
+        cache.set((90, 6.5, 202.9), 'rice', 'v1')
+        self.assertIsNone(cache.get((90, 6.5, 202.9), 'v1'))
+
+
+class ModelRegistryTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.preprocessing import StandardScaler
+
+        cls.X, y = soil_samples()
+        scaler = StandardScaler().fit(cls.X)
+        # Two "deploys" that differ in their predictions
+        cls.predictors = [
+            FusedPredictor.from_sklearn(LogisticRegression(C=C, max_iter=1000).fit(scaler.transform(cls.X), y), scaler)
+            for C in (1.0, 0.01)
+        ]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.model_dir = directory.name
+
+    def publish(self, predictor):
+        predictor.save(os.path.join(self.model_dir, FUSED_MODEL_FILENAME))
+        return write_version_file(self.model_dir, [FUSED_MODEL_FILENAME])
+
+    def test_loads_lazily_on_first_use(self):
+        version = self.publish(self.predictors[0])
+        registry = ModelRegistry(self.model_dir)
+        self.assertIsNone(registry._bundle)
+        bundle = registry.get()
+        self.assertEqual(bundle.version, version)
+        labels, probabilities = bundle.predict_top_k(self.X[:2], 3)
+        self.assertEqual(labels.shape, (2, 3))
+        self.assertIs(registry.get(), bundle)
+
+    def test_nothing_to_load(self):
+        registry = ModelRegistry(self.model_dir)
+        with self.assertLogs('crop.model_registry', 'ERROR'), self.assertRaises(ModelNotAvailable):
+            registry.get()
+
+    def test_new_version_is_picked_up_after_the_check_interval(self):
+        first = self.publish(self.predictors[0])
+        registry = ModelRegistry(self.model_dir, check_interval=60)
+        registry.get()
+        second = self.publish(self.predictors[1])
+        self.assertNotEqual(first, second)
+        self.assertEqual(registry.get().version, first)
+        self.assertEqual(registry.reload().version, second)
+
+    def test_checksum_mismatch_keeps_serving_the_old_version(self):
+        first = self.publish(self.predictors[0])
+        registry = ModelRegistry(self.model_dir)
+        old = registry.get()
+        second = self.publish(self.predictors[1])
+        # A half-copied deploy: the version file lists a checksum the artifact does not have
+        with open(os.path.join(self.model_dir, FUSED_MODEL_FILENAME), 'ab') as f:
+            f.write(b'truncated')
+        with self.assertLogs('crop.model_registry', 'ERROR') as logs:
+            self.assertIs(registry.reload(), old)
+        self.assertIn(f'still serving version {first}', logs.output[0])
+        self.assertIn('Checksum mismatch', registry._last_error)
+
+        self.publish(self.predictors[1])
+        bundle = registry.reload()
+        self.assertEqual(bundle.version, second)
+        np.testing.assert_allclose(bundle.predict_top_k(self.X[:5], 1)[1],
+                                   self.predictors[1].predict_topk(self.X[:5], 1)[1])
+
+
+ARTICLES = [
+    (1, 'Rice', 'Rice grows best in flooded clay soils with warm temperatures and heavy monsoon rainfall.'),
+    (2, 'Maize', 'Maize needs well drained loam, full sun and a generous nitrogen dose at knee height.'),
+    (3, 'Rice Blast Disease', 'Rice blast is a fungal disease that spreads in humid weather; resistant rice varieties help.'),
+]
+
+
+class RetrievalTests(SimpleTestCase):
+    def setUp(self):
+        self.index = retrieval.BM25Index()
+        for article in ARTICLES:
+            self.index.add(*article)
+        patcher = mock.patch.object(retrieval, '_index', self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_direct_answer_from_the_matching_title(self):
+        answer = retrieval.direct_answer('Tell me about maize')
+        self.assertTrue(answer.startswith('**Maize**\n\nMaize needs well drained loam'))
+        self.assertTrue(answer.endswith('*From the CropWise crop information library.*'))
+
+    def test_question_beyond_the_title_goes_to_the_llm(self):
+        # Maize is the best match, but the question asks about more than the article's title
+        self.assertEqual(self.index.search('how much nitrogen does maize need', k=1)[0][1].title, 'Maize')
+        self.assertIsNone(retrieval.direct_answer('How much nitrogen does maize need?'))
+
+    def test_best_article_must_clear_the_margin(self):
+        # "rice" is in two titles, and neither article clearly outranks the other
+        self.assertIsNone(retrieval.direct_answer('Tell me about rice'))
+        with override_settings(CHATBOT_RETRIEVAL={'DIRECT_ANSWER_MARGIN': 1.0}):
+            self.assertIsNotNone(retrieval.direct_answer('Tell me about rice'))
+        with override_settings(CHATBOT_RETRIEVAL={'DIRECT_ANSWER_MARGIN': 100}):
+            # A lone match has no runner-up to beat
+            self.assertIsNotNone(retrieval.direct_answer('Tell me about maize'))
+
+    def test_no_direct_answer_without_a_subject_or_when_disabled(self):
+        self.assertIsNone(retrieval.direct_answer('Tell me about'))
+        self.assertIsNone(retrieval.direct_answer('Tell me about sorghum'))
+        with override_settings(CHATBOT_RETRIEVAL={'DIRECT_ANSWERS': False}):
+            self.assertIsNone(retrieval.direct_answer('Tell me about maize'))
+
+    @override_settings(CHATBOT_RETRIEVAL={'DIRECT_ANSWER_WORDS': 3})
+    def test_long_articles_are_cut_short(self):
+        self.assertIn('Maize needs well...', retrieval.direct_answer('Tell me about maize'))
+
+    def test_removed_articles_are_not_served(self):
+        self.index.remove(2)
+        self.assertIsNone(retrieval.direct_answer('Tell me about maize'))
+        self.assertEqual(self.index.search('maize'), [])
+
+    def test_augment_adds_matching_passages_to_the_last_question(self):
+        messages = [{'role': 'user', 'text': 'hi'}, {'role': 'model', 'text': 'hello'},
+                    {'role': 'user', 'text': 'How do I stop blast in my rice?'}]
+        augmented = retrieval.augment(messages)
+        self.assertEqual(augmented[:2], messages[:2])
+        self.assertIn('[1] Rice Blast Disease:', augmented[-1]['text'])
+        self.assertTrue(augmented[-1]['text'].endswith('Question: How do I stop blast in my rice?'))
+        # Nothing relevant: the question is sent as asked
+        self.assertEqual(retrieval.augment([{'role': 'user', 'text': 'What about sorghum?'}])[-1]['text'],
+                         'What about sorghum?')
@@ -0,0 +1,132 @@
+"""Resized WebP and JPEG thumbnails for LearningContent images.
+
+When an article is saved with an image that has no thumbnails yet, the
+LearningContent signal handler in ``crop.signals`` schedules ``generate`` on
+a small background thread pool once the transaction commits, so uploads do
+not wait for Pillow. Thumbnails are named after a hash of the source bytes
+(``learning_images/thumbs/<hash>-<width>.webp``): the same image is never
+processed twice, and a new upload always gets a new URL, so the files can be
+served with a far-future ``Cache-Control``. ``thumbnail_source`` records which
+image the thumbnails were made from. With ``QUEUE`` set, a ``thumbnails`` job
+is queued for ``manage.py run_jobs`` instead, so the work survives restarts
+and runs outside the web processes. ``python manage.py generate_thumbnails``
+backfills existing articles.
+"""
+import hashlib
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from crop import content_index, content_pages
+from crop.models import LearningContent
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_DIR = 'learning_images/thumbs'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def thumbnail_settings():
+    return {
+        'WIDTH': 640,
+        'JPEG_QUALITY': 82,
+        'WEBP_QUALITY': 80,
+        'WORKERS': 1,
+        'BACKGROUND': True,
+        'QUEUE': False,
+        **getattr(settings, 'LEARNING_CONTENT_THUMBNAILS', {}),
+    }
+
+
+def needs_thumbnails(content):
+    return bool(content.image) and content.thumbnail_source != content.image.name
+
+
+def render(source_bytes, width, jpeg_quality, webp_quality):
+    """Return ``(webp_bytes, jpeg_bytes)`` for an image scaled down to at most ``width`` pixels wide."""
+    with Image.open(io.BytesIO(source_bytes)) as image:
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        if image.width > width:
+            image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        webp, jpeg = io.BytesIO(), io.BytesIO()
+        image.save(webp, 'WEBP', quality=webp_quality, method=4)
+        image.save(jpeg, 'JPEG', quality=jpeg_quality, optimize=True, progressive=True)
+    return webp.getvalue(), jpeg.getvalue()
+
+
+def _store(storage, name, data):
+    # Content-addressed names: an existing file already holds exactly these bytes
+    if not storage.exists(name):
+        storage.save(name, ContentFile(data))
+    return name
+
+
+def generate(content_id):
+    """Build and attach the thumbnails for one article; return True if it was updated."""
+    options = thumbnail_settings()
+    content = LearningContent.objects.filter(pk=content_id).only('id', 'image', 'thumbnail_source').first()
+    if content is None or not needs_thumbnails(content):
+        return False
+    source_name = content.image.name
+    storage = content.image.storage
+    with storage.open(source_name, 'rb') as source:
+        source_bytes = source.read()
+    digest = hashlib.sha256(source_bytes).hexdigest()[:16]
+    width = options['WIDTH']
+    webp, jpeg = render(source_bytes, width, options['JPEG_QUALITY'], options['WEBP_QUALITY'])
+    webp_name = _store(storage, f'{THUMBNAIL_DIR}/{digest}-{width}.webp', webp)
+    jpeg_name = _store(storage, f'{THUMBNAIL_DIR}/{digest}-{width}.jpg', jpeg)
+
+    # update() skips post_save, so this does not schedule itself again. The image filter
+    # leaves an article alone if a newer upload replaced the image while we worked.
+    updated = LearningContent.objects.filter(pk=content_id, image=source_name).update(
+        thumbnail=jpeg_name, thumbnail_webp=webp_name, thumbnail_source=source_name,
+    )
+    if updated:
+        content_index.invalidate()
+        content_pages.invalidate()
+    return bool(updated)
+
+
+def _run(content_id):
+    try:
+        generate(content_id)
+    except Exception:
+        logger.exception("Thumbnail generation failed for LearningContent %s", content_id)
+    finally:
+        # Worker threads hold their own database connections
+        close_old_connections()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=thumbnail_settings()['WORKERS'], thread_name_prefix='thumbnails',
+                )
+    return _executor
+
+
+def schedule(content):
+    """Generate thumbnails for ``content`` after the current transaction commits."""
+    if not needs_thumbnails(content):
+        return
+    content_id = content.pk
+    options = thumbnail_settings()
+    if options['QUEUE']:
+        from jobs.queue import enqueue
+        transaction.on_commit(lambda: enqueue('thumbnails', {'content_id': content_id}, max_attempts=3))
+    elif options['BACKGROUND']:
+        transaction.on_commit(lambda: _get_executor().submit(_run, content_id))
+    else:
+        transaction.on_commit(lambda: _run(content_id))
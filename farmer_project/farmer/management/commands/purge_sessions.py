@@ -0,0 +1,81 @@
+"""Delete expired sessions from the database and from file-based caches.
+
+    python manage.py purge_sessions
+    python manage.py purge_sessions --cache sessions chat --batch-size 500
+
+Unlike ``clearsessions``, expired ``django_session`` rows are deleted in
+batches of ``--batch-size``, each in its own short transaction, so a large
+backlog never holds the SQLite write lock for long. The table is purged
+whatever ``SESSION_ENGINE`` is, since rows written before a switch to the
+cache engine stay behind. File-based cache entries expire only when read,
+so the expired files of each ``--cache`` alias are removed as well.
+"""
+import os
+import pickle
+import time
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = 'Delete expired sessions in batches from the database and file-based session/chat caches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows deleted per transaction.')
+        parser.add_argument('--cache', nargs='*', default=[settings.SESSION_CACHE_ALIAS],
+                            help='File-based cache aliases to sweep for expired entries.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+        rows = self.purge_table(options['batch_size'])
+        self.stdout.write(f'Deleted {rows} expired session row(s) from the database.')
+        for alias in options['cache']:
+            if alias not in settings.CACHES:
+                raise CommandError(f'Unknown cache alias: {alias}')
+            cache = caches[alias]
+            if not isinstance(cache, FileBasedCache):
+                self.stdout.write(f'Skipped cache "{alias}": only file-based caches keep expired entries on disk.')
+                continue
+            files = self.purge_file_cache(settings.CACHES[alias]['LOCATION'])
+            self.stdout.write(f'Deleted {files} expired entries from cache "{alias}".')
+        self.stdout.write(self.style.SUCCESS('Done.'))
+
+    def purge_table(self, batch_size):
+        now = timezone.now()
+        deleted = 0
+        while True:
+            with transaction.atomic():
+                keys = list(
+                    Session.objects.filter(expire_date__lt=now).values_list('session_key', flat=True)[:batch_size]
+                )
+                if not keys:
+                    return deleted
+                deleted += Session.objects.filter(session_key__in=keys).delete()[0]
+
+    def purge_file_cache(self, directory):
+        # FileBasedCache writes each entry as the pickled expiry time (None for never) followed by
+        # the zlib-compressed pickled value, so only the first object needs reading
+        now = time.time()
+        deleted = 0
+        for name in os.listdir(directory):
+            if not name.endswith(FileBasedCache.cache_suffix):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                with open(path, 'rb') as f:
+                    expires = pickle.load(f)
+                if expires is not None and expires < now:
+                    os.remove(path)
+                    deleted += 1
+            except FileNotFoundError:
+                pass  # Deleted or replaced by a request meanwhile
+            except (EOFError, pickle.UnpicklingError):
+                pass  # Not a cache entry; leave it alone
+        return deleted
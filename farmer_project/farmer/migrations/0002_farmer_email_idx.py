@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farmer', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='farmer',
+            index=models.Index(fields=['email'], name='farmer_email_idx'),
+        ),
+    ]
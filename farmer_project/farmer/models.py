@@ -6,5 +6,8 @@ class Farmer(models.Model):
     phone_number = models.CharField(max_length=15)
     address = models.TextField()
 
+    class Meta:
+        indexes = [models.Index(fields=['email'], name='farmer_email_idx')]
+
     def __str__(self):
         return self.name
@@ -1,3 +1,50 @@
-from django.test import TestCase
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+
+class PurgeSessionsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache_dir = directory.name
+        settings_patch = override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'files': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': self.cache_dir},
+        })
+        settings_patch.enable()
+        self.addCleanup(settings_patch.disable)
+
+    def purge(self, *args):
+        out = StringIO()
+        call_command('purge_sessions', *args, stdout=out)
+        return out.getvalue()
+
+    def test_deletes_expired_rows_in_batches(self):
+        past, future = timezone.now() - timedelta(days=1), timezone.now() + timedelta(days=1)
+        for n in range(5):
+            Session.objects.create(session_key=f'old{n}', session_data='', expire_date=past)
+        Session.objects.create(session_key='live', session_data='', expire_date=future)
+        self.assertIn('Deleted 5 expired session row(s)', self.purge('--batch-size', '2', '--cache'))
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['live'])
+
+    def test_removes_only_expired_file_cache_entries(self):
+        cache = caches['files']
+        cache.set('expired', 'x', -1)
+        cache.set('live', 'y', 3600)
+        cache.set('forever', 'z', None)
+        with open(os.path.join(self.cache_dir, 'notes.txt'), 'w') as f:
+            f.write('not a cache entry')
+
+        output = self.purge('--cache', 'files', 'default')
+        self.assertIn('Deleted 1 expired entries from cache "files"', output)
+        self.assertIn('Skipped cache "default"', output)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 3)
+        self.assertEqual((cache.get('live'), cache.get('forever')), ('y', 'z'))
@@ -12,5 +12,8 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'farmer_project.settings')
+# Under ASGI each request's sync work may run on a different thread, and a connection kept
+# open past the request is only closed by its own thread, so persistent connections pile up
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
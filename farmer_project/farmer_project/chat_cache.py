@@ -0,0 +1,197 @@
+"""Response cache for stand-alone chatbot questions: exact and near-duplicate matches.
+
+Questions are normalized (case, punctuation, whitespace) and looked up by
+hash first. On a miss, an optional similarity index compares a hashed
+bag-of-words embedding of the question (light suffix stemming, stop words
+dropped, unit length) against every cached question with one matrix product,
+so "yellow leaves on rice" can answer "rice leaves turning yellow". A
+single word such as the crop, the nutrient or a number carries only a small
+share of that similarity, yet changes the answer, so a near-duplicate is only
+served when both questions name the same crops, nutrients and numbers
+(``key_terms``). The index is off unless ``similarity`` is set. Entries
+expire after ``ttl`` seconds and the least recently used entry is evicted
+once ``max_size`` is reached. Everything is in process memory; the embedding
+matrix starts small and doubles as entries are added (``dim * 4`` bytes an
+entry), so a mostly empty cache does not hold ``max_size`` rows.
+"""
+import hashlib
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+INITIAL_ROWS = 64
+WORD = re.compile(r'[a-z0-9]+')
+STOP_WORDS = frozenset(
+    'a an and are as at be but by can do does for from how i in is it its my me of on or should so '
+    'that the their there these this to was what when where which why will with you your'.split()
+)
+# Words that change the answer however similar the rest of the question is (compared stemmed)
+CROP_WORDS = (
+    'apple bajra banana barley bean blackgram brinjal cabbage cardamom carrot cashew cauliflower chickpea '
+    'chilli coconut coffee corn cotton cucumber garlic ginger gram grape groundnut jowar jute kidneybeans '
+    'lentil maize mango millet mothbeans mungbean muskmelon mustard oat okra onion orange papaya pea '
+    'peanut pepper pigeonpeas pomegranate potato pulse ragi rice rubber sesame sorghum soybean sugarcane '
+    'sunflower tea tobacco tomato turmeric watermelon wheat'
+).split()
+NUTRIENT_WORDS = (
+    'boron calcium copper dap iron magnesium manganese molybdenum n nitrogen npk p phosphorus potash '
+    'potassium k sulfur sulphur urea zinc ph'
+).split()
+
+
+def normalize(text):
+    return ' '.join(WORD.findall(text.lower()))
+
+
+def stem(word):
+    for suffix in ('ing', 'ies', 'es', 'ed', 's'):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+KEY_WORDS = frozenset(stem(word) for word in CROP_WORDS + NUTRIENT_WORDS)
+
+
+def key_terms(text):
+    """The crops, nutrients and numbers in ``text``; near-duplicates must agree on all of them."""
+    terms = set()
+    for word in WORD.findall(text.lower()):
+        word = stem(word)
+        if word in KEY_WORDS or word[0].isdigit():
+            terms.add(word)
+    return frozenset(terms)
+
+
+def embed(text, dim):
+    """Signed feature-hashing embedding of the question's stemmed content words, L2-normalized."""
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in WORD.findall(text.lower()):
+        if word in STOP_WORDS:
+            continue
+        h = zlib.crc32(stem(word).encode())
+        vector[h % dim] += 1.0 if (h >> 31) & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class ResponseCache:
+    def __init__(self, max_size=2000, ttl=6 * 3600, similarity=None, dim=4096):
+        # similarity=None (the default) leaves the near-duplicate index off; only exact matches are served
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity = similarity
+        self.dim = dim
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires_at, response, row, key_terms)
+        self._vectors = None
+        self._row_keys = []
+        self._free_rows = []
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    @staticmethod
+    def key(question):
+        return hashlib.sha256(normalize(question).encode()).hexdigest()
+
+    def _drop(self, key):
+        # Caller holds the lock
+        _, _, row, _ = self._entries.pop(key)
+        if self._vectors is not None:
+            self._vectors[row] = 0.0
+        self._row_keys[row] = None
+        self._free_rows.append(row)
+
+    def _new_row(self):
+        # Caller holds the lock. Reuse a freed row, else add one (growing the matrix), else evict
+        if not self._free_rows and len(self._row_keys) < self.max_size:
+            row = len(self._row_keys)
+            self._row_keys.append(None)
+            if self.similarity and (self._vectors is None or row == len(self._vectors)):
+                rows = min(self.max_size, max(INITIAL_ROWS, 2 * row))
+                vectors = np.zeros((rows, self.dim), dtype=np.float32)
+                if self._vectors is not None:
+                    vectors[:row] = self._vectors
+                self._vectors = vectors
+            return row
+        while not self._free_rows:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+        return self._free_rows.pop()
+
+    def get(self, question):
+        """Return the cached response for ``question`` (or a near-duplicate of it), else None."""
+        if not self.enabled:
+            return None
+        key = self.key(question)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] >= now:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry[1]
+            if entry is not None:
+                self._drop(key)
+
+            if self._vectors is not None and self._entries:
+                scores = self._vectors[:len(self._row_keys)] @ embed(question, self.dim)
+                terms = key_terms(question)
+                candidates = np.flatnonzero(scores >= self.similarity)
+                for row in candidates[np.argsort(-scores[candidates], kind='stable')]:
+                    similar_key = self._row_keys[row]
+                    if similar_key is None:
+                        continue
+                    expires_at, response, _, similar_terms = self._entries[similar_key]
+                    if expires_at < now:
+                        self._drop(similar_key)
+                    elif similar_terms == terms:
+                        self._entries.move_to_end(similar_key)
+                        self.similar_hits += 1
+                        return response
+            self.misses += 1
+            return None
+
+    def set(self, question, response):
+        if not self.enabled:
+            return
+        key = self.key(question)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            row = self._new_row()
+            if self._vectors is not None:
+                self._vectors[row] = embed(question, self.dim)
+            self._row_keys[row] = key
+            self._entries[key] = (time.monotonic() + self.ttl, response, row, key_terms(question))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._vectors = None
+            self._row_keys = []
+            self._free_rows = []
+
+    def stats(self):
+        with self._lock:
+            hits = self.exact_hits + self.similar_hits
+            lookups = hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'exact_hits': self.exact_hits,
+                'similar_hits': self.similar_hits,
+                'misses': self.misses,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+            }
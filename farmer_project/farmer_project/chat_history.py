@@ -0,0 +1,123 @@
+"""Chatbot conversation history kept outside the session, within a token budget.
+
+The session only stores a short ``chat_id``; the turns live in the ``CACHE``
+alias from ``settings.CHAT_HISTORY`` under that id. Recent turns are kept
+verbatim while they fit in ``TOKEN_BUDGET``; older turns are folded into a
+short extractive digest (the first sentence of each message, capped at
+``DIGEST_TOKENS``) that is sent ahead of them, so neither the prompt nor the
+stored history grows with the length of the chat.
+"""
+import re
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+SESSION_KEY = 'chat_id'
+SENTENCE_END = re.compile(r'(?<=[.!?])\s')
+
+
+def history_settings():
+    return {
+        'CACHE': 'default',
+        'TOKEN_BUDGET': 2000,
+        'DIGEST_TOKENS': 300,
+        'TTL': 24 * 3600,
+        **getattr(settings, 'CHAT_HISTORY', {}),
+    }
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text; close enough for budgeting
+    return len(text) // 4 + 1
+
+
+def first_sentence(text, max_chars=200):
+    # Markdown markers add tokens but no meaning to a digest line
+    text = ' '.join(text.replace('*', '').replace('#', '').split())
+    sentence = SENTENCE_END.split(text, maxsplit=1)[0]
+    if len(sentence) > max_chars:
+        sentence = sentence[:max_chars].rsplit(' ', 1)[0] + '...'
+    return sentence
+
+
+class ChatHistory:
+    def __init__(self, chat_id, digest=None, turns=None):
+        self.chat_id = chat_id
+        self.digest = digest or []
+        self.turns = turns or []
+        self.options = history_settings()
+
+    @property
+    def cache_key(self):
+        return f'chat-history:{self.chat_id}'
+
+    @classmethod
+    def for_session(cls, session):
+        chat_id = session.get(SESSION_KEY)
+        if chat_id is None:
+            chat_id = session[SESSION_KEY] = uuid.uuid4().hex
+        history = cls(chat_id)
+        history._restore(caches[history.options['CACHE']].get(history.cache_key))
+        return history
+
+    @classmethod
+    async def afor_session(cls, session):
+        chat_id = await session.aget(SESSION_KEY)
+        if chat_id is None:
+            chat_id = uuid.uuid4().hex
+            await session.aset(SESSION_KEY, chat_id)
+        history = cls(chat_id)
+        history._restore(await caches[history.options['CACHE']].aget(history.cache_key))
+        return history
+
+    def _restore(self, stored):
+        if stored:
+            self.digest = stored['digest']
+            self.turns = stored['turns']
+
+    def _stored(self):
+        return {'digest': self.digest, 'turns': self.turns}
+
+    def save(self):
+        caches[self.options['CACHE']].set(self.cache_key, self._stored(), self.options['TTL'])
+
+    async def asave(self):
+        await caches[self.options['CACHE']].aset(self.cache_key, self._stored(), self.options['TTL'])
+
+    def clear(self):
+        self.digest = []
+        self.turns = []
+        caches[self.options['CACHE']].delete(self.cache_key)
+
+    def add(self, role, text):
+        self.turns.append({'role': role, 'text': text})
+        self._compact()
+
+    def _compact(self):
+        budget = self.options['TOKEN_BUDGET']
+        # Always keep the newest exchange verbatim, however long it is
+        while len(self.turns) > 2 and sum(estimate_tokens(turn['text']) for turn in self.turns) > budget:
+            turn = self.turns.pop(0)
+            speaker = 'Farmer' if turn['role'] == 'user' else 'Assistant'
+            self.digest.append(f'{speaker}: {first_sentence(turn["text"])}')
+            # Gemini expects the verbatim turns to open with a user message
+            if self.turns and self.turns[0]['role'] != 'user':
+                turn = self.turns.pop(0)
+                self.digest.append(f'Assistant: {first_sentence(turn["text"])}')
+        while len(self.digest) > 1 and sum(estimate_tokens(line) for line in self.digest) > self.options['DIGEST_TOKENS']:
+            self.digest.pop(0)
+
+    def is_first_question(self):
+        """True when the only turn is the user's opening message, so the reply depends on nothing else."""
+        return not self.digest and len(self.turns) == 1 and self.turns[0]['role'] == 'user'
+
+    def messages(self):
+        """The turns to send to the LLM, preceded by the digest of older turns when there is one."""
+        if not self.digest:
+            return list(self.turns)
+        summary = 'Summary of our earlier conversation:\n' + '\n'.join(f'- {line}' for line in self.digest)
+        return [
+            {'role': 'user', 'text': summary},
+            {'role': 'model', 'text': 'Noted, I will keep that context in mind.'},
+        ] + self.turns
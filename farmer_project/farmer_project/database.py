@@ -0,0 +1,50 @@
+"""SQLite configuration for running the site under concurrent load.
+
+Every new connection switches the database to WAL (readers no longer block
+the writer), relaxes fsync to once per checkpoint, and waits up to
+``busy_timeout`` ms for a lock instead of failing at once. Transactions are
+started ``IMMEDIATE``, so a request that will write takes the write lock when
+its transaction begins instead of upgrading a read lock halfway through,
+which is what made concurrent session writes fail with "database is locked".
+Connections are kept open for ``CONN_MAX_AGE`` seconds and health-checked
+before reuse, so a request does not pay to reconnect and rerun the pragmas.
+That only holds under WSGI: ``asgi.py`` defaults ``DB_CONN_MAX_AGE`` to 0,
+since a connection left open by one of its worker threads is never reused or
+closed by the others.
+"""
+import os
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'temp_store': 'MEMORY',
+    'cache_size': -20000,        # KiB (about 20 MB of page cache per connection)
+    'mmap_size': 134217728,      # 128 MB of memory-mapped reads
+}
+
+
+def init_command(pragmas):
+    return ''.join(f'PRAGMA {name}={value};' for name, value in pragmas.items())
+
+
+def sqlite_database(path, conn_max_age=None, pragmas=None):
+    """Return a ``DATABASES`` entry for the SQLite file at ``path``."""
+    pragmas = {**PRAGMAS, **(pragmas or {})}
+    if conn_max_age is None:
+        conn_max_age = int(os.getenv('DB_CONN_MAX_AGE', 600))
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': path,
+        'CONN_MAX_AGE': conn_max_age,
+        'CONN_HEALTH_CHECKS': True,
+        # Tests get a file as well: the default in-memory test database locks per table and fails
+        # at once where the site would wait for the write lock, so concurrency could not be tested
+        'TEST': {'NAME': os.path.join(os.path.dirname(path), 'test_' + os.path.basename(path))},
+        'OPTIONS': {
+            'init_command': init_command(pragmas),
+            'transaction_mode': 'IMMEDIATE',
+            # The driver's own lock wait, in seconds; kept in step with busy_timeout
+            'timeout': pragmas['busy_timeout'] / 1000,
+        },
+    }
@@ -0,0 +1,512 @@
+"""Chatbot LLM backends with streaming, bounded concurrency and timeouts.
+
+One backend instance is created per process on first use (``get_backend()``)
+and shared by every request, so the limits below apply to the whole process.
+The Gemini async client is bound to an event loop, so it is created once per
+loop (see ``GeminiBackend``). ``settings.CHATBOT['BACKEND']`` selects:
+
+* ``'gemini'`` - Google Gemini through the async ``generate_content_async``
+  streaming API; ``API_ENDPOINT`` points it at another (e.g. local fake) server.
+* ``'stub'`` - a local fake that streams a canned farming answer word by word,
+  for development and tests without network access or an API key.
+
+Every reply passes, in order, through:
+
+* a circuit breaker - after ``BREAKER_FAILURES`` consecutive upstream failures
+  calls fail fast with ``LLMUnavailable`` for ``BREAKER_RESET`` seconds, then a
+  single trial call decides whether to close it again;
+* token buckets - one per user (``USER_RATE_PER_MINUTE``/``USER_BURST``,
+  exceeding it raises ``LLMRateLimited``) and one for the whole process
+  (``GLOBAL_RATE_PER_MINUTE``/``GLOBAL_BURST``, waited on like the queue);
+* a bounded queue - at most ``MAX_CONCURRENCY`` streams run at once and at
+  most ``MAX_QUEUE`` wait, each for up to ``QUEUE_TIMEOUT`` seconds, before
+  ``LLMBusy`` is raised instead of piling up;
+* retries - quota and availability errors raised before the first chunk are
+  retried up to ``MAX_RETRIES`` times with exponential backoff and full jitter.
+
+A stream that waits more than ``CHUNK_TIMEOUT`` seconds for its next chunk
+(the first one included) or runs past ``TIMEOUT`` seconds is cancelled with
+``LLMTimeout``. ``stats()`` returns the counters for all of the above.
+"""
+import asyncio
+import random
+import threading
+import time
+import weakref
+from collections import Counter, OrderedDict
+from contextlib import aclosing
+
+from django.conf import settings
+
+from farmer_project import metrics
+
+SYSTEM_INSTRUCTION = (
+    "You are a helpful AI assistant specializing in crop diseases and farming suggestions. "
+    "Your primary goal is to assist farmers in identifying potential crop diseases based on their descriptions, "
+    "and to provide relevant suggestions for prevention, diagnosis, and treatment. "
+    "You should also offer general farming advice and best practices. "
+    "If a user asks a question that is irrelevant to crop diseases, farming, or agriculture, "
+    "gently steer them back to the topic or state that you can only assist with farming-related queries. "
+    "Always format your responses using Markdown for clarity and readability, including bullet points, bold text, and code blocks where appropriate. "
+    "Be concise but informative."
+)
+
+QUOTA_EXCEEDED_MESSAGE = "I'm sorry, I've exceeded my usage quota. Please try again later or contact support."
+
+
+class LLMError(Exception):
+    """A chat could not be answered; ``str(error)`` is safe to show to the user."""
+
+
+class LLMNotConfigured(LLMError):
+    pass
+
+
+class LLMBusy(LLMError):
+    pass
+
+
+class LLMTimeout(LLMError):
+    pass
+
+
+class LLMRateLimited(LLMError):
+    pass
+
+
+class LLMUnavailable(LLMError):
+    pass
+
+
+class UpstreamError(Exception):
+    """Retryable failure reported by a backend (quota exhausted, service unavailable)."""
+
+    def __init__(self, message, quota=False):
+        super().__init__(message)
+        self.quota = quota
+
+
+BUSY_MESSAGE = "The assistant is busy right now. Please try again in a moment."
+TIMEOUT_MESSAGE = "The assistant took too long to answer. Please try again."
+
+counters = Counter()
+_counters_lock = threading.Lock()
+
+
+def count(name, n=1):
+    with _counters_lock:
+        counters[name] += n
+
+
+def chat_settings():
+    return {
+        'BACKEND': 'gemini',
+        'MODEL': 'gemini-1.5-flash',
+        'API_ENDPOINT': None,
+        'MAX_CONCURRENCY': 8,
+        'QUEUE_TIMEOUT': 5.0,
+        'CHUNK_TIMEOUT': 15.0,
+        'TIMEOUT': 60.0,
+        'MAX_QUEUE': 32,
+        'USER_RATE_PER_MINUTE': 10,
+        'USER_BURST': 3,
+        'GLOBAL_RATE_PER_MINUTE': 60,
+        'GLOBAL_BURST': 10,
+        'MAX_RETRIES': 3,
+        'RETRY_BASE_DELAY': 0.5,
+        'RETRY_MAX_DELAY': 8.0,
+        'BREAKER_FAILURES': 5,
+        'BREAKER_RESET': 30.0,
+        'STUB_DELAY': 0.02,
+        'STUB_ERROR_RATE': 0.0,
+        **getattr(settings, 'CHATBOT', {}),
+    }
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute, burst):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Take a token and return 0, or return the seconds until one is available."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate if self.rate else float('inf')
+
+
+class UserBuckets:
+    """One ``TokenBucket`` per user, keeping only the most recently active ``max_users``."""
+
+    def __init__(self, rate_per_minute, burst, max_users=10000):
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.max_users = max_users
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, user_key):
+        with self._lock:
+            bucket = self._buckets.get(user_key)
+            if bucket is None:
+                bucket = self._buckets[user_key] = TokenBucket(self.rate_per_minute, self.burst)
+                if len(self._buckets) > self.max_users:
+                    self._buckets.popitem(last=False)
+            self._buckets.move_to_end(user_key)
+        return bucket.take()
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        """Return ``'closed'`` or ``'trial'`` when a call may proceed, None when it may not."""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return 'closed'
+            # Half open: let exactly one trial call through
+            if state == 'half_open' and not self.trial_running:
+                self.trial_running = True
+                return 'trial'
+            return None
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def release_trial(self):
+        # The trial call ended without an outcome (e.g. the client went away); let another one try
+        with self._lock:
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self.trial_running:
+                    count('circuit_opened')
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+
+class RequestQueue:
+    """Bounded wait for one of ``limit`` stream slots, shared across threads and event loops.
+
+    ``asyncio.Semaphore`` is tied to one event loop, but under WSGI every async
+    view runs on a loop of its own, so slots are counted behind a thread lock.
+    """
+
+    def __init__(self, limit, max_waiting):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.active = 0
+        self.waiting = 0
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, queued):
+        with self._lock:
+            if self.active < self.limit:
+                self.active += 1
+                if queued:
+                    self.waiting -= 1
+                return True
+            if not queued:
+                if self.waiting >= self.max_waiting:
+                    raise LLMBusy(BUSY_MESSAGE)
+                self.waiting += 1
+            return False
+
+    async def acquire(self, timeout):
+        if self._try_acquire(queued=False):
+            return
+        count('queued')
+        deadline = time.monotonic() + timeout
+        try:
+            while not self._try_acquire(queued=True):
+                if time.monotonic() >= deadline:
+                    raise LLMBusy(BUSY_MESSAGE)
+                await asyncio.sleep(0.05)
+        except BaseException:
+            with self._lock:
+                self.waiting -= 1
+            raise
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+
+class GeminiBackend:
+    """Gemini through ``generate_content_async``, with one async client per event loop.
+
+    The grpc.aio channel behind the async client belongs to the loop it was
+    created on. Under WSGI every ``async_to_sync`` call runs a loop of its own,
+    so sharing genai's process-wide default client fails with "Event loop is
+    closed" from the second chat on. The API key and endpoint are configured
+    once; the client is built on the running loop and dropped with it.
+    """
+
+    def __init__(self, api_key, model_name, api_endpoint=None):
+        import google.generativeai as genai
+        from google.generativeai.types import HarmBlockThreshold, HarmCategory
+
+        client_options = {'api_endpoint': api_endpoint} if api_endpoint else None
+        genai.configure(api_key=api_key, client_options=client_options)
+        self.model_name = model_name
+        self._models = weakref.WeakKeyDictionary()
+        self._models_lock = threading.Lock()
+        self.safety_settings = {
+            HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+        }
+
+    def model_for_running_loop(self):
+        import google.generativeai as genai
+        from google.generativeai.client import _client_manager
+
+        loop = asyncio.get_running_loop()
+        with self._models_lock:
+            model = self._models.get(loop)
+            if model is None:
+                model = genai.GenerativeModel(self.model_name, system_instruction=SYSTEM_INSTRUCTION)
+                # A fresh client instead of genai's cached default, which is bound to the first loop
+                model._async_client = _client_manager.make_client('generative_async')
+                self._models[loop] = model
+        return model
+
+    async def stream(self, messages):
+        import google.api_core.exceptions
+
+        contents = [{'role': msg['role'], 'parts': [msg['text']]} for msg in messages]
+        try:
+            response = await self.model_for_running_loop().generate_content_async(
+                contents, safety_settings=self.safety_settings, stream=True,
+            )
+            async for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+        except google.api_core.exceptions.ResourceExhausted as e:
+            print(f"Quota Exceeded Error: {e}")
+            raise UpstreamError(str(e), quota=True)
+        except (google.api_core.exceptions.ServiceUnavailable, google.api_core.exceptions.InternalServerError,
+                google.api_core.exceptions.DeadlineExceeded) as e:
+            raise UpstreamError(str(e))
+
+
+class StubBackend:
+    """Fake LLM: streams a fixed Markdown answer that quotes the question.
+
+    With ``error_rate`` > 0 that fraction of calls fails like an exhausted
+    Gemini quota, to exercise the retry and circuit breaker paths offline.
+    """
+
+    def __init__(self, delay=0.02, error_rate=0.0):
+        self.delay = delay
+        self.error_rate = error_rate
+
+    async def stream(self, messages):
+        if self.error_rate and random.random() < self.error_rate:
+            await asyncio.sleep(self.delay)
+            raise UpstreamError("Stub quota exhausted", quota=True)
+        question = messages[-1]['text'] if messages else ''
+        answer = (
+            f"**You asked:** {question}\n\n"
+            "- Check the leaves and stems for spots, wilting or discoloration.\n"
+            "- Keep soil moisture even and avoid waterlogging.\n"
+            "- Rotate crops each season to break disease cycles.\n"
+        )
+        for word in answer.split(' '):
+            await asyncio.sleep(self.delay)
+            yield word + ' '
+
+
+_backend = None
+_queue = None
+_breaker = None
+_user_buckets = None
+_global_bucket = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Return the process-wide backend, creating it (and its limits) on first use."""
+    global _backend, _queue, _breaker, _user_buckets, _global_bucket
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                options = chat_settings()
+                _queue = RequestQueue(options['MAX_CONCURRENCY'], options['MAX_QUEUE'])
+                _breaker = CircuitBreaker(options['BREAKER_FAILURES'], options['BREAKER_RESET'])
+                _user_buckets = UserBuckets(options['USER_RATE_PER_MINUTE'], options['USER_BURST'])
+                _global_bucket = TokenBucket(options['GLOBAL_RATE_PER_MINUTE'], options['GLOBAL_BURST'])
+                if options['BACKEND'] == 'stub':
+                    _backend = StubBackend(options['STUB_DELAY'], options['STUB_ERROR_RATE'])
+                elif settings.GEMINI_API_KEY:
+                    print(f"Gemini API Key loaded: {settings.GEMINI_API_KEY[:4]}...{settings.GEMINI_API_KEY[-4:]}")
+                    _backend = GeminiBackend(settings.GEMINI_API_KEY, options['MODEL'], options['API_ENDPOINT'])
+                else:
+                    print("GEMINI_API_KEY not found in settings. Gemini chatbot will not function.")
+                    raise LLMNotConfigured("Chatbot is not configured. Please check GEMINI_API_KEY.")
+    return _backend
+
+
+UNAVAILABLE_MESSAGE = "The assistant is temporarily unavailable. Please try again in a minute."
+
+
+async def _admit(user_key, options):
+    """Apply the rate limits; raises an ``LLMError`` when the call may not go ahead."""
+    if _breaker.state == 'open':
+        count('circuit_rejected')
+        raise LLMUnavailable(UNAVAILABLE_MESSAGE)
+    if user_key is not None and _user_buckets.take(user_key):
+        count('user_rate_limited')
+        raise LLMRateLimited("You're sending messages too quickly. Please wait a moment and try again.")
+    # The global budget is waited on like the queue, so short bursts are smoothed rather than rejected
+    deadline = time.monotonic() + options['QUEUE_TIMEOUT']
+    while (wait := _global_bucket.take()):
+        if time.monotonic() + wait > deadline:
+            count('global_rate_limited')
+            raise LLMBusy(BUSY_MESSAGE)
+        await asyncio.sleep(wait)
+
+
+async def _stream_once(backend, messages, deadline, chunk_timeout):
+    chunks = backend.stream(messages)
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LLMTimeout(TIMEOUT_MESSAGE)
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), min(remaining, chunk_timeout))
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                raise LLMTimeout(TIMEOUT_MESSAGE)
+            yield chunk
+    finally:
+        await chunks.aclose()
+
+
+async def stream_reply(messages, user_key=None):
+    """Yield the reply to ``messages`` (``[{'role', 'text'}]``) chunk by chunk.
+
+    ``user_key`` identifies the user for the per-user rate limit. Raises
+    ``LLMError`` subclasses for missing configuration, rate limits, saturation,
+    an open circuit, timeouts and exhausted retries; other backend exceptions
+    propagate unchanged.
+    """
+    start = time.perf_counter()
+    outcome = 'failed'
+    try:
+        async with aclosing(_stream_reply(messages, user_key)) as chunks:
+            async for chunk in chunks:
+                yield chunk
+        outcome = 'completed'
+    except LLMError as e:
+        outcome = type(e).__name__
+        raise
+    except (GeneratorExit, asyncio.CancelledError):
+        outcome = 'cancelled'
+        raise
+    finally:
+        metrics.record('llm', time.perf_counter() - start, metrics.llm_duration, outcome)
+
+
+async def _stream_reply(messages, user_key):
+    backend = get_backend()
+    options = chat_settings()
+    count('requests')
+    await _admit(user_key, options)
+    await _queue.acquire(options['QUEUE_TIMEOUT'])
+    admitted = None
+    try:
+        # Checked again once a slot is free; in the half-open state this claims the single trial call
+        admitted = _breaker.allow()
+        if admitted is None:
+            count('circuit_rejected')
+            raise LLMUnavailable(UNAVAILABLE_MESSAGE)
+        deadline = time.monotonic() + options['TIMEOUT']
+        attempt = 0
+        while True:
+            started = False
+            chunks = _stream_once(backend, messages, deadline, options['CHUNK_TIMEOUT'])
+            try:
+                async for chunk in chunks:
+                    started = True
+                    yield chunk
+            except UpstreamError as e:
+                _breaker.record_failure()
+                count('upstream_errors')
+                # Full jitter: a random delay up to the exponential backoff step
+                delay = random.uniform(0, min(options['RETRY_MAX_DELAY'], options['RETRY_BASE_DELAY'] * 2 ** attempt))
+                if (started or attempt >= options['MAX_RETRIES'] or _breaker.state != 'closed'
+                        or time.monotonic() + delay >= deadline):
+                    count('failed')
+                    raise LLMError(QUOTA_EXCEEDED_MESSAGE if e.quota else UNAVAILABLE_MESSAGE)
+                attempt += 1
+                count('retries')
+                await asyncio.sleep(delay)
+                continue
+            except LLMTimeout:
+                _breaker.record_failure()
+                count('timeouts')
+                raise
+            except Exception:
+                _breaker.record_failure()
+                count('failed')
+                raise
+            finally:
+                await chunks.aclose()
+            _breaker.record_success()
+            count('completed')
+            return
+    finally:
+        if admitted == 'trial':
+            _breaker.release_trial()
+        _queue.release()
+
+
+async def generate_reply(messages, user_key=None):
+    """Collect the whole streamed reply; for callers that cannot stream."""
+    return ''.join([chunk async for chunk in stream_reply(messages, user_key)])
+
+
+def stats():
+    """Counters plus the current queue and circuit breaker state, for monitoring."""
+    with _counters_lock:
+        result = dict(counters)
+    if _backend is not None:
+        result.update({
+            'active': _queue.active,
+            'waiting': _queue.waiting,
+            'circuit_state': _breaker.state,
+        })
+    return result
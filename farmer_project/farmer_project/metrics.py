@@ -0,0 +1,243 @@
+"""In-process request metrics, exposed in the Prometheus text format at /metrics.
+
+``MetricsMiddleware`` times every request into a latency histogram labelled
+by view name, method and status, and counts the database queries it ran
+through an execute wrapper installed on every new connection. Code that does
+expensive work reports it with ``timed(name, histogram)``: model inference
+(``crop.model_registry``) and LLM calls (``farmer_project.llm``) use it. The
+same timings are summed per request and, with ``SERVER_TIMING`` on, sent
+back in a ``Server-Timing`` header that browser dev tools display.
+
+Collectors registered with ``register_collector`` add the ``stats()`` of the
+prediction cache, chat response cache and LLM client as extra series at
+scrape time. Metrics are per process: scrape each worker, or sum them.
+"""
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'cropwise'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+def metrics_settings():
+    return {
+        'ENABLED': True,
+        'SERVER_TIMING': False,
+        'TOKEN': None,
+        **getattr(settings, 'METRICS', {}),
+    }
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value))
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, labelnames=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 2)
+            # Counts are stored per bucket and made cumulative when rendered
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((labelvalues, list(series)) for labelvalues, series in self._series.items())
+        for labelvalues, series in items:
+            labels = list(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(labels + [("le", _format_value(bound))])} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(labels + [("le", "+Inf")])} {series[-1]}')
+            lines.append(f'{self.name}_sum{_format_labels(labels)} {series[-2]!r}')
+            lines.append(f'{self.name}_count{_format_labels(labels)} {series[-1]}')
+        return lines
+
+
+request_duration = Histogram(
+    f'{PREFIX}_http_request_duration_seconds', 'Time to produce a response (first byte for streams).',
+    labelnames=('view', 'method', 'status'),
+)
+request_queries = Histogram(
+    f'{PREFIX}_db_queries_per_request', 'Database queries run while handling a request.',
+    buckets=QUERY_COUNT_BUCKETS, labelnames=('view',),
+)
+query_duration = Histogram(f'{PREFIX}_db_query_duration_seconds', 'Duration of single database queries.')
+inference_duration = Histogram(
+    f'{PREFIX}_inference_duration_seconds', 'Crop model scoring time per call.', labelnames=('path',),
+)
+llm_duration = Histogram(
+    f'{PREFIX}_llm_call_duration_seconds', 'Chatbot LLM call time, admission to last chunk.', labelnames=('outcome',),
+)
+HISTOGRAMS = [request_duration, request_queries, query_duration, inference_duration, llm_duration]
+
+_collectors = {}
+
+
+def register_collector(name, stats):
+    """Publish the numeric values of ``stats()`` as ``cropwise_<name>_<key>`` at every scrape."""
+    _collectors[name] = stats
+
+
+def _render_collectors():
+    lines = []
+    for name, stats in sorted(_collectors.items()):
+        try:
+            values = stats()
+        except Exception:
+            logger.exception("Metrics collector %s failed", name)
+            continue
+        for key, value in sorted(values.items()):
+            metric = f'{PREFIX}_{name}_{key}'
+            lines.append(f'# TYPE {metric} untyped')
+            if isinstance(value, (bool, int, float)):
+                lines.append(f'{metric} {float(value)!r}')
+            else:
+                # States such as the circuit breaker's are exposed as a labelled constant
+                lines.append(f'{metric}{_format_labels([("value", value)])} 1.0')
+    return lines
+
+
+def render():
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    lines.extend(_render_collectors())
+    return '\n'.join(lines) + '\n'
+
+
+class RequestTimings:
+    """Time spent per kind of work (db, inference, llm...) while handling one request."""
+
+    def __init__(self):
+        self.durations = {}
+        self.counts = {}
+
+    def add(self, name, seconds):
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def server_timing(self, total):
+        entries = [f'total;dur={total * 1000:.1f}']
+        for name, seconds in self.durations.items():
+            entries.append(f'{name};dur={seconds * 1000:.1f};desc="{self.counts[name]}x"')
+        return ', '.join(entries)
+
+
+# The timings of the request being handled; copied into sync_to_async/async_to_sync calls
+current_timings = contextvars.ContextVar('current_timings', default=None)
+
+
+def record(name, seconds, histogram=None, *labelvalues):
+    """Add ``seconds`` to ``histogram`` (if given) and to the current request's timings as ``name``."""
+    if histogram is not None:
+        histogram.observe(seconds, *labelvalues)
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+@contextmanager
+def timed(name, histogram=None, *labelvalues):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start, histogram, *labelvalues)
+
+
+def record_query(execute, sql, params, many, context):
+    with timed('db', query_duration):
+        return execute(sql, params, many, context)
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_wrapper, dispatch_uid='metrics-query-wrapper')
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.options = metrics_settings()
+        # Connections opened before this module was imported
+        for connection in connections.all(initialized_only=True):
+            install_query_wrapper(None, connection)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.options['ENABLED']:
+            return self.get_response(request)
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        if not self.options['ENABLED']:
+            return await self.get_response(request)
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - start)
+
+    def finish(self, request, response, timings, total):
+        match = request.resolver_match
+        # Label by route name rather than path so the number of series stays bounded
+        view = (match.view_name if match else None) or 'unmatched'
+        request_duration.observe(total, view, request.method, response.status_code)
+        request_queries.observe(timings.counts.get('db', 0), view)
+        if self.options['SERVER_TIMING']:
+            response['Server-Timing'] = timings.server_timing(total)
+        return response
@@ -12,12 +12,21 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import sys
 from dotenv import load_dotenv
 
+from farmer_project.database import sqlite_database
+
 load_dotenv()
 BASE_DIR = Path(__file__).resolve().parent.parent
+# ML/ holds the training script and the NumPy-only inference helpers used when serving
+ML_DIR = BASE_DIR.parent / 'ML'
+if str(ML_DIR) not in sys.path:
+    sys.path.append(str(ML_DIR))
 
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+# Bearer token for scripted access to /api/recommendation/batch/ (session login works too)
+BATCH_API_TOKEN = os.getenv('BATCH_API_TOKEN')
 SECRET_KEY = 'django-insecure-5jzcdftfdhvzcmek4!l%@u5w&b68cw&7xqd%j&wdotx$+*xh7i'
 DEBUG = True
 
@@ -35,6 +44,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'crop',
     'farmer',
+    'jobs',
 ]
 
 LOGIN_REDIRECT_URL = '/'
@@ -42,6 +52,7 @@ LOGOUT_REDIRECT_URL = '/'
 
 
 MIDDLEWARE = [
+    'farmer_project.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -75,11 +86,10 @@ WSGI_APPLICATION = 'farmer_project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# WAL mode, IMMEDIATE transactions and persistent connections; see farmer_project/database.py.
+# DB_CONN_MAX_AGE=0 closes the connection after every request; asgi.py makes that the default under ASGI.
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': sqlite_database(BASE_DIR / 'db.sqlite3'),
 }
 
 
@@ -124,6 +134,194 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Batch recommendation API limits
+BATCH_PREDICTION_MAX_ROWS = int(os.getenv('BATCH_PREDICTION_MAX_ROWS', 100000))
+BATCH_PREDICTION_MAX_BYTES = 50 * 1024 * 1024
+
+# Crop prediction artifacts. They are loaded on first use and reloaded when
+# model_version.json in DIR changes (checked at most every CHECK_INTERVAL seconds).
+# MMAP_MODE is passed to joblib.load. sklearn rebuilds its trees in private memory on
+# load, so it only saves copying plain NumPy arrays stored in the pickle, not worker RSS.
+# COMPACT serves the quantized model from `crop_prediction.py compress` instead, when present.
+CROP_MODEL = {
+    'DIR': Path(os.getenv('CROP_MODEL_DIR', BASE_DIR)),
+    'MMAP_MODE': os.getenv('CROP_MODEL_MMAP_MODE') or None,
+    'COMPACT': os.getenv('CROP_MODEL_COMPACT', '').lower() in ('1', 'true', 'yes'),
+    'CHECK_INTERVAL': 5.0,
+}
+
+# Recommendations served from the form are stored with the model version, and farmers can
+# report the crop they actually grew. Reports are appended to the columnar log in LOG_DIR,
+# which `crop_prediction.py retrain --feedback-dir` reads (default: CROP_MODEL['DIR']/feedback).
+FEEDBACK = {
+    'ENABLED': True,
+    'LOG_DIR': Path(os.getenv('FEEDBACK_LOG_DIR', CROP_MODEL['DIR'] / 'feedback')),
+}
+
+# In-process cache of single-row predictions, keyed on inputs rounded to PRECISION
+# decimal places per feature. Set MAX_SIZE to 0 to disable.
+PREDICTION_CACHE = {
+    'MAX_SIZE': int(os.getenv('PREDICTION_CACHE_MAX_SIZE', 10000)),
+    'TTL': 3600,
+    'PRECISION': {'N': 0, 'P': 0, 'K': 0, 'temperature': 1, 'humidity': 0, 'ph': 1, 'rainfall': 0},
+}
+
+# Chatbot LLM. BACKEND is 'gemini' or 'stub' (a local fake that needs no network or API key;
+# STUB_ERROR_RATE makes that fraction of its calls fail like an exhausted quota).
+# API_ENDPOINT points the Gemini client at another server. Limits are per process:
+# - at most MAX_CONCURRENCY replies stream at once and MAX_QUEUE more wait up to QUEUE_TIMEOUT seconds;
+# - each user may start USER_RATE_PER_MINUTE replies (bursts of USER_BURST), everyone together
+#   GLOBAL_RATE_PER_MINUTE (bursts of GLOBAL_BURST);
+# - quota/availability errors are retried MAX_RETRIES times with jittered exponential backoff
+#   (RETRY_BASE_DELAY doubling up to RETRY_MAX_DELAY seconds);
+# - BREAKER_FAILURES consecutive failures stop calls to Gemini for BREAKER_RESET seconds.
+# A reply is cut off after CHUNK_TIMEOUT seconds without output or TIMEOUT seconds in total.
+CHATBOT = {
+    'BACKEND': os.getenv('CHATBOT_BACKEND', 'gemini'),
+    'MODEL': 'gemini-1.5-flash',
+    'API_ENDPOINT': os.getenv('GEMINI_API_ENDPOINT') or None,
+    'MAX_CONCURRENCY': int(os.getenv('CHATBOT_MAX_CONCURRENCY', 8)),
+    'MAX_QUEUE': 32,
+    'QUEUE_TIMEOUT': 5.0,
+    'USER_RATE_PER_MINUTE': 10,
+    'USER_BURST': 3,
+    'GLOBAL_RATE_PER_MINUTE': int(os.getenv('CHATBOT_GLOBAL_RATE_PER_MINUTE', 60)),
+    'GLOBAL_BURST': 10,
+    'MAX_RETRIES': 3,
+    'RETRY_BASE_DELAY': 0.5,
+    'RETRY_MAX_DELAY': 8.0,
+    'BREAKER_FAILURES': 5,
+    'BREAKER_RESET': 30.0,
+    'CHUNK_TIMEOUT': 15.0,
+    'TIMEOUT': 60.0,
+    'STUB_DELAY': 0.02,
+    'STUB_ERROR_RATE': float(os.getenv('CHATBOT_STUB_ERROR_RATE', 0.0)),
+}
+
+# 'chat' is shared by every worker process, so a conversation survives being
+# served by different workers; the in-process default cache is not. 'pages' holds the
+# Crop Information version stamp and rendered cards, which every worker (and run_jobs,
+# whose thumbnail jobs save articles) must agree on.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'chat': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CHAT_CACHE_DIR', BASE_DIR / '.cache' / 'chat'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('SESSION_CACHE_DIR', BASE_DIR / '.cache' / 'sessions'),
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+    'pages': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('PAGE_CACHE_DIR', BASE_DIR / '.cache' / 'pages'),
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+
+# Load the model and response cache while the app registry starts instead of on the first
+# request; for preforking servers (gunicorn --preload). The LLM client is not fork-safe, so
+# workers still create it on first use. See farmer_project/warmup.py.
+WARMUP_ON_START = os.getenv('WARMUP_ON_START', '').lower() in ('1', 'true', 'yes')
+
+# Request latency, DB query, inference and LLM histograms served at /metrics (per process).
+# SERVER_TIMING adds a Server-Timing header to every response; TOKEN, when set, is required
+# as "Authorization: Bearer <token>" to read /metrics.
+METRICS = {
+    'ENABLED': True,
+    'SERVER_TIMING': os.getenv('SERVER_TIMING', str(DEBUG)).lower() in ('1', 'true', 'yes'),
+    'TOKEN': os.getenv('METRICS_TOKEN'),
+}
+
+# Sessions are read through the file-based 'sessions' cache and written to the database
+# (cached_db), so a cache wipe or MAX_ENTRIES culling never logs anyone out. SESSION_BACKEND=cache
+# opts into cache-only sessions, which write nothing to the database but are lost when their
+# file is culled; db is Django's default and signed_cookies keeps the session in the cookie.
+# Expired sessions are removed in batches by `python manage.py purge_sessions`.
+SESSION_ENGINES = {
+    'cache': 'django.contrib.sessions.backends.cache',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'db': 'django.contrib.sessions.backends.db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+SESSION_ENGINE = SESSION_ENGINES[os.getenv('SESSION_BACKEND', 'cached_db')]
+SESSION_CACHE_ALIAS = 'sessions'
+
+# Crop information is listed PAGE_SIZE articles at a time. Rendered pages are cached for
+# CACHE_TIMEOUT seconds in CACHE, keyed by a version stamp reset whenever an article is
+# saved or deleted. The stamp is also the pages' ETag, so CACHE must be shared by every
+# process that serves or saves articles; a per-process cache keeps answering 304 for stale pages.
+LEARNING_CONTENT_PAGES = {
+    'PAGE_SIZE': 24,
+    'CACHE': 'pages',
+    'CACHE_TIMEOUT': 600,
+}
+
+# LearningContent images get WIDTH-pixel WebP and JPEG thumbnails, made by WORKERS background
+# threads after an upload (BACKGROUND=False makes them inline, e.g. for scripts).
+LEARNING_CONTENT_THUMBNAILS = {
+    'WIDTH': 640,
+    'JPEG_QUALITY': 82,
+    'WEBP_QUALITY': 80,
+    'WORKERS': 1,
+    'BACKGROUND': True,
+    # Queue a 'thumbnails' job for `manage.py run_jobs` instead of using in-process threads
+    'QUEUE': os.getenv('THUMBNAIL_QUEUE', '').lower() in ('1', 'true', 'yes'),
+}
+
+# Chat turns are kept verbatim within TOKEN_BUDGET (estimated) tokens; older ones are
+# folded into a digest of at most DIGEST_TOKENS. Histories expire after TTL seconds idle.
+CHAT_HISTORY = {
+    'CACHE': 'chat',
+    'TOKEN_BUDGET': 2000,
+    'DIGEST_TOKENS': 300,
+    'TTL': 24 * 3600,
+}
+
+# Per-process cache of answers to a chat's opening question. Repeats are matched exactly
+# after normalization. Setting SIMILARITY (e.g. 0.85) also serves near-duplicates by cosine
+# similarity of hashed bag-of-words vectors, when they name the same crops, nutrients and
+# numbers; it is off by default. MAX_SIZE=0 turns the cache off.
+CHAT_RESPONSE_CACHE = {
+    'MAX_SIZE': int(os.getenv('CHAT_RESPONSE_CACHE_MAX_SIZE', 2000)),
+    'TTL': 6 * 3600,
+    'SIMILARITY': None,
+}
+
+# Chatbot grounding in LearningContent. The TOP_K passages scoring at least MIN_SCORE (BM25)
+# are added to the prompt; "tell me about <crop>" questions are answered from the article
+# directly (first DIRECT_ANSWER_WORDS words) when it outscores every other article by
+# DIRECT_ANSWER_MARGIN times.
+CHATBOT_RETRIEVAL = {
+    'ENABLED': True,
+    'TOP_K': 3,
+    'MIN_SCORE': 1.0,
+    'PASSAGE_WORDS': 80,
+    'DIRECT_ANSWERS': True,
+    'DIRECT_ANSWER_MARGIN': 1.2,
+    'DIRECT_ANSWER_WORDS': 120,
+}
+
+# Background jobs, run by `python manage.py run_jobs` with WORKERS threads. LIMITS caps how
+# many jobs of a kind run at once across all workers; jobs still running after STALE_AFTER
+# seconds are taken to have lost their worker, checked every RECOVER_INTERVAL seconds.
+# Bulk-scoring uploads and results live in DIR.
+JOBS = {
+    'WORKERS': 2,
+    'POLL_INTERVAL': 1.0,
+    'LIMITS': {'retrain': 1, 'bulk_score': 1, 'thumbnails': 2},
+    'STALE_AFTER': 6 * 3600,
+    'RECOVER_INTERVAL': 60.0,
+    'RETRAIN_TIMEOUT': 3600,
+    'DIR': Path(os.getenv('JOBS_DIR', BASE_DIR / 'job_files')),
+    'BULK_SCORE_WORKERS': 1,
+    'BULK_SCORE_MAX_BYTES': 500 * 1024 * 1024,
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
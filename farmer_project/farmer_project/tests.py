@@ -0,0 +1,417 @@
+import asyncio
+import json
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from farmer_project import llm, views
+from farmer_project.chat_cache import ResponseCache, key_terms
+from farmer_project.chat_history import ChatHistory, estimate_tokens, first_sentence
+
+STUB_CHATBOT = {
+    'BACKEND': 'stub',
+    'STUB_DELAY': 0,
+    'MAX_CONCURRENCY': 1,
+    'MAX_QUEUE': 1,
+    'QUEUE_TIMEOUT': 0.2,
+    'USER_RATE_PER_MINUTE': 60,
+    'USER_BURST': 2,
+    'GLOBAL_RATE_PER_MINUTE': 6000,
+    'GLOBAL_BURST': 100,
+    'MAX_RETRIES': 2,
+    'RETRY_BASE_DELAY': 0,
+    'RETRY_MAX_DELAY': 0,
+    'BREAKER_FAILURES': 3,
+    'BREAKER_RESET': 60.0,
+}
+
+MESSAGES = [{'role': 'user', 'text': 'Why are my tomato leaves yellow?'}]
+
+RICE_QUESTION = "What is the best fertilizer schedule for rice grown in clay soil during the monsoon season?"
+
+
+class ResponseCacheTests(SimpleTestCase):
+    def test_exact_hit_after_normalization(self):
+        cache = ResponseCache()
+        cache.set("Why are my tomato leaves yellow?", 'answer')
+        self.assertEqual(cache.get("  why are MY tomato leaves yellow "), 'answer')
+        self.assertEqual(cache.stats()['exact_hits'], 1)
+
+    def test_near_duplicates_are_off_by_default(self):
+        cache = ResponseCache()
+        cache.set("rice leaves turning yellow", 'answer')
+        self.assertIsNone(cache.get("yellow leaves on rice"))
+
+    def test_near_duplicate_hit(self):
+        cache = ResponseCache(similarity=0.85)
+        cache.set("rice leaves turning yellow", 'answer')
+        self.assertEqual(cache.get("yellow leaves on rice"), 'answer')
+        self.assertEqual(cache.stats()['similar_hits'], 1)
+
+    def test_near_duplicate_must_name_the_same_crop(self):
+        cache = ResponseCache(similarity=0.85)
+        cache.set(RICE_QUESTION, 'rice answer')
+        self.assertIsNone(cache.get(RICE_QUESTION.replace('rice', 'wheat')))
+
+    def test_near_duplicate_must_name_the_same_nutrient(self):
+        cache = ResponseCache(similarity=0.85)
+        cache.set("How much nitrogen should I apply to maize in sandy loam soil before sowing?", 'maize answer')
+        self.assertIsNone(cache.get("How much potassium should I apply to cotton in sandy loam soil before sowing?"))
+        self.assertIsNone(cache.get("How much potassium should I apply to maize in sandy loam soil before sowing?"))
+
+    def test_near_duplicate_must_have_the_same_numbers(self):
+        cache = ResponseCache(similarity=0.85)
+        cache.set("Is a soil pH of 5 too acidic for growing potatoes in raised beds?", 'answer')
+        self.assertIsNone(cache.get("Is a soil pH of 8 too acidic for growing potatoes in raised beds?"))
+
+    def test_key_terms(self):
+        self.assertEqual(key_terms("Tomatoes need 20 kg of Nitrogen"), {'tomato', '20', 'nitrogen'})
+
+    def test_expired_entries_are_not_served(self):
+        cache = ResponseCache(ttl=-1, similarity=0.85)
+        cache.set("rice leaves turning yellow", 'answer')
+        self.assertIsNone(cache.get("rice leaves turning yellow"))
+        self.assertIsNone(cache.get("yellow leaves on rice"))
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_evicts_least_recently_used(self):
+        cache = ResponseCache(max_size=2)
+        cache.set("first question", 1)
+        cache.set("second question", 2)
+        cache.get("first question")
+        cache.set("third question", 3)
+        self.assertEqual(cache.get("first question"), 1)
+        self.assertIsNone(cache.get("second question"))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+
+@override_settings(CHAT_HISTORY={'CACHE': 'default', 'TOKEN_BUDGET': 60, 'DIGEST_TOKENS': 30})
+class ChatHistoryTests(SimpleTestCase):
+    def turn_text(self, n):
+        # About 20 tokens, so three turns fill the budget; the first sentence is what the digest keeps
+        return f"Message {n} is here. More detail about the field and the weather this week."
+
+    def test_recent_turns_stay_within_the_token_budget(self):
+        history = ChatHistory('chat')
+        for n in range(10):
+            history.add('user' if n % 2 == 0 else 'model', self.turn_text(n))
+            self.assertLessEqual(sum(estimate_tokens(turn['text']) for turn in history.turns), 60)
+            self.assertEqual(history.turns[0]['role'], 'user')
+        self.assertTrue(history.digest)
+        self.assertLessEqual(sum(estimate_tokens(line) for line in history.digest), 30)
+        self.assertEqual(history.digest[-1], 'Assistant: Message 7 is here.')
+
+    def test_first_verbatim_turn_is_a_user_message(self):
+        history = ChatHistory('chat')
+        history.add('user', 'Short question.')
+        history.add('model', self.turn_text(1))
+        history.add('user', self.turn_text(2))
+        history.add('model', self.turn_text(3))
+        # Dropping the first user turn would leave a model turn in front; it is folded in too
+        self.assertEqual([turn['role'] for turn in history.turns], ['user', 'model'])
+        self.assertEqual(history.digest, ['Farmer: Short question.', 'Assistant: Message 1 is here.'])
+        messages = history.messages()
+        self.assertEqual([message['role'] for message in messages], ['user', 'model', 'user', 'model'])
+        self.assertIn('- Farmer: Short question.', messages[0]['text'])
+
+    def test_newest_exchange_is_kept_however_long(self):
+        history = ChatHistory('chat')
+        history.add('user', 'word ' * 500)
+        history.add('model', 'word ' * 500)
+        self.assertEqual(len(history.turns), 2)
+        self.assertEqual(history.digest, [])
+
+    def test_first_question(self):
+        history = ChatHistory('chat')
+        history.add('user', 'Hello')
+        self.assertTrue(history.is_first_question())
+        history.add('model', 'Hi')
+        history.add('user', 'And now?')
+        self.assertFalse(history.is_first_question())
+
+    def test_saved_under_the_session_chat_id(self):
+        session = {}
+        history = ChatHistory.for_session(session)
+        history.add('user', 'Hello')
+        history.save()
+        self.assertEqual(ChatHistory.for_session(session).turns, [{'role': 'user', 'text': 'Hello'}])
+        history.clear()
+        self.assertEqual(ChatHistory.for_session(session).turns, [])
+        self.assertEqual(ChatHistory.for_session({}).turns, [])
+
+    def test_first_sentence(self):
+        self.assertEqual(first_sentence("**Water** early. Then mulch."), 'Water early.')
+        self.assertEqual(first_sentence('word ' * 100, max_chars=20), 'word word word word...')
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_burst_then_wait(self):
+        bucket = llm.TokenBucket(rate_per_minute=60, burst=2)
+        self.assertEqual(bucket.take(), 0)
+        self.assertEqual(bucket.take(), 0)
+        wait = bucket.take()
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 1.0)
+
+    def test_refills_over_time(self):
+        bucket = llm.TokenBucket(rate_per_minute=60, burst=1)
+        with mock.patch('farmer_project.llm.time.monotonic', return_value=1000.0):
+            bucket.updated = 1000.0
+            self.assertEqual(bucket.take(), 0)
+            self.assertGreater(bucket.take(), 0)
+        with mock.patch('farmer_project.llm.time.monotonic', return_value=1001.0):
+            self.assertEqual(bucket.take(), 0)
+
+    def test_zero_rate_never_refills(self):
+        bucket = llm.TokenBucket(rate_per_minute=0, burst=0)
+        self.assertEqual(bucket.take(), float('inf'))
+
+    def test_user_buckets_are_separate_and_bounded(self):
+        buckets = llm.UserBuckets(rate_per_minute=60, burst=1, max_users=2)
+        self.assertEqual(buckets.take('a'), 0)
+        self.assertGreater(buckets.take('a'), 0)
+        self.assertEqual(buckets.take('b'), 0)
+        # A third user evicts the least recently active one, which starts over with a full bucket
+        self.assertEqual(buckets.take('c'), 0)
+        self.assertNotIn('a', buckets._buckets)
+        self.assertEqual(buckets.take('a'), 0)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_opens_after_consecutive_failures(self):
+        breaker = llm.CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'closed')
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertIsNone(breaker.allow())
+
+    def test_success_resets_the_failure_count(self):
+        breaker = llm.CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_half_open_allows_one_trial(self):
+        breaker = llm.CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'half_open')
+        self.assertEqual(breaker.allow(), 'trial')
+        self.assertIsNone(breaker.allow())
+        breaker.release_trial()
+        self.assertEqual(breaker.allow(), 'trial')
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+        self.assertEqual(breaker.allow(), 'closed')
+
+    def test_failed_trial_opens_again(self):
+        breaker = llm.CircuitBreaker(failure_threshold=5, reset_timeout=60)
+        for _ in range(5):
+            breaker.record_failure()
+        breaker.opened_at -= 60
+        self.assertEqual(breaker.allow(), 'trial')
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+
+
+class RequestQueueTests(SimpleTestCase):
+    def test_waits_for_a_free_slot(self):
+        queue = llm.RequestQueue(limit=1, max_waiting=1)
+
+        async def scenario():
+            await queue.acquire(1.0)
+            waiter = asyncio.ensure_future(queue.acquire(1.0))
+            await asyncio.sleep(0.01)
+            self.assertEqual(queue.waiting, 1)
+            queue.release()
+            await waiter
+            self.assertEqual((queue.active, queue.waiting), (1, 0))
+
+        async_to_sync(scenario)()
+
+    def test_busy_when_the_wait_list_is_full(self):
+        queue = llm.RequestQueue(limit=1, max_waiting=0)
+
+        async def scenario():
+            await queue.acquire(1.0)
+            with self.assertRaises(llm.LLMBusy):
+                await queue.acquire(1.0)
+
+        async_to_sync(scenario)()
+        self.assertEqual(queue.waiting, 0)
+
+    def test_busy_after_the_queue_timeout(self):
+        queue = llm.RequestQueue(limit=1, max_waiting=1)
+
+        async def scenario():
+            await queue.acquire(1.0)
+            with self.assertRaises(llm.LLMBusy):
+                await queue.acquire(0.1)
+
+        async_to_sync(scenario)()
+        self.assertEqual((queue.active, queue.waiting), (1, 0))
+
+
+@override_settings(CHATBOT=STUB_CHATBOT)
+class StubBackendReplyTests(SimpleTestCase):
+    """``stream_reply`` end to end against the stub backend, with fresh process-wide limits per test."""
+
+    def setUp(self):
+        llm._backend = None
+        llm.counters.clear()
+        self.addCleanup(setattr, llm, '_backend', None)
+
+    def reply(self, user_key=None):
+        return async_to_sync(llm.generate_reply)(MESSAGES, user_key)
+
+    def test_streams_the_stub_answer(self):
+        self.assertIn("**You asked:** Why are my tomato leaves yellow?", self.reply())
+        stats = llm.stats()
+        self.assertEqual(stats['completed'], 1)
+        self.assertEqual((stats['active'], stats['waiting'], stats['circuit_state']), (0, 0, 'closed'))
+
+    def test_user_rate_limit(self):
+        self.reply('farmer')
+        self.reply('farmer')
+        with self.assertRaises(llm.LLMRateLimited):
+            self.reply('farmer')
+        # Other users have buckets of their own
+        self.reply('neighbour')
+
+    def test_global_rate_limit_waits_within_the_queue_timeout(self):
+        with override_settings(CHATBOT={**STUB_CHATBOT, 'GLOBAL_RATE_PER_MINUTE': 600, 'GLOBAL_BURST': 1,
+                                        'QUEUE_TIMEOUT': 2.0}):
+            self.reply('farmer')
+            self.assertIn("You asked", self.reply('neighbour'))
+        self.assertEqual(llm.counters['global_rate_limited'], 0)
+
+    def test_global_rate_limit_is_busy_past_the_queue_timeout(self):
+        with override_settings(CHATBOT={**STUB_CHATBOT, 'GLOBAL_RATE_PER_MINUTE': 60, 'GLOBAL_BURST': 1}):
+            self.reply('farmer')
+            with self.assertRaises(llm.LLMBusy):
+                self.reply('neighbour')
+        self.assertEqual(llm.counters['global_rate_limited'], 1)
+
+    def test_counters_before_the_backend_exists(self):
+        llm.counters.clear()
+        self.assertEqual(llm.stats(), {})
+
+    def test_busy_when_every_slot_and_queue_place_is_taken(self):
+        llm.get_backend()
+        llm._queue.active = 1
+        llm._queue.waiting = 1
+        with self.assertRaises(llm.LLMBusy):
+            self.reply()
+
+    def test_retries_then_opens_the_circuit(self):
+        backend = llm.get_backend()
+        backend.error_rate = 1.0
+        with self.assertRaises(llm.LLMError) as raised:
+            self.reply()
+        self.assertEqual(str(raised.exception), llm.QUOTA_EXCEEDED_MESSAGE)
+        self.assertEqual(llm.counters['retries'], 2)
+        self.assertEqual(llm.stats()['circuit_state'], 'open')
+        self.assertEqual(llm.stats()['active'], 0)
+
+        # While open, calls fail fast without reaching the backend
+        with self.assertRaises(llm.LLMUnavailable):
+            self.reply()
+        self.assertEqual(llm.counters['upstream_errors'], 3)
+
+    def test_half_open_trial_closes_the_circuit(self):
+        backend = llm.get_backend()
+        backend.error_rate = 1.0
+        with self.assertRaises(llm.LLMError):
+            self.reply()
+        backend.error_rate = 0.0
+        llm._breaker.opened_at -= STUB_CHATBOT['BREAKER_RESET']
+        self.assertIn("You asked", self.reply())
+        self.assertEqual(llm.stats()['circuit_state'], 'closed')
+
+    def test_chunk_timeout(self):
+        llm.get_backend().delay = 0.5
+        with override_settings(CHATBOT={**STUB_CHATBOT, 'CHUNK_TIMEOUT': 0.05}):
+            with self.assertRaises(llm.LLMTimeout):
+                self.reply()
+        self.assertEqual(llm.counters['timeouts'], 1)
+
+
+@override_settings(CHATBOT=STUB_CHATBOT, CHAT_HISTORY={'CACHE': 'default'})
+class ChatbotStreamTests(TestCase):
+    """The ``chatbot_stream`` server-sent events view, against the stub backend."""
+
+    def setUp(self):
+        llm._backend = None
+        llm.counters.clear()
+        views._response_cache = None
+        self.addCleanup(setattr, llm, '_backend', None)
+        self.addCleanup(setattr, views, '_response_cache', None)
+        self.user = User.objects.create_user('streamer', password='pw')
+
+    async def stream(self, message=MESSAGES[0]['text']):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post('/chatbot/stream/', {'user_message': message})
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        return response, self.parse_events(body)
+
+    @staticmethod
+    def parse_events(body):
+        events = []
+        for block in body.split('\n\n'):
+            if not block:
+                continue
+            lines = dict(line.split(': ', 1) for line in block.split('\n'))
+            events.append((lines.get('event', 'message'), json.loads(lines['data'])))
+        return events
+
+    async def saved_turns(self):
+        history = await ChatHistory.afor_session(await self.async_client.asession())
+        return [(turn['role'], turn['text']) for turn in history.turns]
+
+    async def test_streams_text_then_done(self):
+        response, events = await self.stream()
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertEqual(events[-1], ('done', {}))
+        chunks = events[:-1]
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(event == 'message' and set(data) == {'text'} for event, data in chunks))
+        answer = ''.join(data['text'] for _, data in chunks)
+        self.assertIn('**You asked:** Why are my tomato leaves yellow?', answer)
+        self.assertEqual(await self.saved_turns(), [('user', MESSAGES[0]['text']), ('model', answer)])
+
+    async def test_repeated_opening_question_is_served_from_the_cache(self):
+        _, first = await self.stream()
+        await self.async_client.alogout()
+        _, events = await self.stream()
+        self.assertEqual(events[0][1]['cached'], True)
+        self.assertEqual(events[0][1]['text'], ''.join(data.get('text', '') for _, data in first))
+        self.assertEqual(events[1], ('done', {}))
+
+    async def test_llm_error_becomes_an_error_event(self):
+        llm.get_backend().error_rate = 1.0
+        _, events = await self.stream()
+        self.assertEqual(events, [('error', {'error': llm.QUOTA_EXCEEDED_MESSAGE})])
+        # The failed exchange is still recorded, so the next turn has its context
+        self.assertEqual(await self.saved_turns(), [
+            ('user', MESSAGES[0]['text']),
+            ('model', llm.QUOTA_EXCEEDED_MESSAGE),
+        ])
+
+    async def test_requires_login(self):
+        response = await self.async_client.post('/chatbot/stream/', {'user_message': 'hello'})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_rejects_an_empty_message(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post('/chatbot/stream/', {'user_message': '   '})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content), {'error': 'Message is empty.'})
+
+    async def test_only_post(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get('/chatbot/stream/')
+        self.assertEqual(response.status_code, 405)
@@ -29,5 +29,13 @@ urlpatterns = [
     path('logout/', views.logout_view, name='logout'),
     path('crop_information/', views.crop_information, name='crop_information'),
     path('recommendation/', views.recommendation, name='recommendation'),
+    path('recommendation/reports/', views.harvest_reports, name='harvest_reports'),
+    path('recommendation/<int:feedback_id>/feedback/', views.recommendation_feedback, name='recommendation_feedback'),
+    path('api/recommendation/batch/', views.batch_recommendation, name='batch_recommendation'),
+    path('api/recommendation/batch/jobs/', views.batch_recommendation_job, name='batch_recommendation_job'),
+    path('api/jobs/<int:job_id>/', views.job_status, name='job_status'),
+    path('api/jobs/<int:job_id>/result/', views.job_result, name='job_result'),
     path('chatbot/', views.chatbot, name='chatbot'),
+    path('chatbot/stream/', views.chatbot_stream, name='chatbot_stream'),
+    path('metrics', views.metrics_view, name='metrics'),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
@@ -1,118 +1,343 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
-from farmer.models import Farmer
-from crop.models import Crop, LearningContent
 from farmer.forms import CustomUserCreationForm, CustomAuthenticationForm
-from crop.prediction_views import get_crop_prediction_context
+from crop import content_pages
 from django.conf import settings
 from django.http import JsonResponse # Import JsonResponse
-import google.generativeai as genai
-from google.generativeai.types import HarmCategory, HarmBlockThreshold
-import google.api_core.exceptions # Import this for specific exception handling
-
-# Configure Gemini API
-if settings.GEMINI_API_KEY:
-    genai.configure(api_key=settings.GEMINI_API_KEY)
-    print(f"Gemini API Key loaded: {settings.GEMINI_API_KEY[:4]}...{settings.GEMINI_API_KEY[-4:]}")
-    model = genai.GenerativeModel(
-        'gemini-1.5-flash',
-        system_instruction=(
-            "You are a helpful AI assistant specializing in crop diseases and farming suggestions. "
-            "Your primary goal is to assist farmers in identifying potential crop diseases based on their descriptions, "
-            "and to provide relevant suggestions for prevention, diagnosis, and treatment. "
-            "You should also offer general farming advice and best practices. "
-            "If a user asks a question that is irrelevant to crop diseases, farming, or agriculture, "
-            "gently steer them back to the topic or state that you can only assist with farming-related queries. "
-            "Always format your responses using Markdown for clarity and readability, including bullet points, bold text, and code blocks where appropriate. "
-            "Be concise but informative."
-        )
-    )
-else:
-    model = None
-    print("GEMINI_API_KEY not found in settings. Gemini chatbot will not function.")
+from django.middleware.csrf import CsrfViewMiddleware, get_token
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_POST
+from django.urls import reverse
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.utils.functional import SimpleLazyObject
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from asgiref.sync import async_to_sync, sync_to_async
+from datetime import datetime, timezone
+import hashlib
+import hmac
+import json
+import threading
+import time
+from farmer_project import llm, metrics
+from farmer_project.chat_history import ChatHistory
 
+# NumPy, the model artifacts and the retrieval index are imported on first use by the views
+# that need them (or by `manage.py warmup`), so loading the URLconf stays cheap.
+metrics.register_collector('llm', llm.stats)
+
+# Answers to stand-alone questions, reused for exact (and optionally near-duplicate) repeats
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+def get_response_cache():
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                from farmer_project.chat_cache import ResponseCache
+                response_cache_settings = getattr(settings, 'CHAT_RESPONSE_CACHE', {})
+                _response_cache = ResponseCache(
+                    max_size=response_cache_settings.get('MAX_SIZE', 2000),
+                    ttl=response_cache_settings.get('TTL', 6 * 3600),
+                    similarity=response_cache_settings.get('SIMILARITY'),
+                )
+                metrics.register_collector('response_cache', _response_cache.stats)
+    return _response_cache
+
+# Templates only change with a deploy, which restarts the process
+STARTED_AT = time.time()
+
+def csrf_etag(request):
+    # Pages with forms embed the CSRF token, which changes on every login; a 304 would keep a stale one.
+    # get_token() masks the secret differently on each call, so the ETag uses a digest of the secret itself.
+    get_token(request)
+    return hashlib.sha256(request.META['CSRF_COOKIE'].encode()).hexdigest()[:16]
+
+def home_etag(request):
+    # The navbar differs for signed-in users and its logout form carries the CSRF token
+    return f'home-{STARTED_AT}-{request.user.pk or 0}-{csrf_etag(request)}'
+
+def home_last_modified(request):
+    return datetime.fromtimestamp(STARTED_AT, timezone.utc)
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=home_etag, last_modified_func=home_last_modified)
 def home(request):
-    farmers = Farmer.objects.all()
-    crops = Crop.objects.all()
-    context = {
-        'farmers': farmers,
-        'crops': crops
-    }
-    return render(request, 'home.html', context)
+    return render(request, 'home.html')
 
 @login_required(login_url='/login/')
 def recommendation(request):
+    from crop.prediction_views import get_crop_prediction_context
     context = get_crop_prediction_context(request)
     return render(request, 'recommendation.html', context)
 
+def has_batch_token(request):
+    token = settings.BATCH_API_TOKEN
+    auth_header = request.headers.get('Authorization', '')
+    return bool(token) and auth_header.startswith('Bearer ') and hmac.compare_digest(auth_header[len('Bearer '):], token)
+
+@login_required(login_url='/login/')
+@require_POST
+def recommendation_feedback(request, feedback_id):
+    # The farmer reports the crop they actually grew for one of their recommendations
+    from crop.feedback import FeedbackError, report_outcome
+    from crop.models import PredictionFeedback
+    from crop.prediction_views import ModelNotAvailable, registry
+    feedback = get_object_or_404(PredictionFeedback, pk=feedback_id, user=request.user)
+    try:
+        known_crops = {str(crop) for crop in registry.get().classes}
+        report_outcome(feedback, request.POST.get('actual_crop', ''), known_crops)
+    except ModelNotAvailable:
+        return HttpResponse('The model is not available; please try again later.', status=503, content_type='text/plain')
+    except FeedbackError as e:
+        return HttpResponse(str(e), status=400, content_type='text/plain')
+    # Reports sent from the pending list go back to it
+    next_url = request.POST.get('next', '')
+    if not url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
+        next_url = reverse('recommendation')
+    return redirect(next_url + '?feedback=saved')
+
 @login_required(login_url='/login/')
+def harvest_reports(request):
+    # Recommendations the farmer has not reported an outcome for yet, to fill in after the season
+    from crop.feedback import pending_reports
+    from crop.prediction_views import FORM_FIELDS, ModelNotAvailable, registry
+    try:
+        known_crops = sorted(str(crop) for crop in registry.get().classes)
+    except ModelNotAvailable:
+        known_crops = []
+    pending = [
+        {'feedback': feedback, 'inputs': dict(zip(FORM_FIELDS, feedback.features))}
+        for feedback in pending_reports(request.user)
+    ]
+    return render(request, 'harvest_reports.html', {'pending': pending, 'known_crops': known_crops})
+
+def authorize_batch_request(request):
+    # Return None when the request may use the batch API, otherwise the error response. The views
+    # are csrf_exempt for token-authenticated scripts, so session requests get the CSRF check here.
+    if settings.BATCH_API_TOKEN and request.headers.get('Authorization', '').startswith('Bearer '):
+        return None if has_batch_token(request) else JsonResponse({'error': 'Authentication required.'}, status=401)
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+    csrf_check = CsrfViewMiddleware(lambda request: None)
+    csrf_check.process_request(request)
+    if csrf_check.process_view(request, None, (), {}) is not None:
+        return JsonResponse({'error': 'CSRF verification failed.'}, status=403)
+    return None
+
+@csrf_exempt
+@require_POST
+def batch_recommendation(request):
+    from crop.prediction_views import BatchPredictionError, get_batch_prediction_context
+    rejected = authorize_batch_request(request)
+    if rejected is not None:
+        return rejected
+    try:
+        context = get_batch_prediction_context(request)
+    except BatchPredictionError as e:
+        return JsonResponse({'error': str(e)}, status=e.status)
+    return JsonResponse(context)
+
+@csrf_exempt
+@require_POST
+def batch_recommendation_job(request):
+    # Files too large to score within a request are queued for `manage.py run_jobs`
+    from jobs import queue
+    from jobs.handlers import save_bulk_input
+    rejected = authorize_batch_request(request)
+    if rejected is not None:
+        return rejected
+    max_bytes = queue.job_settings()['BULK_SCORE_MAX_BYTES']
+    if 'file' in request.FILES:
+        chunks = request.FILES['file'].chunks()
+    elif request.content_type == 'text/csv':
+        chunks = iter(lambda: request.read(1024 * 1024), b'')
+    else:
+        return JsonResponse({'error': 'Send a text/csv body or a multipart upload in the "file" field.'}, status=415)
+    try:
+        k = int(request.GET.get('k', 3))
+        if k < 1:
+            raise ValueError('k must be a positive integer.')
+        input_name = save_bulk_input(chunks, max_bytes)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    job = queue.enqueue('bulk_score', {'input': input_name, 'k': k}, user=request.user)
+    response = JsonResponse({**queue.status(job), 'status_url': reverse('job_status', args=[job.pk])}, status=202)
+    response['Location'] = reverse('job_status', args=[job.pk])
+    return response
+
+def get_visible_job(request, job_id):
+    # Jobs are visible to whoever queued them, staff, and scripts holding the batch token
+    from jobs.models import Job
+    job = get_object_or_404(Job, pk=job_id)
+    if has_batch_token(request):
+        return job
+    if request.user.is_authenticated and (request.user.is_staff or job.created_by_id == request.user.pk):
+        return job
+    return None
+
+def job_status(request, job_id):
+    from jobs import queue
+    job = get_visible_job(request, job_id)
+    if job is None:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+    status = queue.status(job)
+    if job.status == job.SUCCEEDED and job.kind == 'bulk_score':
+        status['result_url'] = reverse('job_result', args=[job.pk])
+    return JsonResponse(status)
+
+def job_result(request, job_id):
+    from jobs.handlers import job_file
+    job = get_visible_job(request, job_id)
+    if job is None:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+    if job.kind != 'bulk_score' or job.status != job.SUCCEEDED:
+        return JsonResponse({'error': 'No result file for this job.', 'status': job.status}, status=404)
+    try:
+        scored = open(job_file(job.result['output']), 'rb')
+    except FileNotFoundError:
+        return JsonResponse({'error': 'The result file has been removed.'}, status=410)
+    return FileResponse(scored, as_attachment=True, filename=f'scored-{job.pk}.csv', content_type='text/csv')
+
+def metrics_view(request):
+    # Prometheus scrape endpoint; with METRICS['TOKEN'] set, scrapers must send it as a bearer token
+    token = metrics.metrics_settings()['TOKEN']
+    if token and not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+        return HttpResponse('Authentication required.', status=401, content_type='text/plain')
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def crop_information_etag(request):
+    direction, cursor = content_pages.parse_cursor(request.GET)
+    return f'learning-{content_pages.version()}-{direction}-{cursor}-{request.user.pk}-{csrf_etag(request)}'
+
+def crop_information_last_modified(request):
+    return datetime.fromtimestamp(content_pages.version(), timezone.utc)
+
+@login_required(login_url='/login/')
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=crop_information_etag, last_modified_func=crop_information_last_modified)
 def crop_information(request):
-    contents = LearningContent.objects.all()
-    return render(request, 'crop_information.html', {'contents': contents})
+    direction, cursor = content_pages.parse_cursor(request.GET)
+    options = content_pages.page_settings()
+    context = {
+        # Only queried when the card fragment is not already cached
+        'page': SimpleLazyObject(lambda: content_pages.get_page(direction, cursor)),
+        'content_version': content_pages.version(),
+        'cursor': f'{direction}-{cursor}',
+        'cache_timeout': options['CACHE_TIMEOUT'],
+        'cache_alias': options['CACHE'],
+    }
+    return render(request, 'crop_information.html', context)
 
 @login_required(login_url='/login/')
 def chatbot(request):
+    from crop import retrieval
+    history = ChatHistory.for_session(request.session)
     if request.method == 'GET':
-        request.session['conversation_history'] = [] # Clear history on GET request (page refresh)
+        history.clear() # Clear history on GET request (page refresh)
 
-    conversation_history = request.session.get('conversation_history', [])
     user_message = None
     chatbot_response = None
 
     if request.method == 'POST':
         if 'clear_history' in request.POST:
-            request.session['conversation_history'] = []
+            history.clear()
             return redirect('chatbot')
 
         user_message = request.POST.get('user_message')
-        if user_message and model:
+        if user_message:
+            # Add user message to history
+            history.add('user', user_message)
+            # Only the first question of a chat is answerable without its context
+            cacheable = history.is_first_question()
+            # Simple crop-info questions are answered from LearningContent without calling the LLM
+            chatbot_response = retrieval.direct_answer(user_message)
+            if chatbot_response is None and cacheable:
+                chatbot_response = get_response_cache().get(user_message)
             try:
-                # Add user message to history
-                conversation_history.append({'role': 'user', 'text': user_message})
-
-                # Prepare messages for Gemini API
-                gemini_messages = []
-                for msg in conversation_history:
-                    gemini_messages.append({'role': msg['role'], 'parts': [msg['text']]})
-
-                print(f"Sending messages to Gemini: {gemini_messages}")
-                response = model.generate_content(
-                    gemini_messages,
-                    safety_settings={
-                        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-                        HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-                    },
-                )
-                chatbot_response = response.text
-                print(f"Received response from Gemini: {chatbot_response}")
-
-                # Add chatbot response to history
-                conversation_history.append({'role': 'model', 'text': chatbot_response})
-
-            except google.api_core.exceptions.ResourceExhausted as e:
-                print(f"Quota Exceeded Error: {e}")
-                chatbot_response = "I'm sorry, I've exceeded my usage quota. Please try again later or contact support."
-                conversation_history.append({'role': 'model', 'text': chatbot_response})
+                if chatbot_response is None:
+                    # Non-streaming fallback; the chat page itself uses chatbot_stream
+                    messages = retrieval.augment(history.messages())
+                    chatbot_response = async_to_sync(llm.generate_reply)(messages, request.user.pk)
+                    if cacheable:
+                        get_response_cache().set(user_message, chatbot_response)
+            except llm.LLMError as e:
+                chatbot_response = str(e)
             except Exception as e:
                 print(f"Exception during Gemini API call: {e}")
                 chatbot_response = f"Error communicating with the chatbot: {e}"
-                conversation_history.append({'role': 'model', 'text': chatbot_response})
-        elif not model:
-            print("Model is None. GEMINI_API_KEY might be missing or invalid.")
-            chatbot_response = "Chatbot is not configured. Please check GEMINI_API_KEY."
-            conversation_history.append({'role': 'model', 'text': chatbot_response})
+            # Add chatbot response to history
+            history.add('model', chatbot_response)
+            history.save()
 
-        request.session['conversation_history'] = conversation_history
         return JsonResponse({'chatbot_response': chatbot_response})
 
     context = {
-        'conversation_history': conversation_history,
+        'conversation_history': history.turns,
     }
     return render(request, 'chatbot.html', context)
 
+def sse_event(data, event=None):
+    prefix = f'event: {event}\n' if event else ''
+    return f'{prefix}data: {json.dumps(data)}\n\n'
+
+@require_POST
+async def chatbot_stream(request):
+    # Streams the reply as server-sent events: {"text": ...} chunks, then a "done" or "error" event
+    from crop import retrieval
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+    user_message = request.POST.get('user_message', '').strip()
+    if not user_message:
+        return JsonResponse({'error': 'Message is empty.'}, status=400)
+
+    # Only the chat id lives in the session; the turns are kept in the chat cache
+    history = await ChatHistory.afor_session(request.session)
+    history.add('user', user_message)
+
+    # Only the first question of a chat is answerable without its context
+    cacheable = history.is_first_question()
+    # Simple crop-info questions are answered from LearningContent without calling the LLM
+    cached_response = await sync_to_async(retrieval.direct_answer)(user_message)
+    if cached_response is None and cacheable:
+        cached_response = get_response_cache().get(user_message)
+    if cached_response is None:
+        # Ground the LLM in our own articles
+        messages = await sync_to_async(retrieval.augment)(history.messages())
+
+    async def events():
+        parts = []
+        try:
+            if cached_response is not None:
+                chatbot_response = cached_response
+                yield sse_event({'text': cached_response, 'cached': True})
+            else:
+                async for chunk in llm.stream_reply(messages, user.pk):
+                    parts.append(chunk)
+                    yield sse_event({'text': chunk})
+                chatbot_response = ''.join(parts)
+                if cacheable:
+                    get_response_cache().set(user_message, chatbot_response)
+            yield sse_event({}, event='done')
+        except llm.LLMError as e:
+            chatbot_response = str(e)
+            yield sse_event({'error': chatbot_response}, event='error')
+        except Exception as e:
+            print(f"Exception during Gemini API call: {e}")
+            chatbot_response = f"Error communicating with the chatbot: {e}"
+            yield sse_event({'error': chatbot_response}, event='error')
+        history.add('model', chatbot_response)
+        await history.asave()
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 def contact(request):
     return render(request, 'contact.html')
 
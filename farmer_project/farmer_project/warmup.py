@@ -0,0 +1,79 @@
+"""Load the heavy parts of the site ahead of the first request.
+
+The views import NumPy, the model artifacts, the Gemini client and the
+retrieval index only when first used, so workers and ``manage.py`` start
+fast. Preforking servers (``gunicorn --preload``) would rather pay that once
+in the parent so every worker inherits it: set ``WARMUP_ON_START=1`` to run
+``warmup(load_data=False, before_fork=True)`` from ``CropConfig.ready``, or
+run ``python manage.py warmup`` to time each step. Steps that read the
+database (``load_data=True``) are left out of ``ready()``, where queries are
+not allowed yet. So is the LLM client: gRPC channels and threads created
+before a fork are not usable in the children, so each worker creates its own
+on the first chat.
+"""
+import logging
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _prediction_model():
+    from crop.prediction_views import FEATURE_COLUMNS, registry
+    # One prediction also runs the NumPy/sklearn code paths a real request takes
+    registry.get().predict_top_k(np.zeros((1, len(FEATURE_COLUMNS))), 1)
+
+
+def _llm_client():
+    from farmer_project import llm
+    backend = llm.get_backend()
+    if isinstance(backend, llm.GeminiBackend):
+        import google.api_core.exceptions  # noqa: F401  (imported by the first stream otherwise)
+
+
+def _response_cache():
+    from farmer_project.views import get_response_cache
+    get_response_cache()
+
+
+def _content_index():
+    from crop.content_index import get_image_urls
+    get_image_urls()
+
+
+def _retrieval_index():
+    from crop import retrieval
+    retrieval.get_index()
+
+
+# (name, step, needs_database, fork_safe)
+STEPS = [
+    ('prediction_model', _prediction_model, False, True),
+    ('llm_client', _llm_client, False, False),
+    ('response_cache', _response_cache, False, True),
+    ('content_index', _content_index, True, True),
+    ('retrieval_index', _retrieval_index, True, True),
+]
+
+
+def warmup(load_data=True, before_fork=False):
+    """Run every warm-up step; return ``{step: milliseconds or error message}``.
+
+    ``before_fork=True`` skips the steps whose state must not be inherited by
+    forked workers.
+    """
+    results = {}
+    for name, step, needs_database, fork_safe in STEPS:
+        if (needs_database and not load_data) or (before_fork and not fork_safe):
+            continue
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            # A missing model or API key must not stop the server from starting
+            logger.exception("Warm-up step %s failed", name)
+            results[name] = f'failed: {e}'
+            continue
+        results[name] = round((time.perf_counter() - start) * 1000, 1)
+    return results
@@ -0,0 +1,18 @@
+from django.contrib import admin
+from django.utils import timezone
+
+from .models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'attempts', 'created_at', 'wait_seconds', 'run_seconds', 'worker')
+    list_filter = ('status', 'kind')
+    readonly_fields = ('result', 'error', 'attempts', 'worker', 'created_at', 'queued_at', 'started_at', 'finished_at')
+    actions = ['requeue']
+
+    @admin.action(description='Re-queue selected jobs')
+    def requeue(self, request, queryset):
+        queryset.exclude(status=Job.RUNNING).update(
+            status=Job.QUEUED, error='', queued_at=timezone.now(), started_at=None, finished_at=None,
+        )
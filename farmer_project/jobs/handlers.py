@@ -0,0 +1,120 @@
+"""The job kinds the site queues: retraining, thumbnails and bulk scoring.
+
+Handlers import what they need when they run, so registering them (from
+``JobsConfig.ready``) keeps startup cheap. Retraining runs
+``ML/crop_prediction.py`` (``train``, or ``retrain`` on the farmers'
+feedback with ``{"mode": "feedback"}``) in a child process writing to the
+serving model directory, which the model registry hot-reloads once the new
+``model_version.json`` lands. Bulk scoring reads a CSV saved under
+``JOBS['DIR']`` and writes the scored copy next to it with ``score_csv``.
+"""
+import json
+import os
+import subprocess
+import sys
+import uuid
+
+from django.conf import settings
+
+from jobs.queue import job_settings, register
+
+OUTPUT_TAIL_LINES = 20
+
+
+def job_file(name):
+    """Path of a file under ``JOBS['DIR']``; names from payloads never leave that directory."""
+    return os.path.join(job_settings()['DIR'], os.path.basename(name))
+
+
+def save_bulk_input(chunks, max_bytes):
+    """Write uploaded CSV ``chunks`` to a new file under ``JOBS['DIR']``; return its name."""
+    os.makedirs(job_settings()['DIR'], exist_ok=True)
+    name = f'bulk-{uuid.uuid4().hex}.csv'
+    path = job_file(name)
+    size = 0
+    try:
+        with open(path, 'wb') as f:
+            for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ValueError(f"Upload exceeds {max_bytes} bytes.")
+                f.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    if size == 0:
+        os.remove(path)
+        raise ValueError("No rows to score.")
+    return name
+
+
+@register('retrain')
+def retrain(job):
+    options = job.payload
+    model_dir = str(getattr(settings, 'CROP_MODEL', {}).get('DIR', settings.BASE_DIR))
+    script = os.path.join(settings.ML_DIR, 'crop_prediction.py')
+    if options.get('mode') == 'feedback':
+        # Warm-start the current model on the outcomes reported since it was trained
+        from crop.feedback import feedback_settings
+        command = [
+            sys.executable, script, 'retrain', '--output-dir', model_dir,
+            '--feedback-dir', str(feedback_settings()['LOG_DIR']),
+            '--min-rows', str(int(options.get('min_rows', 1))),
+        ]
+    else:
+        command = [
+            sys.executable, script, 'train',
+            '--output-dir', model_dir, '--n-jobs', str(int(options.get('n_jobs', 1))),
+        ]
+        if options.get('search'):
+            command.append('--search')
+        if options.get('objective'):
+            command += ['--objective', str(options['objective'])]
+
+    completed = subprocess.run(
+        command, cwd=settings.ML_DIR, capture_output=True, text=True,
+        timeout=job_settings().get('RETRAIN_TIMEOUT', 3600),
+    )
+    output = (completed.stdout + completed.stderr).strip().splitlines()[-OUTPUT_TAIL_LINES:]
+    if completed.returncode != 0:
+        raise RuntimeError(f"Training exited with status {completed.returncode}: " + '\n'.join(output))
+
+    from model_artifacts import VERSION_FILENAME
+    with open(os.path.join(model_dir, VERSION_FILENAME)) as f:
+        version = json.load(f)['version']
+    return {'version': version, 'output': output}
+
+
+@register('thumbnails')
+def make_thumbnails(job):
+    from crop import thumbnails
+    return {'updated': thumbnails.generate(job.payload['content_id'])}
+
+
+@register('bulk_score')
+def bulk_score(job):
+    from score_csv import score_csv
+
+    model_settings = getattr(settings, 'CROP_MODEL', {})
+    input_path = job_file(job.payload['input'])
+    output_name = f'bulk-{job.pk}-scored.csv'
+    try:
+        rows, seconds = score_csv(
+            input_path, job_file(output_name),
+            artifact_dir=str(model_settings.get('DIR', settings.BASE_DIR)),
+            engine='compact' if model_settings.get('COMPACT') else 'sklearn',
+            k=int(job.payload.get('k', 3)),
+            workers=job_settings().get('BULK_SCORE_WORKERS', 1),
+        )
+    except Exception:
+        # Keep the upload for the next attempt, if there is one
+        if job.attempts >= job.max_attempts:
+            os.remove(input_path)
+        raise
+    os.remove(input_path)
+    return {
+        'rows': rows,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(rows / max(seconds, 1e-9)),
+        'output': output_name,
+    }
@@ -0,0 +1,34 @@
+"""Queue a background job from the command line or cron.
+
+    python manage.py enqueue_job retrain
+    python manage.py enqueue_job retrain --payload '{"search": true, "n_jobs": -1}'
+
+Prints the job id; ``python manage.py run_jobs`` picks it up.
+"""
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from jobs import queue
+
+
+class Command(BaseCommand):
+    help = 'Queue a background job of the given kind and print its id.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', help='Job kind, e.g. retrain, thumbnails or bulk_score.')
+        parser.add_argument('--payload', default='{}', help='JSON object passed to the job handler.')
+        parser.add_argument('--max-attempts', type=int, default=1, help='Runs allowed before the job is failed.')
+
+    def handle(self, *args, **options):
+        try:
+            payload = json.loads(options['payload'])
+        except json.JSONDecodeError as e:
+            raise CommandError(f'--payload is not valid JSON: {e}')
+        if not isinstance(payload, dict):
+            raise CommandError('--payload must be a JSON object.')
+        try:
+            job = queue.enqueue(options['kind'], payload, max_attempts=options['max_attempts'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(str(job.pk))
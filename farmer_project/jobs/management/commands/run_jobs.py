@@ -0,0 +1,89 @@
+"""Run queued background jobs (retraining, thumbnails, bulk scoring).
+
+    python manage.py run_jobs
+    python manage.py run_jobs --workers 4 --kind bulk_score thumbnails
+    python manage.py run_jobs --burst
+
+Each of ``--workers`` threads claims the oldest queued job it may run (within
+``JOBS['LIMITS']``), runs it and records the result, then polls again every
+``POLL_INTERVAL`` seconds when the queue is empty. Several processes can run
+side by side against the same database. Every ``RECOVER_INTERVAL`` seconds
+jobs whose worker died are put back in the queue (see ``queue.recover_stale``).
+``--burst`` exits once nothing is
+left to claim, e.g. from cron. Ctrl-C stops claiming new jobs and waits for
+the running ones to finish.
+"""
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from jobs import queue
+
+
+class Command(BaseCommand):
+    help = 'Process queued background jobs until interrupted (or until the queue is empty with --burst).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help="Jobs run at once by this process (default: JOBS['WORKERS']).")
+        parser.add_argument('--kind', nargs='*', help='Only run jobs of these kinds.')
+        parser.add_argument('--burst', action='store_true', help='Exit when there is no job left to claim.')
+
+    def handle(self, *args, **options):
+        job_options = queue.job_settings()
+        workers = options['workers'] or job_options['WORKERS']
+        if workers < 1:
+            raise CommandError('--workers must be at least 1.')
+        unknown = set(options['kind'] or ()) - set(queue.HANDLERS)
+        if unknown:
+            raise CommandError(f"Unknown job kind(s): {', '.join(sorted(unknown))}")
+
+        self.recover()
+        self.stop = threading.Event()
+        threads = [
+            threading.Thread(target=self.work, args=(options['kind'], options['burst'], job_options['POLL_INTERVAL']),
+                             name=f'job-worker-{i}')
+            for i in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f'Running jobs with {workers} worker(s).')
+        next_recovery = time.monotonic() + job_options['RECOVER_INTERVAL']
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.5)
+                    if time.monotonic() >= next_recovery:
+                        self.recover()
+                        next_recovery = time.monotonic() + job_options['RECOVER_INTERVAL']
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping after the running jobs finish...')
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+
+    def recover(self):
+        try:
+            recovered = queue.recover_stale()
+        finally:
+            close_old_connections()
+        if recovered:
+            self.stdout.write(f'Recovered {recovered} stale job(s).')
+
+    def work(self, kinds, burst, poll_interval):
+        try:
+            while not self.stop.is_set():
+                job = queue.claim(kinds)
+                if job is None:
+                    if burst:
+                        return
+                    self.stop.wait(poll_interval)
+                    continue
+                # Measured here: a re-queued job no longer carries the times of the attempt that failed
+                waited, start = job.wait_seconds, time.monotonic()
+                job = queue.run(job)
+                self.stdout.write(f'{job}: {time.monotonic() - start:.2f}s after {waited:.2f}s queued')
+                close_old_connections()
+        finally:
+            close_old_connections()
@@ -0,0 +1,166 @@
+"""Database-backed queue for work too slow for a request.
+
+A view (or script) calls ``enqueue(kind, payload)`` and answers at once with
+the job's id; ``python manage.py run_jobs`` runs the handler registered for
+that kind with ``@register(kind)`` and stores its JSON result, or the error,
+on the ``Job`` row, which the status endpoint returns to pollers. No broker
+is needed: workers claim the job longest in the queue (``queued_at``, which a
+retry resets) inside a write transaction, so any number of worker processes
+and threads can share the table.
+
+``JOBS['LIMITS']`` caps how many jobs of a kind run at once across all
+workers, e.g. one retraining at a time. Counting the running jobs and
+claiming one must not interleave between workers: SQLite takes its write lock
+at BEGIN (see ``farmer_project.database``), and on databases with row locks
+the claim first locks the queued and running rows of the limited kinds. A job
+still ``running`` after ``STALE_AFTER`` seconds is assumed to have lost its
+worker: it is queued again while it has attempts left, otherwise failed. The
+workers check for those every ``RECOVER_INTERVAL`` seconds. Queue wait and
+run time are kept per job (``queued_at``/``started_at``/``finished_at``).
+"""
+import logging
+import os
+import socket
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from jobs.models import Job
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+
+def job_settings():
+    return {
+        'WORKERS': 2,
+        'POLL_INTERVAL': 1.0,
+        'LIMITS': {},
+        'STALE_AFTER': 6 * 3600,
+        'RECOVER_INTERVAL': 60.0,
+        'DIR': settings.BASE_DIR / 'job_files',
+        **getattr(settings, 'JOBS', {}),
+    }
+
+
+def register(kind):
+    """Decorator registering ``handler(job) -> JSON-serializable result`` for ``kind``."""
+    def decorator(handler):
+        HANDLERS[kind] = handler
+        return handler
+    return decorator
+
+
+def enqueue(kind, payload=None, user=None, max_attempts=1):
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind '{kind}'.")
+    return Job.objects.create(
+        kind=kind, payload=payload or {}, max_attempts=max_attempts,
+        created_by=user if user is not None and user.is_authenticated else None,
+    )
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}'
+
+
+def recover_stale():
+    """Re-queue (or fail, when out of attempts) jobs whose worker stopped; return how many."""
+    cutoff = timezone.now() - timedelta(seconds=job_settings()['STALE_AFTER'])
+    stale = Job.objects.filter(status=Job.RUNNING, started_at__lt=cutoff)
+    recovered = 0
+    for job in stale:
+        if job.attempts < job.max_attempts:
+            recovered += Job.objects.filter(pk=job.pk, status=Job.RUNNING).update(
+                status=Job.QUEUED, worker='', queued_at=timezone.now(), started_at=None,
+            )
+        else:
+            recovered += Job.objects.filter(pk=job.pk, status=Job.RUNNING).update(
+                status=Job.FAILED, finished_at=timezone.now(), error='Worker stopped before the job finished.',
+            )
+    return recovered
+
+
+def claim(kinds=None):
+    """Mark the oldest runnable queued job as running and return it, or None."""
+    limits = job_settings()['LIMITS']
+    kinds = set(kinds or HANDLERS)
+    with transaction.atomic():
+        limited = kinds & set(limits)
+        if limited:
+            # Serializes claimers of limited kinds where rows can be locked; a no-op on SQLite,
+            # whose write lock already covers the whole transaction
+            list(
+                Job.objects.select_for_update()
+                .filter(kind__in=limited, status__in=[Job.QUEUED, Job.RUNNING])
+                .order_by('id').values_list('id', flat=True)
+            )
+        running = dict(
+            Job.objects.filter(status=Job.RUNNING).values_list('kind').annotate(count=Count('id')).order_by()
+        )
+        available = [kind for kind in kinds if kind not in limits or running.get(kind, 0) < limits[kind]]
+        if not available:
+            return None
+        job = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=Job.QUEUED, kind__in=available)
+            .order_by('queued_at', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = Job.RUNNING
+        job.attempts += 1
+        job.worker = worker_name()
+        job.started_at = timezone.now()
+        job.finished_at = None
+        job.save(update_fields=['status', 'attempts', 'worker', 'started_at', 'finished_at'])
+    return job
+
+
+def run(job):
+    """Run a claimed job's handler and record the outcome; return the updated job."""
+    try:
+        result = HANDLERS[job.kind](job)
+    except Exception as e:
+        logger.exception("Job %s (%s) failed", job.pk, job.kind)
+        job.error = ''.join(traceback.format_exception_only(e)).strip()
+        job.result = None
+        if job.attempts < job.max_attempts:
+            # Back to the end of the queue; started/finished_at describe the attempt being waited for
+            job.status = Job.QUEUED
+            job.queued_at = timezone.now()
+            job.started_at = job.finished_at = None
+        else:
+            job.status = Job.FAILED
+            job.finished_at = timezone.now()
+    else:
+        job.status = Job.SUCCEEDED
+        job.result = result
+        job.error = ''
+        job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'result', 'error', 'started_at', 'finished_at', 'queued_at'])
+    return job
+
+
+def status(job):
+    """Return the JSON document served to pollers for ``job``."""
+    return {
+        'id': job.pk,
+        'kind': job.kind,
+        'status': job.status,
+        'attempts': job.attempts,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at and job.started_at.isoformat(),
+        'finished_at': job.finished_at and job.finished_at.isoformat(),
+        'wait_seconds': job.wait_seconds,
+        'run_seconds': job.run_seconds,
+        'result': job.result,
+        'error': job.error or None,
+    }
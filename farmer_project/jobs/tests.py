@@ -0,0 +1,160 @@
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock
+
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+from jobs import handlers, queue
+from jobs.models import Job
+
+
+class QueueTests(TransactionTestCase):
+    def setUp(self):
+        self.calls = []
+        queue.register('test_ok')(self.ok)
+        queue.register('test_flaky')(self.flaky)
+        self.addCleanup(queue.HANDLERS.pop, 'test_ok')
+        self.addCleanup(queue.HANDLERS.pop, 'test_flaky')
+
+    def ok(self, job):
+        self.calls.append(job.pk)
+        return {'done': job.pk}
+
+    def flaky(self, job):
+        self.calls.append(job.pk)
+        raise RuntimeError('boom')
+
+    def test_claims_oldest_first_and_records_the_result(self):
+        first = queue.enqueue('test_ok')
+        second = queue.enqueue('test_ok')
+        job = queue.run(queue.claim(['test_ok']))
+        self.assertEqual(job.pk, first.pk)
+        self.assertEqual((job.status, job.result, job.attempts), (Job.SUCCEEDED, {'done': first.pk}, 1))
+        self.assertGreaterEqual(job.wait_seconds, 0)
+        self.assertGreaterEqual(job.run_seconds, 0)
+        self.assertEqual(queue.claim(['test_ok']).pk, second.pk)
+        self.assertIsNone(queue.claim(['test_ok']))
+
+    def test_unknown_kind(self):
+        with self.assertRaises(ValueError):
+            queue.enqueue('no_such_kind')
+
+    def test_limits_cap_running_jobs_of_a_kind(self):
+        for _ in range(3):
+            queue.enqueue('test_ok')
+        other = queue.enqueue('test_flaky')
+        with override_settings(JOBS={**queue.job_settings(), 'LIMITS': {'test_ok': 1}}):
+            claimed = queue.claim(['test_ok'])
+            self.assertIsNotNone(claimed)
+            self.assertIsNone(queue.claim(['test_ok']))
+            # Other kinds are not held back by the limit
+            self.assertEqual(queue.claim(['test_ok', 'test_flaky']).pk, other.pk)
+            queue.run(claimed)
+            self.assertIsNotNone(queue.claim(['test_ok']))
+
+    def test_concurrent_claims_respect_limits(self):
+        for _ in range(4):
+            queue.enqueue('test_ok')
+        claimed = []
+        barrier = threading.Barrier(4)
+
+        def worker():
+            try:
+                barrier.wait()
+                job = queue.claim(['test_ok'])
+                if job is not None:
+                    claimed.append(job.pk)
+            finally:
+                connection.close()
+
+        with override_settings(JOBS={**queue.job_settings(), 'LIMITS': {'test_ok': 1}}):
+            threads = [threading.Thread(target=worker) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(claimed), 1)
+        self.assertEqual(Job.objects.filter(status=Job.RUNNING).count(), 1)
+
+    def test_failed_job_with_attempts_left_goes_to_the_back_of_the_queue(self):
+        flaky = queue.enqueue('test_flaky', max_attempts=2)
+        later = queue.enqueue('test_ok')
+        with self.assertLogs('jobs.queue', 'ERROR') as logs:
+            job = queue.run(queue.claim())
+        self.assertIn(f'Job {flaky.pk} (test_flaky) failed', logs.output[0])
+        self.assertEqual(job.pk, flaky.pk)
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIn('boom', job.error)
+        # The failed attempt's times are cleared, so the status never shows a negative wait
+        self.assertIsNone(job.started_at)
+        self.assertIsNone(job.wait_seconds)
+        self.assertIsNone(queue.status(job)['wait_seconds'])
+
+        self.assertEqual(queue.run(queue.claim()).pk, later.pk)
+        with self.assertLogs('jobs.queue', 'ERROR'):
+            job = queue.run(queue.claim())
+        self.assertEqual((job.pk, job.status, job.attempts), (flaky.pk, Job.FAILED, 2))
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(self.calls, [flaky.pk, later.pk, flaky.pk])
+
+    def test_recover_stale(self):
+        cutoff = timezone.now() - timedelta(seconds=queue.job_settings()['STALE_AFTER'] + 60)
+        retry = queue.enqueue('test_ok', max_attempts=2)
+        exhausted = queue.enqueue('test_ok')
+        fresh = queue.enqueue('test_ok')
+        Job.objects.filter(pk__in=[retry.pk, exhausted.pk]).update(status=Job.RUNNING, attempts=1, started_at=cutoff)
+        Job.objects.filter(pk=fresh.pk).update(status=Job.RUNNING, attempts=1, started_at=timezone.now())
+
+        self.assertEqual(queue.recover_stale(), 2)
+        retry.refresh_from_db()
+        exhausted.refresh_from_db()
+        fresh.refresh_from_db()
+        self.assertEqual((retry.status, retry.worker, retry.started_at), (Job.QUEUED, '', None))
+        self.assertEqual(exhausted.status, Job.FAILED)
+        self.assertEqual(fresh.status, Job.RUNNING)
+        self.assertEqual(queue.claim(['test_ok']).pk, retry.pk)
+
+
+class BulkScoreHandlerTests(TransactionTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_patch = override_settings(JOBS={**queue.job_settings(), 'DIR': directory.name})
+        settings_patch.enable()
+        self.addCleanup(settings_patch.disable)
+
+    def bulk_job(self, max_attempts):
+        name = handlers.save_bulk_input([b'N,P,K\n1,2,3\n'], max_bytes=1024)
+        job = queue.enqueue('bulk_score', {'input': name, 'k': 2}, max_attempts=max_attempts)
+        return queue.claim(['bulk_score']), handlers.job_file(name)
+
+    def test_failure_keeps_the_upload_for_a_retry(self):
+        job, path = self.bulk_job(max_attempts=2)
+        with mock.patch('score_csv.score_csv', side_effect=ValueError('Input is missing the column(s): humidity')), \
+                self.assertLogs('jobs.queue', 'ERROR'):
+            job = queue.run(job)
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIn('humidity', job.error)
+        self.assertTrue(os.path.exists(path))
+
+    def test_last_failure_removes_the_upload(self):
+        job, path = self.bulk_job(max_attempts=1)
+        with mock.patch('score_csv.score_csv', side_effect=ValueError('Input is missing the column(s): humidity')), \
+                self.assertLogs('jobs.queue', 'ERROR'):
+            job = queue.run(job)
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertFalse(os.path.exists(path))
+
+    def test_success_reports_the_output(self):
+        job, path = self.bulk_job(max_attempts=1)
+        with mock.patch('score_csv.score_csv', return_value=(1, 0.5)) as score:
+            job = queue.run(job)
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.result['rows'], 1)
+        self.assertEqual(job.result['output'], f'bulk-{job.pk}-scored.csv')
+        self.assertEqual(score.call_args.kwargs['k'], 2)
+        self.assertFalse(os.path.exists(path))